@@ -0,0 +1,759 @@
+'''
+    Benchmarks of the slow parts of the analysis.
+
+    benchmark_write_stats() times writing the results of every year in
+    results.csv: the original row by row csv writer against stats_rows() and
+    the results store of filmResults.py. The stats dictionaries and the
+    represented categories are rebuilt from results.csv so that the benchmark
+    runs on the full set of real results without repeating the analysis.
+    
+    benchmark_grouping() checks that the model of a year gives the same 
+    likelihood and posterior when its films are collapsed into groups by 
+    group_films() and times the sampling of the two.
+    
+    benchmark_records() times the scraper's path from the pages of a film to 
+    the data file and measures the memory of each film it holds, for the 
+    records of filmRecord.py and for the attributes of the original filmGrab.
+    The pages are made up by film_pages() in the layout of imdb.com that 
+    filmObtainItem.py parses, so no request is made to imdb.com.
+    
+    benchmark_pipeline() times each stage of the analysis, from the wrangling
+    to the plots, on a made up raw data file written by make_raw_data() at a 
+    chosen scale, so the pipeline can be timed without the real data or hours
+    of sampling. The times are saved as json and compared with those of an 
+    earlier run to find the stages that have become slower.
+    '''
+import numpy as np
+import pandas as pd
+#pymc, imported by filmModel, chooses an interactive backend when it is 
+#imported, so the plots are set to be saved to file before it is
+import matplotlib
+matplotlib.use('Agg')
+import argparse
+import bs4
+import codecs
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+DIRECTORY=sys.path[0]
+
+from filmMCMC import stats_rows, share_wrangled_data, attach_shared_data, \
+                     year_group, get_all_represented
+from filmModel import film_model_by_year, film_map_by_year, group_films, MCMC
+from filmResults import ResultsStore
+from filmObtainItem import parse_primary, parse_secondary
+from filmServer import film_pages
+from filmServer import countries as allCountries, languages as allLanguages, \
+                       genres as allGenres
+from filmRecord import filmRecord, RecordWriter, HEADER
+from filmWrangle import get_clean_data, get_unique, add_category_columns
+from filmMCMC import writeStats, get_represented
+from filmPlot import read_results as read_plot_results, plot_gaussian
+import matplotlib.pyplot as plt
+
+
+def read_results(fileName):
+    '''
+        Rebuilds the arguments of writeStats() for every year of a results csv
+        file.
+
+        Parameters
+        ----------
+
+        fileName: string
+            the csv file, as exported by ResultsStore.export_csv()
+
+        Returns
+        -------
+
+        list of tuples
+            for each year (stats, countrySame, countryDiff, languageSame,
+            languageDiff, genreSame, genreDiff, year, totalNumber). The
+            deviations of a year are split into the six categories by their
+            QSame, so categories with no entries may be merged with their
+            neighbours, which does not change what is written.
+
+        '''
+    df = pd.read_csv(fileName, encoding='utf-8', dtype={'QSame': str})
+    years = []
+    for year, group in df.groupby('date', sort=False):
+        year = str(year)
+        glob = group[group['category'] == 'Global'].iloc[0]
+        dev = group[group['category'] != 'Global']
+        stats = {year+'_global': {'mean': np.log10(glob['linMean']), \
+                    'standard deviation': np.log10(glob['linSD']), \
+                    '95% HPD interval': np.log10([glob['lin95Low'], \
+                                                  glob['lin95Hi']])}, \
+                 year+'_linDev': {'mean': dev['linMean'].values, \
+                    'standard deviation': dev['linSD'].values, \
+                    '95% HPD interval': np.array([dev['lin95Low'].values, \
+                                                  dev['lin95Hi'].values])}}
+        categories = []
+        same = dev['QSame'].values
+        position = 0
+        for flag in ['True', 'False'] * 3:
+            stop = position
+            while stop < len(same) and same[stop] == flag:
+                stop += 1
+            categories.append(np.array([[entry, str(number)] for entry, number \
+                in zip(dev['category'].values[position:stop], \
+                       dev['number'].values[position:stop])]))
+            position = stop
+        years.append(tuple([stats] + categories + [year, glob['number']]))
+    return years
+
+def legacy_write_stats(fileName, stats, countrySame, countryDiff, languageSame,\
+                       languageDiff, genreSame, genreDiff, year, totalNumber):
+    '''
+        The original writeStats() of filmMCMC.py, which reopens the file for
+        each year and writes one row at a time, kept for comparison
+        '''
+    with codecs.open(fileName, 'a', 'utf-8') as f:
+        year=str(year)
+        results = stats[year+'_global']
+        worldlinMean = str(10.**results['mean'])
+        worldlinSD = str(10.**results['standard deviation'])
+        worldlin95Low = str(10.**results['95% HPD interval'][0])
+        worldlin95Hi = str(10.**results['95% HPD interval'][1])
+        entry=np.array([year, 'Global', '-1', str(totalNumber), worldlinMean, \
+                        worldlinSD, worldlin95Low, worldlin95Hi])
+        f.write(','.join(entry) + '\n')
+        offset = 0
+        same = True
+        for category in [countrySame, countryDiff, languageSame, languageDiff, \
+                         genreSame, genreDiff]:
+            for i in range(len(category)):
+                position = offset+i
+                finding = stats[year+'_linDev']
+                mean = str(finding['mean'][position])
+                SD = str(finding['standard deviation'][position])
+                low95 = str(finding['95% HPD interval'][0][position])
+                hi95 = str(finding['95% HPD interval'][1][position])
+                entry = np.array([year, category[i][0], str(same), \
+                                  category[i][1], mean, SD, low95, hi95])
+                f.write(','.join(entry) + '\n')
+            offset = offset + len(category)
+            same = not same
+
+def benchmark_write_stats(fileName, repeat=3):
+    '''
+        Times writing every year of the results csv fileName by the legacy
+        writer, by stats_rows() alone and by stats_rows() followed by 
+        ResultsStore.write_year(), which filmMCMC.py leaves to a background 
+        thread, and times the export of the store to csv, which is done once at
+        the end of a run. Prints the best of repeat runs of each and checks 
+        that the legacy and the exported csv files have the same rows.
+        '''
+    years = read_results(fileName)
+    rows = sum([len(stats_rows(*args)) for args in years])
+    print 'writing %d rows of %d years from %s' %(rows, len(years), fileName)
+    directory = tempfile.mkdtemp()
+    try:
+        legacyName = os.path.join(directory, 'legacy.csv')
+        storeName = os.path.join(directory, 'results.db')
+        exportName = os.path.join(directory, 'results.csv')
+
+        def legacy():
+            with codecs.open(legacyName, 'w', 'utf-8') as f:
+                f.write('date,category,QSame,number,linMean,linSD,lin95Low,' \
+                        'lin95Hi\n')
+            for args in years:
+                legacy_write_stats(legacyName, *args)
+
+        def build():
+            for args in years:
+                stats_rows(*args)
+
+        def store():
+            results = ResultsStore(storeName)
+            for args in years:
+                results.write_year(int(args[7]), stats_rows(*args), '')
+            results.close()
+
+        def export():
+            results = ResultsStore(storeName)
+            results.export_csv(exportName)
+            results.close()
+
+        for name, function in [('legacy csv writer', legacy), \
+                               ('stats_rows', build), \
+                               ('stats_rows + store', store), \
+                               ('export_csv', export)]:
+            times = []
+            for i in range(repeat):
+                start = time.time()
+                function()
+                times.append(time.time() - start)
+            print '%-30s %8.3fs  %8.1f rows/ms' %(name, min(times), \
+                                                  rows / min(times) / 1000.)
+        #newer versions of numpy print more digits of the legacy writer's 
+        #numbers, so the two files are compared to 11 significant figures
+        legacyDf = pd.read_csv(legacyName, encoding='utf-8')
+        exportDf = pd.read_csv(exportName, encoding='utf-8')
+        numeric = ['number', 'linMean', 'linSD', 'lin95Low', 'lin95Hi']
+        same = legacyDf.shape == exportDf.shape and \
+                (legacyDf.drop(numeric, axis=1) == \
+                 exportDf.drop(numeric, axis=1)).all().all() and \
+                np.allclose(legacyDf[numeric].values, \
+                            exportDf[numeric].values, rtol=1e-11, atol=0.)
+        print 'legacy and exported csv files have the same rows: %s' %same
+    finally:
+        shutil.rmtree(directory)
+
+def benchmark_grouping(csvName, years, iter=200, seed=1):
+    '''
+        For each of years, fits film_model_by_year() to the films of the year 
+        and to their groups from group_films() and prints
+        
+        - the number of films and of groups and the time taken to group them
+        - the largest difference of the log likelihoods of the two models at 
+          ten random points, and the time taken by each to evaluate it
+        - the largest difference of the posterior modes and of the standard 
+          deviations of the Laplace approximation of film_map_by_year(), 
+          in units of the standard deviation. Being exact, these test the 
+          grouping without the noise of sampling.
+        - the time per iteration of pyMC2's sampler for each model, from a 
+          chain of iter iterations
+        
+        Parameters
+        ----------
+        
+        csvName: string
+            the wrangled data, film_wrangled.csv
+        
+        years: list of integers
+            the years to fit
+        
+        iter: integer
+            the length of the chains
+        
+        seed: integer
+            the seed of the random points and of the chains
+        
+        '''
+    directory = tempfile.mkdtemp()
+    try:
+        npyName = os.path.join(directory, 'film_wrangled.npy')
+        columns, ranges = share_wrangled_data(csvName, npyName)
+        attach_shared_data(npyName, columns)
+        for year, first, stop in ranges:
+            if year not in years:
+                continue
+            group = year_group(first, stop)
+            cou, lan, gen, num = get_all_represented(group)
+            start = time.time()
+            grouped = group_films(group, cou, lan, gen)
+            groupTime = time.time() - start
+            print 'year %d: %d films in %d groups, grouped in %.3fs' %(year, \
+                len(group), len(grouped), groupTime)
+            
+            #the log likelihood at random points
+            models = [film_model_by_year(str(year), group, cou, lan, gen, num),\
+                      film_model_by_year(str(year), grouped, cou, lan, gen, \
+                                         num, grouped=True)]
+            rng = np.random.RandomState(seed)
+            points = [(rng.normal(2., 0.05), rng.normal(0., 0.05, num - 3), \
+                       rng.uniform(0.05, 0.3)) for i in range(10)]
+            logp = np.empty((2, len(points)))
+            seconds = []
+            for i, model in enumerate(models):
+                start = time.time()
+                for j, (a, dev, sigma) in enumerate(points):
+                    model['globalAvg'].value = a
+                    model['category_deviation'].value = dev
+                    model['sigmaObs'].value = sigma
+                    logp[i, j] = model['obs'].logp
+                seconds.append((time.time() - start) / len(points))
+            print '    log likelihood difference %.2e (of %.4g), %.2fms ' \
+                'vs %.2fms per evaluation' %(np.abs(logp[0] - logp[1]).max(), \
+                np.abs(logp[0]).max(), seconds[0]*1e3, seconds[1]*1e3)
+            
+            #the posterior found from the normal equations, which do not 
+            #depend on the random numbers drawn, of the films and the groups
+            modes = [film_map_by_year(str(year), data, cou, lan, gen, num)[1] \
+                     for data in [group, grouped]]
+            sd = np.sqrt(np.diag(modes[0]['cov']))
+            shift = np.abs(modes[0]['mean'] - modes[1]['mean']) / sd
+            ratio = np.abs(np.log(np.sqrt(np.diag(modes[1]['cov'])) / sd))
+            print '    posterior modes differ by at most %.2e SDs, their SDs ' \
+                'by a factor of at most exp(%.2e)' %(shift.max(), ratio.max())
+            
+            #the time per iteration of pyMC2's sampler
+            seconds = []
+            for data, isGrouped in [(group, False), (grouped, True)]:
+                np.random.seed(seed)
+                mc = MCMC(film_model_by_year(str(year), data, cou, lan, gen, \
+                                             num, grouped=isGrouped))
+                start = time.time()
+                mc.sample(iter=iter, progress_bar=False)
+                seconds.append((time.time() - start) / iter)
+            print '    MCMC %.2fms vs %.2fms per iteration' %(seconds[0]*1e3, \
+                                                           seconds[1]*1e3)
+    finally:
+        shutil.rmtree(directory)
+
+class LegacyFilm(object):
+    '''
+        The attributes that the original filmGrab kept for each film, for 
+        comparison with filmRecord. As in filmGrab, the date is the string of
+        the primary page, which keeps the parsed page alive.
+        '''
+    def __init__(self, idnum, primaryPage, secondaryPage):
+        self.idnum = idnum
+        self.failed = False
+        date, self.name, self.time, self.country, self.language, \
+            self.genre = parse_primary(primaryPage)
+        self.date = primaryPage.h1.find("a").contents[0]
+        self.writer, self.director = parse_secondary(secondaryPage)[:2]
+        self.same = np.in1d(self.writer, self.director).any()
+        self.state = "all data gained"
+
+def legacy_line(i, filmObj):
+    '''the line of the data file written by the original success()'''
+    country = ', '.join(filmObj.country)
+    language = ', '.join(filmObj.language)
+    writer = ', '.join(filmObj.writer)
+    director = ', '.join(filmObj.director)
+    genre = ', '.join(filmObj.genre)
+    return "%d\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" %(i, filmObj.date, \
+        filmObj.name, str(filmObj.time), country, language, genre, writer, \
+        director, filmObj.same)
+
+def held_bytes(objects):
+    '''
+        Returns the number of bytes of the objects and of every object they
+        refer to, directly or not, counting each object once. Classes, 
+        functions and modules are shared by the whole program and are not 
+        counted.
+        '''
+    seen = set()
+    total = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, \
+                                                 types.FunctionType)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+def benchmark_records(number=2000, repeat=3, seed=1):
+    '''
+        Times the path from the pages of number made up films to the data file,
+        and the memory of the films held, for
+        
+        - the original filmGrab: the attributes of LegacyFilm, each film 
+          formatted and written on its own under a lock
+        - filmRecord: the records of grab_record(), written by RecordWriter
+        
+        and checks that the two write the same file, apart from the imdb ids
+        of the writers and directors which only the records have. The pages are parsed by
+        BeautifulSoup's html.parser in both, which is timed on its own. The 
+        memory of a film is the held_bytes() of the films divided by their 
+        number, so the names interned by filmRecord count once.
+        
+        Parameters
+        ----------
+        
+        number: integer
+            the number of films
+        
+        repeat: integer
+            the number of times each path is timed, the best time is printed
+        
+        seed: integer
+            the seed of film_pages()
+        
+        '''
+    rng = np.random.RandomState(seed)
+    pages = [film_pages(i, rng) for i in range(1, number + 1)]
+    print 'parsing and writing %d made up films' %number
+    
+    parse = lambda page: bs4.BeautifulSoup(page, 'html.parser')
+    
+    def soup():
+        return [(parse(primary), parse(credits)) for primary, credits in pages]
+    
+    def legacy(keep=False):
+        out = io.StringIO()
+        lock = threading.Lock()
+        films = []
+        for i, (primary, credits) in enumerate(pages):
+            film = LegacyFilm(i + 1, parse(primary), parse(credits))
+            lock.acquire()
+            out.write(legacy_line(i + 1, film))
+            lock.release()
+            if keep:
+                films.append(film)
+        return out, films
+    
+    def records(keep=False):
+        out = io.StringIO()
+        writer = RecordWriter(out, batchSize=200)
+        films = []
+        for i, (primary, credits) in enumerate(pages):
+            record = filmRecord(i + 1, *(parse_primary(parse(primary)) + \
+                                         parse_secondary(parse(credits))))
+            writer.add(record)
+            if keep:
+                films.append(record)
+        writer.flush()
+        return out, films
+    
+    for name, function in [('BeautifulSoup only', soup), \
+                           ('filmGrab attributes', legacy), \
+                           ('filmRecord + RecordWriter', records)]:
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            function()
+            times.append(time.time() - start)
+        print '%-30s %8.3fs  %8.1f films/s' %(name, min(times), \
+                                              number / min(times))
+    
+    for name, function in [('filmGrab attributes', legacy), \
+                           ('filmRecord', records)]:
+        films = function(keep=True)[1]
+        print '%-30s %8.0f bytes per film held' %(name, \
+                                                 held_bytes(films) / number)
+    withoutIds = lambda out: [line.split('\t')[:10] for line in \
+                              out.getvalue().splitlines()]
+    print 'the two write the same file: %s' %(withoutIds(legacy()[0]) == \
+                                              withoutIds(records()[0]))
+
+
+def make_raw_data(fileName, filmsPerYear=100, firstYear=1930, lastYear=2014, \
+                  numCountries=20, numLanguages=15, numGenres=12, overlap=0.3, \
+                  runtime=(95., 0.1), duplicates=0.01, seed=1):
+    '''
+        Writes a made up raw data file in the format of filmObtainDataset.py
+        and returns the number of films in it. 3% of the films are shorts, 
+        which are dropped by the wrangling.
+        
+        Parameters
+        ----------
+        
+        fileName: string
+            the raw data file
+        
+        filmsPerYear: integer
+            the number of films released in each year
+        
+        firstYear, lastYear: integers
+            the years of the films
+        
+        numCountries, numLanguages, numGenres: integers
+            the number of the names of categories.txt of each category that 
+            the films are drawn from, the first names drawn being the most 
+            common
+        
+        overlap: float
+            the fraction of the films in which a writer was also a director
+        
+        runtime: tuple
+            the median runtime in minutes and the standard deviation of the 
+            log10 of the runtime. Each country, language and genre and the 
+            overlap shift the log10 runtime a little.
+        
+        duplicates: float
+            the fraction of the films that are listed a second time under 
+            another id, with the title in capitals
+        
+        seed: integer
+            the seed of the random numbers
+        
+        '''
+    rng = np.random.RandomState(seed)
+    names = [pool[rng.choice(len(pool), number, replace=False)] for pool, \
+             number in [(allCountries, numCountries), (allLanguages, \
+             numLanguages), (allGenres, numGenres)]]
+    #the first names are the most common, with the effects on the runtime
+    weights = [1. / np.arange(1, len(n) + 1) for n in names]
+    weights = [w / w.sum() for w in weights]
+    effects = [rng.normal(0., 0.03, len(n)) for n in names]
+    
+    films = 0
+    with codecs.open(fileName, 'w', 'utf-8') as f:
+        f.write(HEADER)
+        for year in range(firstYear, lastYear + 1):
+            for k in range(filmsPerYear):
+                films += 1
+                picked = [rng.choice(len(n), rng.randint(1, 3), replace=False, \
+                          p=w) for n, w in zip(names, weights)]
+                same = rng.rand() < overlap
+                length = np.log10(runtime[0]) + runtime[1] * rng.randn() + \
+                    sum([e[p].sum() for e, p in zip(effects, picked)]) - \
+                    0.01 * same
+                genre = list(names[2][picked[2]])
+                if rng.rand() < 0.03:
+                    genre.append(u'Short')
+                directors = rng.randint(1, 200000, rng.randint(1, 3))
+                writers = directors[:1] if same else rng.randint(1, 200000, 1)
+                fields = [films, year, u'Film %d' %films, \
+                          round(10**length), u', '.join(names[0][picked[0]]), \
+                          u', '.join(names[1][picked[1]]), u', '.join(genre), \
+                          u', '.join([u'Person %d' %p for p in writers]), \
+                          u', '.join([u'Person %d' %p for p in directors]), \
+                          same, u', '.join([u'nm%07d' %p for p in writers]), \
+                          u', '.join([u'nm%07d' %p for p in directors])]
+                f.write(u'\t'.join([unicode(x) for x in fields]) + u'\n')
+                if rng.rand() < duplicates:
+                    fields[0] = 10**8 + films
+                    fields[2] = fields[2].upper()
+                    f.write(u'\t'.join([unicode(x) for x in fields]) + u'\n')
+    return films
+
+def benchmark_pipeline(outName, repeat=3, iter=200, baseline=None, \
+                       threshold=1.25, **scale):
+    '''
+        Times each stage of the analysis on the made up raw data of 
+        make_raw_data(), the best of repeat runs each:
+        
+        - get_clean_data: the wrangling of the raw data
+        - add_category_columns: the columns of every country, language and 
+          genre, found by get_unique()
+        - get_represented: the represented entries of every category in every
+          year
+        - film_model_by_year: one iteration of the sampler of the model of the
+          year with the most films, the average of iter iterations
+        - writeStats: the results of every year, found by film_map_by_year(),
+          written to a results store
+        - plot_gaussian: the trend of the global average fitted and plotted
+        
+        A stage that fails is recorded with its error and the stages that need
+        its output are skipped. The times are written to the json file outName
+        with the scale of the data, and compared with the json file of an 
+        earlier run baseline, if given.
+        
+        Parameters
+        ----------
+        
+        outName: string
+            the json file of the times
+        
+        repeat: integer
+            the number of times each stage is run
+        
+        iter: integer
+            the number of iterations of the sampler
+        
+        baseline: string or None
+            the json file of an earlier run
+        
+        threshold: float
+            a stage is reported as slower if it takes more than threshold times
+            as long as in the baseline
+        
+        scale: keyword arguments
+            the parameters of make_raw_data()
+        
+        Returns
+        -------
+        
+        list of strings
+            the stages that are slower than in the baseline
+        
+        '''
+    directory = tempfile.mkdtemp()
+    stages = {}
+    order = []
+    
+    def timed(name, function, prepare=lambda: None, number=1):
+        order.append(name)
+        times = []
+        try:
+            for i in range(repeat):
+                arg = prepare()
+                start = time.time()
+                out = function(arg)
+                times.append((time.time() - start) / number)
+        except Exception as inst:
+            stages[name] = {'error': '%s: %s' %(type(inst).__name__, inst)}
+            print '%-22s failed: %s' %(name, stages[name]['error'])
+            return None
+        stages[name] = {'seconds': min(times), 'times': times}
+        print '%-22s %10.4fs' %(name, min(times))
+        return out
+    
+    def skipped(*names):
+        for name in names:
+            order.append(name)
+            stages[name] = {'error': 'skipped'}
+            print '%-22s skipped' %name
+    
+    def run_stages(rawName):
+        df = timed('get_clean_data', lambda arg: get_clean_data(rawName, \
+                   reportName=os.path.join(directory, 'duplicates.txt')))
+        if df is None:
+            skipped('add_category_columns', 'get_represented', \
+                    'film_model_by_year', 'writeStats', 'plot_gaussian')
+            return
+        categories = [(get_unique(df, column), column, prefix) for \
+                      column, prefix in [('country', u'Cou_'), \
+                      ('language', u'Lan_'), ('genre', u'Gen_')]]
+        
+        def add_columns(wrangled):
+            for names, column, prefix in categories:
+                add_category_columns(wrangled, column, names, prefix)
+            return wrangled
+        wrangled = timed('add_category_columns', add_columns, df.copy)
+        if wrangled is None:
+            skipped('get_represented', 'film_model_by_year', 'writeStats', \
+                    'plot_gaussian')
+            return
+        
+        years = [(year, wrangled[wrangled.date == year]) for year in \
+                 np.unique(wrangled.date)]
+        def represent(group):
+            found = [get_represented(group, names, prefix) for names, \
+                     column, prefix in categories]
+            return found + [sum([len(r['same']) + len(r['diff']) for r \
+                                 in found])]
+        represented = timed('get_represented', lambda arg: [represent( \
+                            group) for year, group in years])
+        if represented is None:
+            skipped('film_model_by_year', 'writeStats', 'plot_gaussian')
+            return
+        
+        largest = np.argmax([len(group) for year, group in years])
+        year, group = years[largest]
+        args = represented[largest]
+        
+        def sample(model):
+            MCMC(model).sample(iter=iter, progress_bar=False)
+        timed('film_model_by_year', sample, lambda: film_model_by_year( \
+              str(year), group, *args), iter)
+        
+        #the results are those of --method map, the years whose films the
+        #deviations fit exactly have none
+        fitted = []
+        for (y, g), r in zip(years, represented):
+            try:
+                fitted.append((y, g, r, film_map_by_year(str(y), g, *r)[0]))
+            except ValueError:
+                pass
+        storeName = os.path.join(directory, 'results.db')
+        
+        def write(store):
+            for y, g, r, s in fitted:
+                writeStats(store, '', s, r[0]['same'], r[0]['diff'], \
+                           r[1]['same'], r[1]['diff'], r[2]['same'], \
+                           r[2]['diff'], y, len(g))
+            store.close()
+        timed('writeStats', write, lambda: ResultsStore(storeName))
+        #write() returns nothing, so a failure is found from the stage's entry
+        if 'error' in stages['writeStats']:
+            skipped('plot_gaussian')
+            return
+        
+        store = ResultsStore(storeName)
+        store.export_csv(os.path.join(directory, 'results.csv'))
+        store.close()
+        results = read_plot_results(os.path.join(directory, 'results.csv'))
+        results = results[results.category == 'Global']
+        
+        def plot(figure):
+            plot_gaussian(results, 'b')
+            plt.close(figure)
+        timed('plot_gaussian', plot, plt.figure)
+    
+    try:
+        rawName = os.path.join(directory, 'raw.txt')
+        start = time.time()
+        films = make_raw_data(rawName, **scale)
+        print 'made up %d films in %.1fs' %(films, time.time() - start)
+        run_stages(rawName)
+    finally:
+        shutil.rmtree(directory)
+    
+    run = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), \
+           'python': platform.python_version(), 'numpy': np.__version__, \
+           'pandas': pd.__version__, 'films': films, 'scale': scale, \
+           'repeat': repeat, 'iter': iter, 'stages': stages}
+    with open(outName, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+    print 'times written to %s' %outName
+    
+    slower = []
+    if baseline is not None:
+        with open(baseline) as f:
+            before = json.load(f)
+        if before.get('scale') != json.loads(json.dumps(scale)):
+            print 'the baseline was run at another scale: %s' %before['scale']
+        print 'compared with %s of %s:' %(baseline, before['date'])
+        for name in order:
+            old = before['stages'].get(name, {}).get('seconds')
+            new = stages[name].get('seconds')
+            if old is None or new is None:
+                continue
+            flag = ''
+            if new > threshold * old:
+                slower.append(name)
+                flag = '  SLOWER'
+            print '%-22s %10.4fs -> %10.4fs  x%.2f%s' %(name, old, new, \
+                                                        new / old, flag)
+    return slower
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='benchmarks of the analysis')
+    parser.add_argument('--results', default=DIRECTORY+'/results.csv', \
+                        help='the results csv file to rewrite')
+    parser.add_argument('--repeat', type=int, default=3, \
+                        help='the number of times each benchmark is run')
+    parser.add_argument('--grouping', type=int, nargs='+', metavar='YEAR', \
+                        help='check and time the grouped model for these ' \
+                        'years instead')
+    parser.add_argument('--data', default=DIRECTORY+'/film_wrangled.csv', \
+                        help='the wrangled data, for --grouping')
+    parser.add_argument('--iter', type=int, default=200, \
+                        help='the length of the chains of --grouping')
+    parser.add_argument('--records', type=int, metavar='FILMS', \
+                        help='time the scraper\'s records for this many made '\
+                        'up films instead')
+    parser.add_argument('--pipeline', metavar='JSON', help='time each stage ' \
+                        'of the analysis of made up data instead and write ' \
+                        'the times to this file')
+    parser.add_argument('--baseline', metavar='JSON', help='compare the ' \
+                        'times of --pipeline with those of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25, \
+                        help='how many times slower than the baseline a ' \
+                        'stage must be to be reported')
+    parser.add_argument('--films-per-year', type=int, default=100)
+    parser.add_argument('--years', type=int, nargs=2, default=[1930, 2014], \
+                        metavar=('FIRST', 'LAST'))
+    parser.add_argument('--categories', type=int, nargs=3, \
+                        default=[20, 15, 12], metavar=('COUNTRIES', \
+                        'LANGUAGES', 'GENRES'), help='the number of the ' \
+                        'countries, languages and genres of the made up films')
+    parser.add_argument('--overlap', type=float, default=0.3, \
+                        help='the fraction of the made up films in which a ' \
+                        'writer was also a director')
+    parser.add_argument('--runtime', type=float, nargs=2, default=[95., 0.1], \
+                        metavar=('MEDIAN', 'SD'), help='the median runtime ' \
+                        'and the standard deviation of its log10')
+    args = parser.parse_args()
+    if args.pipeline:
+        slower = benchmark_pipeline(args.pipeline, args.repeat, args.iter, \
+            args.baseline, args.threshold, \
+            filmsPerYear=args.films_per_year, firstYear=args.years[0], \
+            lastYear=args.years[1], numCountries=args.categories[0], \
+            numLanguages=args.categories[1], numGenres=args.categories[2], \
+            overlap=args.overlap, runtime=tuple(args.runtime))
+        sys.exit(1 if slower else 0)
+    elif args.grouping:
+        benchmark_grouping(args.data, args.grouping, args.iter)
+    elif args.records:
+        benchmark_records(args.records, args.repeat)
+    else:
+        benchmark_write_stats(args.results, args.repeat)
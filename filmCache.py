@@ -0,0 +1,142 @@
+'''A cache on disk for the results of expensive calculations.
+
+    Each result is pickled to a file named after a key, the hash of everything
+    the result depends on, so a result is found again whenever the same inputs
+    recur, whichever run or year they come from. Reading a result marks it as
+    recently used and when the files take up more than maxBytes the least
+    recently used are deleted. Intended use:
+
+    cache = DiskCache('cache', maxBytes=2**30)
+    key = cache_key(group.values, columns, represented, settings, MODEL_VERSION)
+    res = cache.get(key)
+    if res is None:
+        res = dotheMCMC(x)
+        cache.put(key, res)
+    '''
+
+import cPickle
+import hashlib
+import numpy as np
+import os
+import tempfile
+
+
+class DiskCache(object):
+    '''
+    DiskCache(directory, maxBytes=2**30)
+
+    A cache of pickled results in directory, which is created if it does not
+    exist.
+
+    Parameters
+    ----------
+
+    directory: string
+        the directory in which the results are stored
+
+    maxBytes: integer
+        the most space the results may take up before the least recently used
+        are deleted
+
+    '''
+    def __init__(self, directory, maxBytes=2**30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        '''
+            Returns the result stored under key, or None if there is none. The
+            modification time of the file records when it was last used.
+            '''
+        fileName = self._filename(key)
+        try:
+            with open(fileName, 'rb') as f:
+                value = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            self.misses += 1
+            return None
+        os.utime(fileName, None)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''
+            Stores value under key, then deletes the least recently used results
+            until the cache fits in maxBytes. The file is written under a
+            temporary name and then renamed, so that a reader never finds it
+            half written.
+            '''
+        handle, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as f:
+            cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, self._filename(key))
+        self.evict()
+
+    def evict(self):
+        '''deletes the least recently used results until the cache fits'''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            info = os.stat(os.path.join(self.directory, name))
+            entries.append((info.st_mtime, info.st_size, name))
+        total = sum([size for used, size, name in entries])
+        for used, size, name in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        '''deletes every result'''
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.directory, name))
+
+
+def cache_key(*parts):
+    '''
+        A hash of parts, which may be numpy arrays, dictionaries, lists, tuples
+        or anything whose repr() identifies it. Arrays are hashed by their
+        type, shape and bytes and dictionaries in the order of their keys, so
+        equal inputs always give the same key.
+
+        Returns
+        -------
+
+        string
+            the hexadecimal sha1 digest
+
+        '''
+    digest = hashlib.sha1()
+    _update(digest, parts)
+    return digest.hexdigest()
+
+def _update(digest, part):
+    '''FOR USE IN CACHE_KEY
+        adds part to the hash digest
+        '''
+    if isinstance(part, np.ndarray):
+        digest.update('array%s%s' %(part.dtype.str, part.shape))
+        if part.dtype.hasobject:
+            _update(digest, part.tolist())
+        else:
+            digest.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(part, dict):
+        digest.update('dict%d' %len(part))
+        for key in sorted(part):
+            _update(digest, key)
+            _update(digest, part[key])
+    elif isinstance(part, (list, tuple)):
+        digest.update('list%d' %len(part))
+        for item in part:
+            _update(digest, item)
+    else:
+        digest.update(repr(part))
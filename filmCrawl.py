@@ -0,0 +1,304 @@
+'''Orders the imdb ids requested by the scraper so that the likely films are
+    requested first.
+
+    Films are not spread evenly over the imdb ids: among the first hundred
+    thousand ids about one in sixteen is a film in film_wrangled.csv, beyond
+    them it is nearer one in a hundred and some ranges hold no films at all,
+    the rest being TV shows, videos and dead entries. CrawlScheduler splits the
+    ids into blocks, learns the density of films in each block from the results
+    of the ids already requested, and hands out the remaining ids of the
+    densest blocks first. A few ids spread over each block are requested before
+    any others so that every block has an estimate, which is shrunk towards the
+    density of the neighbouring blocks while few of its ids have been tried.
+
+    The scheduler keeps the state of every id, one byte each, and is saved
+    after each step of the crawl. A crawl that is restarted therefore never
+    requests an id known to be dead (404) or not a film (NA) again, and
+    retries only the ids whose requests failed. Intended use:
+
+    scheduler = CrawlScheduler(1, 1000000)
+    ids = scheduler.next_ids(200)
+    scheduler.record(ids[0], "404")
+    scheduler.save('Film_crawl.npy')
+    scheduler = load_scheduler('Film_crawl.npy')
+
+    Running this script replays a crawl of the ids in film_wrangled.csv and
+    film_fail.txt in the order of the scheduler and in the order of the ids and
+    reports the fraction of the films found against the requests spent.
+    '''
+
+import argparse
+import numpy as np
+import pandas as pd
+import threading
+import time
+
+#the states of an id
+UNTRIED = 0
+PENDING = 1
+FILM = 2
+NOTFILM = 3
+DEAD = 4
+FAILED = 5
+
+#the http codes of ids that do not exist
+DEAD_CODES = ('404', '410')
+
+
+def id_state(state):
+    '''the state of an id from the state returned by grab_record()'''
+    if state == "all data gained":
+        return FILM
+    if state == "NA":
+        return NOTFILM
+    if state in DEAD_CODES:
+        return DEAD
+    return FAILED
+
+
+class CrawlScheduler(object):
+    '''
+    CrawlScheduler(first, last, blockSize=1000, probe=5, strength=20, \
+                   radius=1, status=None)
+
+    Hands out the imdb ids from first to last, the ids of the blocks with the
+    most films per id tried first. next_ids() and record() are thread safe.
+
+    Parameters
+    ----------
+
+    first, last: integers
+        the first and the last id of the crawl
+
+    blockSize: integer
+        the number of consecutive ids in a block
+
+    probe: integer
+        the number of ids of each block, spread evenly over it, that are
+        requested before any block is ordered by its density
+
+    strength: float
+        the number of tried ids that the density of the neighbouring blocks
+        counts for in the estimate of the density of a block
+
+    radius: integer
+        the number of blocks on either side whose results give the density of
+        the neighbouring blocks
+
+    status: array of integers
+        the state of each id, as saved by save(). If not given, every id is
+        untried.
+
+    Attributes
+    ----------
+
+    films, tried: arrays of integers
+        the number of films and the number of ids tried in each block, the ids
+        whose requests failed not being counted
+
+    '''
+    def __init__(self, first, last, blockSize=1000, probe=5, strength=20, \
+                 radius=1, status=None):
+        self.first = first
+        self.last = last
+        self.blockSize = blockSize
+        self.probe = probe
+        self.strength = strength
+        self.radius = radius
+        if status is None:
+            status = np.zeros(last - first + 1, dtype=np.uint8)
+        #ids handed out but not recorded by a crawl that stopped are untried
+        status[status == PENDING] = UNTRIED
+        self.status = status
+        blocks = np.arange(len(status)) // blockSize
+        count = lambda states: np.bincount(blocks[np.in1d(status, states)], \
+                                           minlength=blocks[-1] + 1)
+        self.films = count([FILM])
+        self.tried = count([FILM, NOTFILM, DEAD])
+        self.requested = count([FILM, NOTFILM, DEAD, FAILED])
+        self._lock = threading.Lock()
+        #the order of the ids within a block: every blockSize/probe-th id,
+        #then the ids after each of those, and so on
+        stride = max(blockSize // probe, 1)
+        self._order = np.argsort(np.arange(blockSize) % stride, \
+                                 kind='mergesort')
+
+    def __len__(self):
+        '''the number of ids not yet requested'''
+        return int(np.sum(self.status == UNTRIED))
+
+    def density(self):
+        '''
+            Returns the estimated number of films per id of each block: the
+            films among its tried ids, with strength ids at the density of the
+            blocks within radius of it, or of all the blocks if none of those
+            has been tried.
+            '''
+        kernel = np.ones(2 * self.radius + 1)
+        near = np.convolve(self.films, kernel, 'same')
+        nearTried = np.convolve(self.tried, kernel, 'same')
+        prior = (self.films.sum() + 1.) / (self.tried.sum() + 2.)
+        prior = np.where(nearTried > 0, (near + prior) / (nearTried + 1.), \
+                         prior)
+        return (self.films + self.strength * prior) / \
+            (self.tried + self.strength)
+
+    def next_ids(self, number):
+        '''
+            Returns up to number untried ids, marking them as pending. The
+            blocks in which fewer than probe ids have been requested are
+            probed first, then the ids of the densest blocks are handed out.
+            An empty list means every id has been requested.
+            '''
+        with self._lock:
+            ids = []
+            short = np.flatnonzero(self.requested < self.probe)
+            for block in short:
+                if len(ids) >= number:
+                    break
+                ids += self._take(block, min(number - len(ids), \
+                                  self.probe - self.requested[block]))
+            if len(ids) < number:
+                for block in np.argsort(-self.density(), kind='mergesort'):
+                    ids += self._take(block, number - len(ids))
+                    if len(ids) >= number:
+                        break
+            return ids
+
+    def _take(self, block, number):
+        start = block * self.blockSize
+        order = self._order[self._order < len(self.status) - start] + start
+        order = order[self.status[order] == UNTRIED][:number]
+        self.status[order] = PENDING
+        self.requested[block] += len(order)
+        return [int(i) + self.first for i in order]
+
+    def record(self, idnum, state):
+        '''
+            Records the result of the request of an id: state is the state
+            returned by filmObtainItem.grab_record(), "ThreadTimeout" or
+            another failure
+            '''
+        i = idnum - self.first
+        block = i // self.blockSize
+        new = id_state(state)
+        with self._lock:
+            old = self.status[i]
+            self.status[i] = new
+            self.films[block] += int(new == FILM) - int(old == FILM)
+            self.tried[block] += int(new in (FILM, NOTFILM, DEAD)) - \
+                int(old in (FILM, NOTFILM, DEAD))
+            self.requested[block] += int(old == UNTRIED)
+
+    def known_dead(self, idnum):
+        '''True if the id is known to be dead or not to be a film'''
+        return self.status[idnum - self.first] in (NOTFILM, DEAD)
+
+    def retry_failed(self):
+        '''makes the ids whose requests failed untried, returns their number'''
+        with self._lock:
+            failed = self.status == FAILED
+            self.status[failed] = UNTRIED
+            blocks = np.flatnonzero(failed) // self.blockSize
+            self.requested -= np.bincount(blocks, \
+                                          minlength=len(self.requested))
+            return int(failed.sum())
+
+    def save(self, fileName):
+        '''writes the state of every id to the numpy file fileName'''
+        with self._lock:
+            status = self.status.copy()
+        np.save(fileName, status)
+        np.save(fileName[:-4] + '_range.npy', \
+                [self.first, self.last, self.blockSize, self.probe])
+
+def load_scheduler(fileName):
+    '''reads a CrawlScheduler written by CrawlScheduler.save()'''
+    first, last, blockSize, probe = np.load(fileName[:-4] + '_range.npy')
+    return CrawlScheduler(int(first), int(last), int(blockSize), int(probe), \
+                          status=np.load(fileName))
+
+
+def replay(states, scheduler, stepsize=200):
+    '''
+        Replays a crawl with known results in the order of the scheduler.
+
+        Parameters
+        ----------
+
+        states: dictionary
+            the state that grab_record() returns for each id that is not "NA"
+
+        scheduler: CrawlScheduler
+            the scheduler of the ids, whose results are recorded as it goes
+
+        stepsize: integer
+            the number of ids requested at a time
+
+        Returns
+        -------
+
+        array
+            the ids in the order in which they were requested
+
+        '''
+    requested = []
+    ids = scheduler.next_ids(stepsize)
+    while ids:
+        for i in ids:
+            scheduler.record(i, states.get(i, "NA"))
+        requested += ids
+        ids = scheduler.next_ids(stepsize)
+    return np.array(requested)
+
+def known_states(wrangledName, failName):
+    '''
+        The films of the wrangled data and the failures of the fail file as a
+        dictionary of the states returned by grab_record() for each id
+        '''
+    states = dict((int(i), "all data gained") for i in \
+                  pd.read_csv(wrangledName, usecols=['id'])['id'])
+    fails = pd.read_csv(failName, sep='\t', dtype={'error': str})
+    for i, error in zip(fails['id'], fails['error']):
+        states.setdefault(int(i), error)
+    return states
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compares the order of the ' \
+                                     'crawl scheduler with the order of the ' \
+                                     'ids')
+    parser.add_argument('--data', default='film_wrangled.csv', \
+                        help='the films, as wrangled data with an id column')
+    parser.add_argument('--fail', default='film_fail.txt', \
+                        help='the fail file of filmObtainDataset.py')
+    parser.add_argument('--last', type=int, default=1000000, \
+                        help='the last id of the crawl')
+    parser.add_argument('--block-size', type=int, default=1000)
+    parser.add_argument('--probe', type=int, default=5)
+    args = parser.parse_args()
+    states = known_states(args.data, args.fail)
+    films = np.zeros(args.last + 1, dtype=bool)
+    films[[i for i, s in states.items() if s == "all data gained" and \
+           i <= args.last]] = True
+
+    start = time.time()
+    scheduler = CrawlScheduler(1, args.last, args.block_size, args.probe)
+    order = replay(states, scheduler)
+    print 'crawl of %d ids with %d films replayed in %.1fs' %(args.last, \
+        films.sum(), time.time() - start)
+    sequential = np.cumsum(films[1:]) / float(films.sum())
+    scheduled = np.cumsum(films[order]) / float(films.sum())
+    print 'requests\tfilms found (sequential)\tfilms found (scheduled)'
+    for fraction in [0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.]:
+        n = int(fraction * args.last) - 1
+        print '%d%%\t%.1f%%\t%.1f%%' %(100 * fraction, 100 * sequential[n], \
+                                       100 * scheduled[n])
+    print 'films found\trequests (sequential)\trequests (scheduled)'
+    for fraction in [0.5, 0.8, 0.9, 0.95, 0.99]:
+        print '%d%%\t%.1f%%\t%.1f%%' %(100 * fraction, 100. * \
+            (np.searchsorted(sequential, fraction) + 1) / args.last, 100. * \
+            (np.searchsorted(scheduled, fraction) + 1) / args.last)
+    dead = np.in1d(scheduler.status, [NOTFILM, DEAD]).sum()
+    print '%d ids known to be dead or not films are skipped by a ' \
+        'restarted crawl' %dead
@@ -0,0 +1,215 @@
+'''An inverted index of the wrangled data.
+
+    For each country, language and genre column of the wrangled data and for
+    the Overlap and nonOverlap columns, the index keeps the sorted row numbers
+    of the films that have it: its posting list. The films are ordered by date
+    so the films of a year, or of a range of years, are a range of rows. A
+    query such as the French dramas of the 1960s is then the intersection of
+    two posting lists cut down to a range of rows, which takes microseconds
+    rather than a scan of every row and column of the data. Intended use:
+
+    index = build_index(data, columns)
+    index.save(index_name('film_wrangled.npy'))
+    index = load_index(index_name('film_wrangled.npy'))
+    rows = index.query(['Cou_France', 'Gen_Drama'], years=(1960, 1969))
+    films = data[rows]
+
+    filmMCMC.py builds the index next to film_wrangled.npy and, when run with
+    --only, analyses the films of each year found by a query. Running this
+    script times a query against a scan of the wrangled data.
+    '''
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import time
+
+#the prefixes of the columns that are indexed, besides Overlap and nonOverlap
+PREFIXES = (u'Cou_', u'Lan_', u'Gen_')
+
+
+class FilmIndex(object):
+    '''
+    FilmIndex(keys, offsets, postings, years, starts)
+
+    The posting lists of the wrangled data, as returned by build_index() or
+    load_index().
+
+    Parameters
+    ----------
+
+    keys: list of strings
+        the indexed columns, e.g. 'Cou_France'
+
+    offsets: array of integers
+        the posting list of keys[i] is postings[offsets[i]:offsets[i+1]]
+
+    postings: array of integers
+        the posting lists of all the keys, one after the other
+
+    years: array of integers
+        the years of the data, in ascending order
+
+    starts: array of integers
+        the first row of each year, followed by the number of rows
+
+    '''
+    def __init__(self, keys, offsets, postings, years, starts):
+        self.keys = list(keys)
+        self.offsets = offsets
+        self.postings = postings
+        self.years = years
+        self.starts = starts
+        self._position = dict((key, i) for i, key in enumerate(self.keys))
+
+    def rows(self, key):
+        '''the posting list of the column key'''
+        if key not in self._position:
+            raise KeyError('%s is not an indexed column' %key)
+        i = self._position[key]
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def year_rows(self, first, last=None):
+        '''
+            Returns the range (start, stop) of the rows of the films released
+            from the year first to the year last, or in the year first if last
+            is None.
+            '''
+        if last is None:
+            last = first
+        return (int(self.starts[np.searchsorted(self.years, first)]), \
+                int(self.starts[np.searchsorted(self.years, last, 'right')]))
+
+    def query(self, keys, years=None, rows=None):
+        '''
+            Returns the sorted row numbers of the films that have all of the
+            columns keys.
+
+            Parameters
+            ----------
+
+            keys: list of strings
+                indexed columns, e.g. ['Cou_France', 'Gen_Drama', 'Overlap']
+
+            years: integer or tuple
+                if given, only the films released in this year, or from
+                years[0] to years[1]
+
+            rows: tuple
+                if given, only the films in rows rows[0] to rows[1]-1
+
+            '''
+        start, stop = 0, int(self.starts[-1])
+        if years is not None:
+            start, stop = self.year_rows(*np.atleast_1d(years))
+        if rows is not None:
+            start, stop = max(start, rows[0]), min(stop, rows[1])
+        lists = []
+        for key in keys:
+            posting = self.rows(key)
+            lists.append(posting[np.searchsorted(posting, start): \
+                                 np.searchsorted(posting, stop)])
+        if not lists:
+            return np.arange(start, max(start, stop))
+        #intersect from the shortest list, looking up its rows in the others
+        lists.sort(key=len)
+        found = lists[0]
+        for posting in lists[1:]:
+            if len(found) == 0 or len(posting) == 0:
+                return found[:0]
+            at = np.minimum(np.searchsorted(posting, found), len(posting) - 1)
+            found = found[posting[at] == found]
+        return found
+
+    def save(self, fileName):
+        '''writes the index to the numpy file fileName, see load_index()'''
+        np.savez(fileName, keys=np.array(self.keys, dtype=np.unicode_), \
+                 offsets=self.offsets, postings=self.postings, \
+                 years=self.years, starts=self.starts)
+
+
+def build_index(data, columns, chunk=10000):
+    '''
+        Builds the FilmIndex of the wrangled data.
+
+        Parameters
+        ----------
+
+        data: array
+            the wrangled data ordered by date, as written by
+            filmMCMC.share_wrangled_data()
+
+        columns: list of strings
+            the names of the columns of data
+
+        chunk: integer
+            the number of rows whose entries are found at a time
+
+        '''
+    keys = [column for column in columns if column in \
+            [u'Overlap', u'nonOverlap'] or (column.startswith(PREFIXES) \
+            and not column.endswith(u'TOTAL'))]
+    indexed = [columns.index(key) for key in keys]
+    rows, cols = [], []
+    for first in range(0, len(data), chunk):
+        r, c = np.nonzero(data[first:first + chunk, indexed])
+        rows.append(r + first)
+        cols.append(c)
+    rows = np.concatenate(rows).astype(np.int32)
+    cols = np.concatenate(cols)
+    #a stable sort by column keeps the rows of each column in order
+    order = np.argsort(cols, kind='mergesort')
+    offsets = np.append(0, np.cumsum(np.bincount(cols, \
+                                                 minlength=len(keys))))
+    years, starts = np.unique(data[:, columns.index(u'date')], \
+                              return_index=True)
+    return FilmIndex(keys, offsets, rows[order], years.astype(int), \
+                     np.append(starts, len(data)))
+
+def load_index(fileName):
+    '''reads a FilmIndex written by FilmIndex.save()'''
+    saved = np.load(fileName)
+    return FilmIndex(saved['keys'].tolist(), saved['offsets'], \
+                     saved['postings'], saved['years'], saved['starts'])
+
+def index_name(npyName):
+    '''the name of the index of the data in the numpy file npyName'''
+    return os.path.splitext(npyName)[0] + '_index.npz'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='times a query of the ' \
+                                     'index of the wrangled data')
+    parser.add_argument('keys', nargs='+', help='the columns that the films ' \
+                        'must have, e.g. Cou_France Gen_Drama')
+    parser.add_argument('--years', type=int, nargs='+', metavar='YEAR', \
+                        help='a year or the first and last years')
+    parser.add_argument('--data', default='film_wrangled.csv', \
+                        help='the wrangled data')
+    parser.add_argument('--repeat', type=int, default=1000, \
+                        help='the number of times the query is timed')
+    args = parser.parse_args()
+    df = pd.read_csv(args.data, encoding='utf-8')
+    df = df.iloc[np.argsort(df['date'].values, kind='mergesort')]
+    start = time.time()
+    index = build_index(df.values, list(df.columns))
+    print 'index of %d films built in %.2fs, %d rows in %d posting lists' \
+        %(len(df), time.time() - start, len(index.postings), len(index.keys))
+
+    start = time.time()
+    for i in range(args.repeat):
+        rows = index.query(args.keys, years=args.years)
+    queryTime = (time.time() - start) / args.repeat
+    start = time.time()
+    scanned = np.ones(len(df), dtype=bool)
+    for key in args.keys:
+        scanned &= df[key].values > 0
+    if args.years is not None:
+        scanned &= (df['date'].values >= args.years[0]) & \
+                   (df['date'].values <= args.years[-1])
+    scanned = np.flatnonzero(scanned)
+    scanTime = time.time() - start
+    print '%d films found in %.1fus by the index and in %.1fus by a scan, ' \
+        'the same films: %s' %(len(rows), queryTime * 1e6, scanTime * 1e6, \
+                                np.array_equal(rows, scanned))
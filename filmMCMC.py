@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 '''
     A script for analyzing the wrangled data. The data is broken down by year.
     For each year the data are modeled with parameters found by Markov Chain 
@@ -5,17 +6,54 @@
     defined in filmModel.py
     '''
 from filmModel import *
+from filmResults import ResultsStore, ResultsWriter, input_hash
+from filmCache import DiskCache, cache_key
+from filmIndex import build_index, load_index, index_name
+import filmTrace
 
 import pandas as pd
 import numpy as np
-from pymc import MCMC
+from pymc import MCMC, AdaptiveMetropolis
 import codecs
+import argparse
+import itertools
 import multiprocessing as mp
+import os
+import resource
+import time
 import sys
 DIRECTORY=sys.path[0]
 
-#import the wrangled data
-wrangledDf=pd.read_csv(DIRECTORY+'/film_wrangled.csv', encoding='utf-8')
+#the wrangled data are read once by the main process and stored as a binary
+#array. Each worker memory-maps that array in attach_shared_data() so that only
+#the year's row range has to be sent to it. sharedIndex is the FilmIndex of 
+#that array, see filmIndex.py
+sharedData = None
+sharedColumns = None
+sharedIndex = None
+
+#settings for the sampler used by dotheMCMC(). trace is either 'ram' to keep the
+#traces in memory (pyMC2's default) or 'stream' to append them to files in
+#traceDir in chunks of chunk samples, see filmTrace.py. When warmStart is True
+#chains started from a neighbouring year's posterior only burn warmBurn 
+#iterations, see warm_schedule(). The joint* settings are the sweeps of the
+#Gibbs sampler used when all years are fitted together, see dotheJointMCMC().
+#meanField selects the factorized approximation in dotheVI(). When mapInit is 
+#True chains that are not warm started start from the posterior mode and its 
+#Laplace approximation, see film_map_by_year(), and also only burn warmBurn.
+#The batch* settings are the sweeps of the sampler used for years analysed 
+#together by dotheMCMCBatch(). When groupFilms is True the films are collapsed
+#into groups that share the same mean before they are modelled, see 
+#group_films(). When only is not empty only the films that have all of its 
+#columns, e.g. ['Cou_France', 'Gen_Drama'], are analysed, see year_group()
+samplerSettings = {'iter': 300000, 'burn': 75000, 'thin': 1, 'trace': 'ram', \
+                   'chunk': 1000, 'traceDir': DIRECTORY+'/traces', \
+                   'keepTraces': False, 'warmStart': False, 'warmBurn': 5000, \
+                   'jointIter': 6000, 'jointBurn': 1000, 'jointThin': 5, \
+                   'meanField': False, 'mapInit': False, 'batchIter': 6000, \
+                   'batchBurn': 1000, 'batchThin': 5, 'groupFilms': False, \
+                   'only': []}
+
 #import the names of the countries, languages and genres
 with codecs.open(DIRECTORY+'/categories.txt', 'r', 'utf-8') as f:
     countries=f.readline()
@@ -26,46 +64,153 @@ with codecs.open(DIRECTORY+'/categories.txt', 'r', 'utf-8') as f:
     genres=np.array(genres.strip('\n').split(', '))
 
 
-def initializeStats():
-    '''Creates the CSV file in which the MCMC results will be saved. The file is 
-        initialized with the headers:
+def share_wrangled_data(csvName, npyName):
+    '''
+        Reads the wrangled data and saves it as a binary numpy array which the
+        worker processes can memory-map instead of each receiving a pickled copy
+        of the dataframe for every year. The FilmIndex of the array is saved 
+        next to it, see filmIndex.index_name().
         
-        date – the year in which the analyzed films were released
+        Parameters
+        ----------
         
-        category – a country, language or genre. Can also be 'Global' to denote 
-                    the undeviated average runtime
+        csvName: string
+            the file containing the wrangled data, i.e. film_wrangled.csv
         
-        QSame – whether or not the writer of the film was also the director. 
-                 True if the writer was the director, False if not and -1 if the
-                 category is 'Global'
+        npyName: string
+            the file to which the binary copy of the data is written
         
-        number – the number of films released in that category that year
+        Returns
+        -------
         
-        linMean – Either this is the average number of minutes by which films 
-                   descibed by category differ from the global average in the 
-                   given year or, if the category is 'Global', this is the 
-                   average runtime of the movies in the analyzed year.
+        columns: list of strings
+            the column names of the wrangled data in the order in which they are
+            stored in npyName
         
-        linSD – the standard deviation for the mean given in linMean
+        ranges: list of tuples
+            one (year, start, stop) tuple for each year. Rows start to stop-1 of
+            the array in npyName contain the films released that year.
         
-        lin95Low – the 95% lower confidence bound for the mean given in linMean
+        '''
+    #the first column is the row number written by the wrangler. It is left
+    #out so that the films of a year are stored, and hashed, the same way
+    #whatever films were added to or dropped from the years before it
+    df = pd.read_csv(csvName, encoding='utf-8', index_col=0)
+    data = np.float64(df.values)
+    #the wrangler orders the films by date but make sure, a stable sort keeps
+    #the order of the films within each year
+    data = data[np.argsort(data[:, list(df.columns).index('date')], \
+                           kind='mergesort')]
+    np.save(npyName, data)
+    build_index(data, list(df.columns)).save(index_name(npyName))
+    return list(df.columns), year_ranges(data[:, list(df.columns).index('date')])
+
+def year_ranges(dates):
+    '''
+        Finds the rows released in each year of an array of dates that is
+        ordered from earliest to latest.
         
-        lin95Hi – the 95% upper confidence bound for the mean given in linMean
+        Parameters
+        ----------
+        
+        dates: array like
+            the year in which each film was released, in ascending order
+        
+        Returns
+        -------
+        
+        list of tuples
+            one (year, start, stop) tuple for each year such that
+            dates[start:stop] are the films released in that year
         
         '''
-    entry=np.array(['date', 'category', 'QSame', 'number', 'linMean', 'linSD', \
-                    'lin95Low', 'lin95Hi'])
-    with codecs.open('Desktop/results.csv', 'a', 'utf-8') as f:
-        f.write(','.join(entry) + '\n')
+    years, starts = np.unique(dates, return_index=True)
+    stops = np.append(starts[1:], len(dates))
+    return [(int(year), int(start), int(stop)) for year, start, stop in \
+            zip(years, starts, stops)]
 
-def writeStats(stats, countrySame, countryDiff, languageSame, languageDiff, \
-               genreSame, genreDiff, year, totalNumber):
+def attach_shared_data(npyName, columns, settings=None):
+    '''
+        Initializer for the worker processes. Memory-maps the array written by
+        share_wrangled_data() so that all workers share one read-only copy of
+        the wrangled data, and reads its index.
+        
+        Parameters
+        ----------
+        
+        npyName: string
+            the file written by share_wrangled_data()
+        
+        columns: list of strings
+            the column names returned by share_wrangled_data()
+        
+        settings: dictionary
+            entries that replace those in samplerSettings for this worker
+        
+        '''
+    global sharedData, sharedColumns, sharedIndex
+    if settings is not None:
+        samplerSettings.update(settings)
+    start = time.time()
+    before = memory_usage()
+    sharedData = np.load(npyName, mmap_mode='r')
+    sharedColumns = columns
+    sharedIndex = load_index(index_name(npyName))
+    report_worker('attached to shared data', start, before)
+
+def year_group(start, stop):
     '''
-        writes the results of the MCMC analysis to the file results.csv
+        Returns a dataframe of the films in rows start to stop-1 of the shared
+        data. The dataframe is a view on the memory-mapped array. If 
+        samplerSettings['only'] is not empty, the dataframe is a copy of the 
+        films in those rows that have all of its columns, found by a query of 
+        the index.
+        '''
+    if samplerSettings['only']:
+        rows = sharedIndex.query(samplerSettings['only'], rows=(start, stop))
+        return pd.DataFrame(sharedData[rows], columns=sharedColumns)
+    return pd.DataFrame(sharedData[start:stop], columns=sharedColumns)
+
+def memory_usage():
+    '''
+        Returns the resident memory of the current process in megabytes. On
+        systems without /proc the peak resident memory is returned instead.
+        '''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.readline().split()[1])
+        return pages * resource.getpagesize() / 1024.**2
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def report_worker(task, start, before):
+    '''
+        Prints the time a worker took to perform task and its memory before and
+        after. start is the time.time() and before the memory_usage() at the 
+        beginning of the task.
+        '''
+    print 'worker %d: %s in %.2fs, memory %.1fMB -> %.1fMB' %(os.getpid(), \
+        task, time.time() - start, before, memory_usage())
+    sys.stdout.flush()
+
+def writeStats(store, inputHash, stats, countrySame, countryDiff, \
+               languageSame, languageDiff, genreSame, genreDiff, year, \
+               totalNumber):
+    '''
+        writes the results of the MCMC analysis of a year to the results store,
+        replacing any earlier results of that year, see filmResults.py. The 
+        rows are built a column at a time from the arrays of the stats 
+        dictionary and handed to the store in one call.
         
         Parameters
         ----------
         
+        store: ResultsStore or ResultsWriter
+            the store of the results
+        
+        inputHash: string
+            the input_hash() of the year's input, stored with the results
+        
         stats: a pyMC2 stats dictionary
             this contains the results of the MCMC, i.e. the average, standard 
             deviation and 95% confidence interval for each category and for the 
@@ -101,70 +246,43 @@ def writeStats(stats, countrySame, countryDiff, languageSame, languageDiff, \
         
         
         '''
-    with codecs.open(u'/Users/gordonblackadder/Desktop/resultsTEST1.csv', 'a', \
-                     'utf-8') as f:
-        #write global average results to file
-        year=str(year)
-        results = stats[year+'_global']
-        worldlinMean = str(10.**results['mean'])
-        worldlinSD = str(10.**results['standard deviation'])
-        worldlin95Low = str(10.**results['95% HPD interval'][0])
-        worldlin95Hi = str(10.**results['95% HPD interval'][1])
-        entry=np.array([year, 'Global', '-1', str(totalNumber), worldlinMean, \
-                        worldlinSD, worldlin95Low, worldlin95Hi])
-        f.write(','.join(entry) + '\n')
-        
-        #write each deviation result to file, category by category
-        offset = 0 #first position of category in stats dictionary
-        same = True #label whether writer was also the director
-        for category in [countrySame, countryDiff, languageSame, languageDiff, \
-                         genreSame, genreDiff]:
-            writeStatsCategory(f, stats, offset, year, category, str(same))
-            offset = offset + len(category)
-            same = not same
+    store.write_year(int(year), stats_rows(stats, countrySame, countryDiff, \
+                     languageSame, languageDiff, genreSame, genreDiff, year, \
+                     totalNumber), inputHash)
 
-def writeStatsCategory(file, data, offset, year, category, overlap):
+def stats_rows(stats, countrySame, countryDiff, languageSame, languageDiff, \
+               genreSame, genreDiff, year, totalNumber):
     '''
-        A helper function called by writeStats. This writes the results of MCMC 
-        analysis for a particular category
-        
-        Parameters
-        ----------
-        
-        file: filestream
-            the file to which the results are to be written
-        
-        data: a pyMC2 stats dictionary
-            this contains the results of the MCMC, i.e. the average, standard
-            deviation and 95% confidence interval for each category and for the
-            global average.
-        
-        offset: integer
-            the first position of the results stored in the data dictionary 
-            corresponding to the category
-        
-        year: string
-            the year in which the films were released
-        
-        category: array like 
-            the entries in the category, could be countries, languages or genres
-        
-        overlap: bool
-            whether or not the writer of the film was also the director. True if
-            the writer was the director, False if not
-        
+        A helper function called by writeStats. Returns the rows of results of
+        a year, the global average followed by each deviation category by 
+        category, as a list of tuples with an entry for each of 
+        filmResults.COLUMNS. The parameters are those of writeStats.
         '''
-    for i in range(len(category)):
-        position = offset+i #get position of the entry in the data dictionary
-        finding = data[year+'_linDev']
-        mean = str(finding['mean'][position])
-        SD = str(finding['standard deviation'][position])
-        low95 = str(finding['95% HPD interval'][0][position])
-        hi95 = str(finding['95% HPD interval'][1][position])
-        entry = np.array([year, category[i][0], overlap, category[i][1], mean, \
-                          SD, low95, hi95])
-        file.write(','.join(entry) + '\n')
-            
+    year = str(year)
+    results = stats[year+'_global']
+    rows = [(int(year), u'Global', u'-1', float(totalNumber), \
+             10.**results['mean'], 10.**results['standard deviation'], \
+             10.**results['95% HPD interval'][0], \
+             10.**results['95% HPD interval'][1])]
+    
+    #the deviations are in the order of the categories, which alternate
+    #between writer-director overlap and non-overlap
+    categories = [countrySame, countryDiff, languageSame, languageDiff, \
+                  genreSame, genreDiff]
+    lengths = [len(category) for category in categories]
+    represented = [category for category in categories if len(category)]
+    if not represented:
+        return rows
+    entries = np.concatenate([category[:, 0] for category in represented])
+    numbers = np.concatenate([category[:, 1] for category in represented])
+    finding = stats[year+'_linDev']
+    interval = finding['95% HPD interval']
+    columns = [[int(year)] * len(entries), entries.tolist(), \
+               np.repeat(['True', 'False'] * 3, lengths).tolist(), \
+               numbers.astype(np.float64).tolist(), finding['mean'].tolist(), \
+               finding['standard deviation'].tolist(), interval[0].tolist(), \
+               interval[1].tolist()]
+    return rows + zip(*columns)
 
 
 def get_represented(df, category, prefix):
@@ -206,17 +324,217 @@ def get_represented(df, category, prefix):
         '''
     #define the function used to order the array of entries
     sort_by_num_produced =lambda x,y: 1 if x[1]>y[1] else -1 if x[1]<y[1] else 0
-    #find the represented entries and then order them
-    Same = [[item, (df[prefix+item]*df[u'Overlap']).sum()] for item in category]
+    #count the films of every entry at once, then find the represented entries 
+    #and order them
+    entries = df[[prefix+item for item in category]].values
+    Same = [[item, num] for item, num in zip(category, \
+            entries.T.dot(df[u'Overlap'].values))]
     Same = [x for x in Same if x[1]>0]
     Same.sort(cmp=sort_by_num_produced)
     #repeat for diff
-    Diff = [[item, (df[prefix+item]*df[u'nonOverlap']).sum()] \
-            for item in category]
+    Diff = [[item, num] for item, num in zip(category, \
+            entries.T.dot(df[u'nonOverlap'].values))]
     Diff = [x for x in Diff if x[1]>0]
     Diff.sort(cmp=sort_by_num_produced)
     return {'same':np.array(Same), 'diff':np.array(Diff)}
 
+def warm_schedule(ranges, blocks):
+    '''
+        Orders the years so that each chain can be warm started from the 
+        posterior of an adjacent year that has already been analysed. The years
+        are split into blocks of consecutive years containing roughly equal 
+        numbers of films. Within a block the year with the most films is 
+        analysed first from a cold start and the analysis then moves outwards 
+        from it one year at a time in both directions.
+        
+        Parameters
+        ----------
+        
+        ranges: list of tuples
+            the (year, start, stop) tuples returned by share_wrangled_data()
+        
+        blocks: integer
+            the number of blocks, each of which is analysed by one worker
+        
+        Returns
+        -------
+        
+        list of lists of tuples
+            for each block a list of (year, start, stop, neighbour) tuples in 
+            the order in which they should be analysed, neighbour is the year 
+            from which to warm start or None for a cold start
+        
+        '''
+    films = np.array([stop - start for year, start, stop in ranges])
+    edges = np.searchsorted(np.cumsum(films), \
+                            np.arange(1, blocks) * films.sum() / float(blocks))
+    schedule = []
+    for block in np.split(np.arange(len(ranges)), edges):
+        if len(block) == 0:
+            continue
+        seed = block[np.argmax(films[block])]
+        order = [(seed, None)]
+        for i in range(1, len(block)):
+            if seed + i <= block[-1]:
+                order.append((seed + i, ranges[seed + i - 1][0]))
+            if seed - i >= block[0]:
+                order.append((seed - i, ranges[seed - i + 1][0]))
+        schedule.append([ranges[i] + (neighbour,) for i, neighbour in order])
+    return schedule
+
+def posterior_summary(mc, year, labels, samples=5000):
+    '''
+        Summarizes the posterior of the global average and the unconstrained 
+        deviations so that it can be used to warm start another year.
+        
+        Parameters
+        ----------
+        
+        mc: pyMC2 MCMC object
+            the sampler after sampling
+        
+        year: string
+            the year analysed by mc
+        
+        labels: list of tuples
+            the free_deviation_labels() of the year
+        
+        samples: integer
+            the trace is thinned to roughly this many samples before the 
+            covariance is calculated
+        
+        Returns
+        -------
+        
+        dictionary
+            'labels' as passed in, 'mean' and 'cov' the posterior mean and 
+            covariance of the global average followed by the deviations and 
+            'sigma' the posterior mean of sigmaObs
+        
+        '''
+    step = max(1, mc.trace(year+'_global').length() // samples)
+    x = np.column_stack([np.asarray(mc.trace(year+'_global')[::step]), \
+                np.asarray(mc.trace(year+'_log10_categoryDev')[::step])])
+    return {'labels': labels, 'mean': x.mean(0), \
+            'cov': np.atleast_2d(np.cov(x, rowvar=0)), \
+            'sigma': np.asarray(mc.trace(year+'_sigmaObs')[::step]).mean()}
+
+def warm_start(summary, labels):
+    '''
+        Maps the posterior summary of a neighbouring year onto the parameters of
+        the year to be analysed. Deviations that were not represented in the 
+        neighbouring year start at zero, uncorrelated with the other parameters
+        and with the median variance of the neighbour's deviations.
+        
+        Parameters
+        ----------
+        
+        summary: dictionary
+            the posterior_summary() of the neighbouring year
+        
+        labels: list of tuples
+            the free_deviation_labels() of the year to be analysed
+        
+        Returns
+        -------
+        
+        init: dictionary
+            starting values for film_model_by_year()
+        
+        cov: array
+            the covariance of the global average followed by the deviations
+        
+        '''
+    position = dict((label, i + 1) for i, label in enumerate(summary['labels']))
+    index = np.array([0] + [position.get(label, -1) for label in labels])
+    known = index >= 0
+    index[~known] = 0
+    mean = np.where(known, summary['mean'][index], 0.)
+    cov = summary['cov'][np.ix_(index, index)]
+    variance = np.diag(summary['cov'])[1:]
+    cov[~known, :] = 0.
+    cov[:, ~known] = 0.
+    cov[~known, ~known] = np.median(variance) if len(variance) else 0.25**2
+    #guard against a singular covariance from a short trace
+    cov += 1e-10 * np.eye(len(cov))
+    return {'global': mean[0], 'deviation': mean[1:], \
+            'sigma': summary['sigma']}, cov
+
+def dotheMCMCBlock(block):
+    '''
+        Performs dotheMCMC() for each year in a block produced by 
+        warm_schedule(), warm starting each year from the posterior of its 
+        neighbour. Returns a list of the results of dotheMCMC().
+        '''
+    summaries = {}
+    results = []
+    for year, start, stop, neighbour in block:
+        res = dotheMCMC((year, start, stop, summaries.get(neighbour)))
+        res['warmFrom'] = neighbour
+        summaries[year] = res.pop('summary')
+        results.append(res)
+    return results
+
+def batch_schedule(ranges, films, size):
+    '''
+        Splits off the years with fewer than films films so that they can be 
+        analysed together by dotheMCMCBatch(). Returns a list of batches, each 
+        a list of at most size consecutive small years, and the list of the 
+        remaining years. Both contain the (year, start, stop) tuples of ranges.
+        '''
+    small = [x for x in ranges if x[2] - x[1] < films]
+    rest = [x for x in ranges if x[2] - x[1] >= films]
+    return [small[i:i + size] for i in range(0, len(small), size)], rest
+
+def dotheMCMCBatch(batch):
+    '''
+        Analyses several years at once with sample_years_batched(), which 
+        advances the chains of all the years together. batch is a list of 
+        (year, start, stop) tuples. Returns a list with a dictionary for each 
+        year with the same entries as that of dotheVI().
+        '''
+    start = time.time()
+    before = memory_usage()
+    results = []
+    groups, dicts = [], []
+    for year, first, stop in batch:
+        group = year_group(first, stop)
+        cou, lan, gen, num = get_all_represented(group)
+        groups.append(group)
+        dicts.append((cou, lan, gen))
+        results.append({'year': year, 'countries': cou, 'languages': lan, \
+                        'genres': gen, 'num': num})
+    stats = sample_years_batched([x[0] for x in batch], groups, dicts, \
+                                 iter=samplerSettings['batchIter'], \
+                                 burn=samplerSettings['batchBurn'], \
+                                 thin=samplerSettings['batchThin'])
+    seconds = time.time() - start
+    for res in results:
+        res['stats'] = stats[res['year']]
+        res['seconds'] = seconds / len(batch)
+    report_worker('years %d-%d batched' %(batch[0][0], batch[-1][0]), start, \
+                  before)
+    return results
+
+def get_all_represented(group):
+    '''
+        Finds the countries, languages and genres represented in a dataframe of
+        films, see get_represented(). Returns the three dictionaries and the 
+        total number of represented entries.
+        '''
+    representedCountries = get_represented(group, countries, 'Cou_')
+    representedLanguages = get_represented(group, languages, 'Lan_')
+    representedGenres = get_represented(group, genres, 'Gen_')
+    
+    numRepresented = representedCountries['same'].shape[0] + \
+                        representedCountries['diff'].shape[0]
+    numRepresented += representedLanguages['same'].shape[0] + \
+                        representedLanguages['diff'].shape[0]
+    numRepresented += representedGenres['same'].shape[0] + \
+                        representedGenres['diff'].shape[0]
+    return representedCountries, representedLanguages, representedGenres, \
+            numRepresented
+
 def dotheMCMC(x):
     '''
         Performs the Markov Chain Monte Carlo analysis to find the global 
@@ -230,8 +548,13 @@ def dotheMCMC(x):
             x[0]: integer
                 the year in which the films to be analysed were released.
         
-            x[1]: pandas dataframe
-                the dataframe containing all the movies released that year
+            x[1], x[2]: integers
+                the movies released that year are rows x[1] to x[2]-1 of the
+                shared data, see share_wrangled_data()
+            
+            x[3]: dictionary, optional
+                the posterior_summary() of a neighbouring year from which to 
+                warm start the chain
         
         
         Returns
@@ -243,7 +566,8 @@ def dotheMCMC(x):
             global average.
         
         group: pandas dataframe
-            identical to the dataframe x[1]
+            the movies released that year, rows x[1] to x[2]-1 of the shared 
+            data
         
         representedCountries: dictionary of arrays
             a dictionary of two elements: "same" and "diff". dict['same'] and
@@ -262,43 +586,425 @@ def dotheMCMC(x):
         numRepresented: integer
             the total number of movies released that year
         
+        burn: integer
+            the number of burn-in iterations performed
+        
+        seconds: float
+            the time taken by the sampler
+        
+        summary: dictionary
+            only when samplerSettings['warmStart'] is True, the 
+            posterior_summary() of this year
+        
         '''
     #get the parameters needed to initialize the model
-    year, group =  x[0], x[1]
-    representedCountries = get_represented(group, countries, 'Cou_')
-    representedLanguages = get_represented(group, languages, 'Lan_')
-    representedGenres = get_represented(group, genres, 'Gen_')
+    start = time.time()
+    before = memory_usage()
+    year = x[0]
+    group = year_group(x[1], x[2])
+    representedCountries, representedLanguages, representedGenres, \
+        numRepresented = get_all_represented(group)
+    if samplerSettings['groupFilms']:
+        group = group_films(group, representedCountries, \
+                            representedLanguages, representedGenres)
     
-    numRepresented = representedCountries['same'].shape[0] + \
-                        representedCountries['diff'].shape[0]
-    numRepresented += representedLanguages['same'].shape[0] + \
-                        representedLanguages['diff'].shape[0]
-    numRepresented += representedGenres['same'].shape[0] + \
-                        representedGenres['diff'].shape[0]
+    #start from the posterior of the neighbouring year if one is given
+    labels = free_deviation_labels(representedCountries, representedLanguages,\
+                                   representedGenres)
+    init, cov = None, None
+    burn = samplerSettings['burn']
+    if len(x) > 3 and x[3] is not None:
+        init, cov = warm_start(x[3], labels)
+        burn = samplerSettings['warmBurn']
+    elif samplerSettings['mapInit']:
+        mode = film_map_by_year(str(year), group, representedCountries, \
+                                representedLanguages, representedGenres, \
+                                numRepresented)[1]
+        init, cov = warm_start(mode, labels)
+        burn = samplerSettings['warmBurn']
     
     #initialize the model in a pyMC object, then perform the MCMC
-    mc=MCMC(film_model_by_year(str(year), group, representedCountries, \
+    if samplerSettings['trace'] == 'stream':
+        dbArgs = {'db': filmTrace, 'chunk': samplerSettings['chunk'], \
+                  'dbname': os.path.join(samplerSettings['traceDir'], str(year))}
+    else:
+        dbArgs = {'db': 'ram'}
+    model = film_model_by_year(str(year), group, representedCountries, \
                                representedLanguages, representedGenres, \
-                               numRepresented))
-    mc.sample(iter=300000, burn=75000, progress_bar=False)
+                               numRepresented, init=init, \
+                               grouped=samplerSettings['groupFilms'])
+    mc=MCMC(model, **dbArgs)
+    if cov is not None:
+        #propose jumps from the neighbour's posterior covariance, scaled as in
+        #Gelman et al. 1996. AdaptiveMetropolis orders its stochastics itself
+        #so the covariance is rearranged to match.
+        stochastics = [model['globalAvg'], model['category_deviation']]
+        mc.use_step_method(AdaptiveMetropolis, stochastics, \
+                           delay=samplerSettings['warmBurn']//2)
+        step = mc.step_method_dict[model['globalAvg']][0]
+        order = np.empty(len(cov), dtype=int)
+        order[step._slices[stochastics[0]]] = 0
+        order[step._slices[stochastics[1]]] = np.arange(1, len(cov))
+        step.C = cov[np.ix_(order, order)] * 2.4**2 / len(cov)
+        step.updateproposal_sd()
+    kept = samplerSettings['iter'] - samplerSettings['burn']
+    sampleStart = time.time()
+    mc.sample(iter=burn + kept, burn=burn, thin=samplerSettings['thin'], \
+              progress_bar=False)
+    seconds = time.time() - sampleStart
+    stats = mc.stats()
+    stats[str(year)+'_linDev'] = linear_deviation_stats(\
+        mc.trace(str(year)+'_global')[:], \
+        mc.trace(str(year)+'_log10_categoryDev')[:], representedCountries, \
+        representedLanguages, representedGenres)
+    summary = None
+    if samplerSettings['warmStart']:
+        summary = posterior_summary(mc, str(year), labels)
+    if samplerSettings['trace'] == 'stream' and \
+        not samplerSettings['keepTraces']:
+        mc.db.remove()
+    report_worker('year %d' %year, start, before)
     
-    return {'stats':mc.stats(), 'year':year, 'countries':representedCountries, \
+    res = {'stats':stats, 'year':year, 'countries':representedCountries, \
+           'languages': representedLanguages, 'genres':representedGenres, \
+           'num': numRepresented, 'burn': burn, 'seconds': seconds}
+    if summary is not None:
+        res['summary'] = summary
+    return res
+
+
+def dotheJointMCMC(ranges):
+    '''
+        Fits film_model_all_years() to all the years at once, so that the 
+        global average and the deviations vary smoothly from year to year. The 
+        shared data must have been attached with attach_shared_data().
+        
+        Parameters
+        ----------
+        
+        ranges: list of tuples
+            the (year, start, stop) tuples returned by share_wrangled_data()
+        
+        Returns
+        -------
+        
+        list of dictionaries
+            one for each year, with the same entries as the dictionary returned
+            by dotheMCMC()
+        
+        '''
+    start = time.time()
+    before = memory_usage()
+    results = []
+    groups, dicts = [], []
+    for year, first, stop in ranges:
+        group = year_group(first, stop)
+        cou, lan, gen, num = get_all_represented(group)
+        groups.append(group)
+        dicts.append((cou, lan, gen))
+        results.append({'year': year, 'countries': cou, 'languages': lan, \
+                        'genres': gen, 'num': num})
+    stats = sample_all_years(film_model_all_years([x[0] for x in ranges], \
+                             groups, dicts), iter=samplerSettings['jointIter'],\
+                             burn=samplerSettings['jointBurn'], \
+                             thin=samplerSettings['jointThin'])
+    for res in results:
+        res['stats'] = stats[res['year']]
+    report_worker('all years jointly', start, before)
+    return results
+
+def dotheVI(x):
+    '''
+        As dotheMCMC() but the model is fitted by variational inference with
+        film_vi_by_year(), which takes a fraction of a second per year. x is 
+        (year, start, stop), the returned dictionary has the same entries as 
+        that of dotheMCMC() except burn and summary.
+        '''
+    start = time.time()
+    before = memory_usage()
+    year = x[0]
+    group = year_group(x[1], x[2])
+    representedCountries, representedLanguages, representedGenres, \
+        numRepresented = get_all_represented(group)
+    stats = film_vi_by_year(str(year), group, representedCountries, \
+                            representedLanguages, representedGenres, \
+                            numRepresented, \
+                            meanField=samplerSettings['meanField'])
+    seconds = time.time() - start
+    report_worker('year %d (vi)' %year, start, before)
+    return {'stats':stats, 'year':year, 'countries':representedCountries, \
             'languages': representedLanguages, 'genres':representedGenres, \
-            'num': numRepresented}
+            'num': numRepresented, 'seconds': seconds}
 
+def dotheMAP(x):
+    '''
+        As dotheVI() but the model is fitted by finding the posterior mode and 
+        the Laplace approximation around it with film_map_by_year()
+        '''
+    start = time.time()
+    before = memory_usage()
+    year = x[0]
+    group = year_group(x[1], x[2])
+    representedCountries, representedLanguages, representedGenres, \
+        numRepresented = get_all_represented(group)
+    stats = film_map_by_year(str(year), group, representedCountries, \
+                             representedLanguages, representedGenres, \
+                             numRepresented)[0]
+    seconds = time.time() - start
+    report_worker('year %d (map)' %year, start, before)
+    return {'stats':stats, 'year':year, 'countries':representedCountries, \
+            'languages': representedLanguages, 'genres':representedGenres, \
+            'num': numRepresented, 'seconds': seconds}
+
+def compare_vi(mcmcResults, viResults, fileName):
+    '''
+        Writes the posterior mean and standard deviation of the global average 
+        and of every deviation found by MCMC and by variational inference to 
+        fileName, and prints a summary for each year: the difference in the 
+        global average, the median and largest difference in the means in units
+        of the MCMC standard deviation, and the median ratio of the VI to the 
+        MCMC standard deviation. A ratio well below one means VI is 
+        overconfident.
+        
+        Parameters
+        ----------
+        
+        mcmcResults, viResults: lists of dictionaries
+            the results of dotheMCMC() and dotheVI() for the same years
+        
+        fileName: string
+            the csv file to write
+        
+        '''
+    viResults = dict([(res['year'], res) for res in viResults])
+    with codecs.open(fileName, 'w', 'utf-8') as f:
+        f.write('date,category,QSame,number,mcmcMean,viMean,mcmcSD,viSD\n')
+        for res in sorted(mcmcResults, key=lambda r: r['year']):
+            year = str(res['year'])
+            vi = viResults[res['year']]
+            mcGlobal = res['stats'][year+'_global']
+            viGlobal = vi['stats'][year+'_global']
+            f.write(','.join([year, 'Global', '-1', str(res['num']), \
+                    str(10.**mcGlobal['mean']), str(10.**viGlobal['mean']), \
+                    str(mcGlobal['standard deviation']), \
+                    str(viGlobal['standard deviation'])]) + '\n')
+            mcDev = res['stats'][year+'_linDev']
+            viDev = vi['stats'][year+'_linDev']
+            position = 0
+            same = True
+            for name in ['countries', 'languages', 'genres']:
+                for overlap in ['same', 'diff']:
+                    for entry, count in res[name][overlap]:
+                        f.write(','.join([year, entry, str(same), str(count), \
+                                str(mcDev['mean'][position]), \
+                                str(viDev['mean'][position]), \
+                                str(mcDev['standard deviation'][position]), \
+                                str(viDev['standard deviation'][position])]) \
+                                + '\n')
+                        position += 1
+                    same = not same
+            mcSD = mcDev['standard deviation']
+            shift = np.abs(viDev['mean'] - mcDev['mean']) / mcSD
+            ratio = viDev['standard deviation'] / mcSD
+            print 'year %s: global %.2f vs %.2f minutes, mean shift median ' \
+                '%.2f max %.2f SDs, SD ratio median %.2f (%.1fs vs %.1fs)' \
+                %(year, 10.**mcGlobal['mean'], 10.**viGlobal['mean'], \
+                  np.median(shift), shift.max(), np.median(ratio), \
+                  res['seconds'], vi['seconds'])
 
 
 if __name__=='__main__':
-    #group by year
-    grp = wrangledDf.groupby('date')
-    initializeStats()
+    parser = argparse.ArgumentParser(description='MCMC analysis of the ' \
+                                     'wrangled film data')
+    parser.add_argument('--method', choices=['year', 'joint', 'vi', 'map'], \
+                        default='year', help='fit each year separately or ' \
+                        'all years jointly with smoothly varying parameters, ' \
+                        'or fit each year by variational inference or by its '\
+                        'posterior mode')
+    parser.add_argument('--batch-small', type=int, metavar='FILMS', \
+                        help='analyse the years with fewer than FILMS films ' \
+                        'together, several to a worker')
+    parser.add_argument('--batch-size', type=int, default=16, \
+                        help='the number of small years analysed together')
+    parser.add_argument('--map-init', action='store_true', \
+                        help='start each chain from the posterior mode of its ' \
+                        'year')
+    parser.add_argument('--group-films', action='store_true', \
+                        help='collapse the films that share the same mean ' \
+                        'into groups before sampling')
+    parser.add_argument('--mean-field', action='store_true', \
+                        help='use independent components for the variational ' \
+                        'approximation')
+    parser.add_argument('--compare-vi', type=int, nargs='+', metavar='YEAR', \
+                        help='fit these years by both MCMC and variational ' \
+                        'inference and write vi_comparison.csv instead of the ' \
+                        'results')
+    parser.add_argument('--trace', choices=['ram', 'stream'], default='ram', \
+                        help='keep the traces in memory or stream them to ' \
+                        'disk')
+    parser.add_argument('--thin', type=int, default=1, \
+                        help='keep one sample in every THIN')
+    parser.add_argument('--chunk', type=int, default=1000, \
+                        help='samples held in memory per variable before ' \
+                        'they are written to disk when streaming')
+    parser.add_argument('--keep-traces', action='store_true', \
+                        help='do not delete the streamed traces')
+    parser.add_argument('--warm-start', action='store_true', \
+                        help='start each chain from the posterior of a ' \
+                        'neighbouring year')
+    parser.add_argument('--warm-burn', type=int, default=5000, \
+                        help='burn-in iterations for a warm started chain')
+    parser.add_argument('--force', action='store_true', \
+                        help='analyse every year, even those whose stored ' \
+                        'results are current')
+    parser.add_argument('--no-cache', action='store_true', \
+                        help='do not look up or store the results of each ' \
+                        'year in the cache')
+    parser.add_argument('--cache-size', type=int, default=1024, metavar='MB',\
+                        help='the most space the cached results may take up')
+    parser.add_argument('--only', nargs='+', default=[], metavar='COLUMN', \
+                        help='analyse only the films with all of these ' \
+                        'countries, languages and genres, e.g. Cou_France ' \
+                        'Gen_Drama, and write the results to ' \
+                        'results_Cou_France_Gen_Drama.csv')
+    parser.add_argument('--min-films', type=int, default=10, \
+                        help='with --only, skip the years with fewer films')
+    args = parser.parse_args()
+    settings = {'trace': args.trace, 'thin': args.thin, 'chunk': args.chunk, \
+                'keepTraces': args.keep_traces, 'warmStart': args.warm_start, \
+                'warmBurn': args.warm_burn, 'meanField': args.mean_field, \
+                'mapInit': args.map_init, 'groupFilms': args.group_films, \
+                'only': args.only}
+    samplerSettings.update(settings)
+    processes = 4
+    
+    #read the data once and find the rows released in each year
+    start = time.time()
+    npyName = DIRECTORY+'/film_wrangled.npy'
+    columns, ranges = share_wrangled_data(DIRECTORY+'/film_wrangled.csv', \
+                                          npyName)
+    print 'shared data written in %.2fs, memory %.1fMB' %(time.time()-start, \
+                                                           memory_usage())
+    resultsName = 'results'
+    if args.only:
+        #the films of a subset are found from the index and their results 
+        #are kept apart from those of all the films
+        attach_shared_data(npyName, columns, settings)
+        missing = [key for key in args.only if key not in sharedIndex.keys]
+        if missing:
+            parser.error('no indexed columns called %s' %', '.join(missing))
+        #the model compares the films with and without a writer-director
+        #overlap, so a subset cannot be limited to one of them
+        overlap = [key for key in args.only if key in ['Overlap', \
+                                                       'nonOverlap']]
+        if overlap:
+            parser.error('--only cannot select %s, the model needs films ' \
+                         'with and without an overlap' %', '.join(overlap))
+        films = dict((year, len(sharedIndex.query(args.only, rows=(first, \
+                      stop)))) for year, first, stop in ranges)
+        ranges = [x for x in ranges if films[x[0]] >= args.min_films]
+        print '%d films of %s in %d years with at least %d of them' \
+            %(sum(films.values()), ' and '.join(args.only), len(ranges), \
+              args.min_films)
+        resultsName = '_'.join(['results'] + args.only)
+    if args.compare_vi:
+        p=mp.Pool(processes=processes, initializer=attach_shared_data, \
+                  initargs=(npyName, columns, settings))
+        selected = [x for x in ranges if x[0] in args.compare_vi]
+        compare_vi(p.map(dotheMCMC, selected), p.map(dotheVI, selected), \
+                   DIRECTORY+'/vi_comparison.csv')
+        p.close()
+        p.join()
+        sys.exit()
+    
+    #skip the years whose input, settings and model are unchanged since their
+    #results were stored. Settings that only affect how traces are kept are 
+    #left out of the hash
+    store = ResultsStore(DIRECTORY+'/'+resultsName+'.db')
+    attach_shared_data(npyName, columns, settings)
+    runSettings = dict((key, value) for key, value in samplerSettings.items() \
+                       if key not in ['trace', 'chunk', 'traceDir', \
+                                      'keepTraces'])
+    runSettings.update({'method': args.method, 'batchSmall': args.batch_small, \
+                        'batchSize': args.batch_size})
+    hashes = dict((year, input_hash(year_group(first, stop).values, columns, \
+                   runSettings)) for year, first, stop in ranges)
+    stale = [x for x in ranges if args.force or \
+             not store.is_current(x[0], hashes[x[0]])]
+    if args.method == 'joint' and stale:
+        #every year of the joint model depends on all the others
+        stale = ranges
+    print '%d of %d years are current and are skipped' %(len(ranges) - \
+                                                         len(stale), len(ranges))
+    #every year of the data is analysed or current, so the stored results of
+    #any other year are out of date
+    years = [x[0] for x in ranges]
+    ranges = stale
+    
+    #look up the remaining years in the cache of earlier results, keyed on the
+    #year's data, the represented entries, the settings and the model version
+    cache, keys, cached = None, {}, []
+    if not args.no_cache:
+        cache = DiskCache(DIRECTORY+'/cache', maxBytes=args.cache_size * 2**20)
+        for year, first, stop in ranges:
+            group = year_group(first, stop)
+            keys[year] = cache_key(group.values, columns, \
+                                   get_all_represented(group), runSettings, \
+                                   MODEL_VERSION)
+        hits = dict((year, cache.get(key)) for year, key in keys.items())
+        if args.method == 'joint' and None in hits.values():
+            hits = {}
+        cached = [hits[x[0]] for x in ranges if hits.get(x[0]) is not None]
+        ranges = [x for x in ranges if hits.get(x[0]) is None]
+        print '%d years found in the cache' %len(cached)
+    for res in cached:
+        res['cached'] = True
     
     #perform the analysis of films released in different years in parallel
-    #the results of the analysis are written to results.csv by writeStats()
-    p=mp.Pool(processes=4)
-    results = p.imap_unordered(dotheMCMC, grp)
-    #as each result becomes available, write them to file
+    #the results of the analysis are written to the results store by 
+    #writeStats() and exported to results.csv at the end
+    if args.method == 'joint':
+        p = None
+        results = dotheJointMCMC(ranges) if ranges else []
+    else:
+        p=mp.Pool(processes=processes, initializer=attach_shared_data, \
+                  initargs=(npyName, columns, settings))
+        batched = []
+        if args.method == 'year' and args.batch_small:
+            batches, ranges = batch_schedule(ranges, args.batch_small, \
+                                             args.batch_size)
+            batched = (res for batch in p.imap_unordered(dotheMCMCBatch, \
+                       batches) for res in batch)
+        if args.warm_start:
+            results = (res for block in p.imap_unordered(dotheMCMCBlock, \
+                       warm_schedule(ranges, processes)) for res in block)
+        elif args.method == 'vi':
+            results = p.imap_unordered(dotheVI, ranges)
+        elif args.method == 'map':
+            results = p.imap_unordered(dotheMAP, ranges)
+        else:
+            results = p.imap_unordered(dotheMCMC, ranges)
+        results = itertools.chain(batched, results)
+    results = itertools.chain(cached, results)
+    #as each result becomes available, write them to file. The writing is done
+    #by a background thread so that handing out work is never held up by it
+    writer = ResultsWriter(DIRECTORY+'/'+resultsName+'.db')
+    saved = 0.
     for res in results:
+        if cache is not None and not res.get('cached'):
+            writer.submit(cache.put, keys[res['year']], res)
+        if res.get('burn', samplerSettings['burn']) < samplerSettings['burn'] \
+            and not res.get('cached'):
+            #estimate the time saved from the time per iteration of this year
+            perIteration = res['seconds'] / (res['burn'] + \
+                            samplerSettings['iter'] - samplerSettings['burn'])
+            burnSaved = samplerSettings['burn'] - res['burn']
+            saved += burnSaved * perIteration
+            origin = 'the posterior mode' if res.get('warmFrom') is None \
+                        else str(res['warmFrom'])
+            print 'year %d: warm started from %s, %d fewer burn-in ' \
+                'iterations, %.1fs saved' %(res['year'], origin, burnSaved, \
+                                            burnSaved * perIteration)
         mcStat = res['stats']
         year = res['year']
         couSame = res['countries']['same']
@@ -309,8 +1015,20 @@ if __name__=='__main__':
         genDiff =res['genres']['diff']
         num = res['num']
         
-        writeStats(mcStat, couSame, couDiff, lanSame, lanDiff, genSame, \
-                   genDiff, year, num)
-    p.close()
-    p.join()
+        writeStats(writer, hashes[year], mcStat, couSame, couDiff, lanSame, \
+                   lanDiff, genSame, genDiff, year, num)
+    if p is not None:
+        p.close()
+        p.join()
+    writer.close()
+    dropped = store.keep_years(years)
+    if dropped:
+        print '%d years no longer in the data deleted from the results' \
+            %dropped
+    store.export_csv(DIRECTORY+'/'+resultsName+'.csv')
+    store.close()
+    if cache is not None:
+        cache.evict()
+    if args.warm_start or args.map_init:
+        print 'warm starting saved an estimated %.1fs of sampling' %saved
 
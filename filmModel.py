@@ -26,70 +26,100 @@
 
 import pandas as pd
 import numpy as np
-from pymc import Normal, Gamma, deterministic, MCMC, Matplot, Lambda
+from pymc import Normal, Gamma, deterministic, potential, MCMC, Matplot
+from scipy import sparse
+from scipy.linalg import cholesky_banded, cho_solve_banded, solve_banded
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+from filmTrace import hpd
+
+#the version of the models, stored with their results so that results found 
+#with an older version are recomputed. Change it whenever a change to the 
+#models changes their results
+MODEL_VERSION = '1'
 
 #some helper functions used in the model are defined at the bottom
 
 #the model
-def film_model_by_year(year, group, couDict, lanDict, genDict, numCategories):
-        '''
-        A model of film runtimes for analysis by PyMC2. Intended use:
+def film_model_by_year(year, group, couDict, lanDict, genDict, numCategories, \
+                       init=None, grouped=False):
+    '''
+    A model of film runtimes for analysis by PyMC2. Intended use:
+    
+    mc=MCMC(film_model_by_year(str(year), group, representedCountries, \
+        representedLanguages, representedGenres, numRepresented))
+    mc.sample(iter=300000, burn=75000, progress_bar=False)
+    
+    Parameters
+    ----------
+    
+    year: string
+        the year in which the films to be analyzed were released
+    
+    group: dataframe
+        a pandas dataframe of the films released. The dataframe should have
+        columns for 'length' to denote the log_10 of the runtime of the 
+        film, 'Overlap' and 'nonOverlap' to denote whether one of the 
+        writers was also one of the directors, and 'Cou_[country]' for each 
+        country that denotes whether a film was produced in that country.
+    
+    couDict: dictionary
+        a dictionary of two elements: "same" and "diff". couDict['same'] and
+        couDict['diff'] each contain an array of two element lists. Each 
+        pair is the name of a country and the number of times that country 
+        appears in the group dataframe for overlapping and non-overlapping
+        writer/director respectively. The array is ordered by the number of 
+        appearances from smallest to largest.
         
-        mc=MCMC(film_model_by_year(str(year), group, representedCountries, \
-            representedLanguages, representedGenres, numRepresented))
-        mc.sample(iter=300000, burn=75000, progress_bar=False)
+    lanDict: dictionary
+        as couDict but for languages contained in the dataframe group
         
-        Parameters
-        ----------
+    genDict: dictionary
+        as couDict but for genres contained in the dataframe group
         
-        year: string
-            the year in which the films to be analyzed were released
+    numCategories: integer
+        The total number of entries contained in couDict["same"] plus 
+        couDict["diff"] plus the number of entries in "same" and "diff" for 
+        each of lanDict and genDict.
         
-        group: dataframe
-            a pandas dataframe of the films released. The dataframe should have
-            columns for 'length' to denote the log_10 of the runtime of the 
-            film, 'Overlap' and 'nonOverlap' to denote whether one of the 
-            writers was also one of the directors, and 'Cou_[country]' for each 
-            country that denotes whether a film was produced in that country.
-        
-        couDict: dictionary
-            a dictionary of two elements: "same" and "diff". couDict['same'] and
-            couDict['diff'] each contain an array of two element lists. Each 
-            pair is the name of a country and the number of times that country 
-            appears in the group dataframe for overlapping and non-overlapping
-            writer/director respectively. The array is ordered by the number of 
-            appearances from smallest to largest.
-            
-        lanDict: dictionary
-            as couDict but for languages contained in the dataframe group
-            
-        genDict: dictionary
-            as couDict but for genres contained in the dataframe group
-            
-        numCategories: integer
-            The total number of entries contained in couDict["same"] plus 
-            couDict["diff"] plus the number of entries in "same" and "diff" for 
-            each of lanDict and genDict.
-            
-        Returns
-        -------
+    init: dictionary or None
+        starting values for the chain. init['global'] is the log_10 global 
+        average, init['deviation'] the numCategories-3 unconstrained 
+        deviations ordered as free_deviation_labels() and init['sigma'] the 
+        value of sigmaObs. If None the chain starts at a global average of 100 
+        minutes with all deviations zero.
         
-        This function is intented to be analysed by pyMC. It is therefore more 
-            pertinent to look at the returns in the dictionary mc.stats() which 
-            contain the results of the Markov Chain Monte Carlo analysis.
+    grouped: bool
+        if True group is not a dataframe of films but the groups of films 
+        returned by group_films(). The likelihood is the same but it is
+        evaluated once per group rather than once per film.
         
-        mc.stats()["<year>_global"]
-            The log_10 of the average runtime in minutes of all the movies in 
-            group
-            
-        mc.stats()["<year>_linDev"]
-            The average number of minutes (NOT log_10 minutes) by which each 
-            categories average runtime differs from the global average runtime.
+    Returns
+    -------
+    
+    This function is intented to be analysed by pyMC. It is therefore more 
+        pertinent to look at the returns in the dictionary mc.stats() which 
+        contain the results of the Markov Chain Monte Carlo analysis.
+    
+    mc.stats()["<year>_global"]
+        The log_10 of the average runtime in minutes of all the movies in 
+        group
         
-        '''
+    mc.stats()["<year>_log10_categoryDev"]
+        The log_10 deviations of all but the final country, language and genre.
+        The average number of minutes (NOT log_10 minutes) by which each 
+        categories average runtime differs from the global average runtime is
+        found from the traces of these and "<year>_global" by 
+        linear_deviation_stats().
+    
+    '''
+    if init is None:
+        init = {'global': np.log10(100.), \
+                'deviation': np.zeros(numCategories-3), 'sigma': None}
+    
     #the log_10 average runtime of films modelled as a normal distribution
     globalAvg = Normal(year+'_global', mu=np.log10(100.), tau=1./(0.25**2), \
-                       value=np.log10(100.))
+                       value=init['global'])
             
     # create the deviations from that average for each country, language and
     #genre for both writer-director overlap and non-overlap. Assume that the
@@ -98,9 +128,10 @@ def film_model_by_year(year, group, couDict, lanDict, genDict, numCategories):
     #fixed to ensure 0 total deviation.
     category_deviation = Normal(year+'_log10_categoryDev', mu=0, \
                                 tau=1./(0.25**2), size = numCategories-3, \
-                                value=np.zeros(numCategories-3))
+                                value=init['deviation'])
     
-    @deterministic
+    #the deviations follow from category_deviation so they are not traced
+    @deterministic(trace=False)
     def deviation(dev=category_deviation):
         '''
         demand that the total deviation is 0 be making the final deviation in
@@ -124,79 +155,656 @@ def film_model_by_year(year, group, couDict, lanDict, genDict, numCategories):
             values are such that the total, weighted deviation in each category 
             is 0:
             '''
-
-        #insert the final country deviation value
-        dev = deviation_insert_val(dev, couDict, 0)
-        #insert the final language deviation value
-        offset = couDict['same'].shape[0]+couDict['diff'].shape[0]
-        dev = deviation_insert_val(dev, lanDict, offset)
-        #insert the final genre deviation value
-        offset += lanDict['same'].shape[0] + LanDiffLen=lanDict['diff'].shape[0]
-        dev = deviation_insert_val(dev, genDict, offset)
-        
-        return dev
+        return insert_constrained(dev, couDict, lanDict, genDict)
     
-    @deterministic
-    def mu(a=globalAvg, dev=deviation):
-        '''
-            Calculates the mean associated with each film given its listed 
-            country(ies), language(s), genre(s) and whether there is 
-            writer-director overlap or non-overlap.
+    #mu has one entry per film, or per group of films if grouped, and is only 
+    #needed to evaluate the likelihood so it is not traced
+    if grouped:
+        #the design matrix of the groups is built once, which is much faster 
+        #than get_deviations() when the mean is found for every sample
+        X = design_matrix(group, couDict, lanDict, genDict)
+        
+        @deterministic(trace=False)
+        def mu(a=globalAvg, dev=deviation):
+            '''the mean associated with each group of films, as below'''
+            return a + X.dot(dev)
+    else:
+        @deterministic(trace=False)
+        def mu(a=globalAvg, dev=deviation):
+            '''
+                Calculates the mean associated with each film given its listed 
+                country(ies), language(s), genre(s) and whether there is 
+                writer-director overlap or non-overlap.
+                
+                A film is listed in the group dataframe as having been made in 
+                one or more countries, in one or more languages and as fitting 
+                one or more genres. Each of these descriptors has an associated
+                deviation from the global average and these deviations vary 
+                depending on whether or not the writer was also the director.
+                
+                To get the deviation from the average associated with a 
+                particular film, every deviation associated with the films 
+                descriptors are added together and the total is divided by the
+                number of descriptors.
+                
+                The total average is obtained by adding this deviation to the 
+                global average
+                '''
+            #calculate the deviations for each film based on country...
+            cou_same, cou_diff = get_deviations(couDict['same'][:,0], \
+                                                couDict['diff'][:,0], dev, \
+                                                u'Cou_', group, offset=0)
             
-            A film is listed in the group dataframe as having been made in one 
-            or more countries, in one or more languages and as fitting one or 
-            more genres. Each of these descriptors has an associated deviation 
-            from the global average and these deviations vary depending on 
-            whether or not the writer was also the director.
+            #...then language...
+            offset = couDict['same'].shape[0] + couDict['diff'].shape[0]
+            lan_same, lan_diff = get_deviations(lanDict['same'][:,0], \
+                                                lanDict['diff'][:,0],dev, \
+                                                u'Lan_', group, offset=offset)
             
-            To get the deviation from the average associated with a particular 
-            film, every deviation associated with the films descriptors are 
-            added together and the total is divided by the number of 
-            descriptors.
+            #...and finally by genre
+            offset+=lanDict['same'].shape[0] + lanDict['diff'].shape[0]
+            gen_same, gen_diff = get_deviations(genDict['same'][:,0], \
+                                                genDict['diff'][:,0], dev, \
+                                                u'Gen_', group, offset=offset)
             
-            The total average is obtained by adding this deviation to the global
-            average
-            '''
-        #calculate the deviations for each film based on country...
-        cou_same, cou_diff = get_deviations(couDict['same'][:,0], \
-                                            couDict['diff'][:,0], dev, u'Cou_',\
-                                            group, offset=0)
-        
-        #...then language...
-        offset = couDict['same'].shape[0] + couDict['diff'].shape[0])
-        lan_same, lan_diff = get_deviations(lanDict['same'][:,0], \
-                                            lanDict['diff'][:,0],dev, u'Lan_', \
-                                            group, offset=offset
-        
-        #...and finally by genre
-        offset+=lanDict['same'].shape[0] + lanDict['diff'].shape[0]
-        gen_same, gen_diff = get_deviations(genDict['same'][:,0], \
-                                            genDict['diff'][:,0], dev, u'Gen_',\
-                                            group, offset=offset)
-        
-        #then combine for the total predicted average.
-        return a + (cou_same + cou_diff + lan_same + lan_diff \
-                    + gen_same + gen_diff)/3.
+            #then combine for the total predicted average.
+            return a + (cou_same + cou_diff + lan_same + lan_diff \
+                        + gen_same + gen_diff)/3.
     
     #model the standard deviation of the normal distribution of runtimes as a
     #gamma function
-    sigmaObs=Gamma(year+'_sigmaObs', alpha=1, beta=5)
+    sigmaObs=Gamma(year+'_sigmaObs', alpha=1, beta=5, value=init['sigma'])
                                             
     # model the observed distribution of log_10 film runtimes as a normal
     #distribution with mean given by mu and standard deviation given by sigmaObs
-    obs = Normal(year+'_obs', mu=mu, tau=1./(sigmaObs**2), \
-                 value=group[u'length'].values, observed=True)
+    if grouped:
+        count = group[u'count'].values
+        groupMean = group[u'length'].values
+        sumSquares = group[u'sumSquares'].values.sum()
+        
+        @potential(name=year+'_obs')
+        def obs(mu=mu, sigma=sigmaObs):
+            '''
+                The log likelihood of the films, found from the statistics of 
+                each group as the films of a group share the same mu
+                '''
+            return -0.5 * (count.sum() * np.log(2. * np.pi * sigma**2) + \
+                           (sumSquares + count.dot((groupMean - mu)**2)) / \
+                           sigma**2)
+    else:
+        obs = Normal(year+'_obs', mu=mu, tau=1./(sigmaObs**2), \
+                     value=group[u'length'].values, observed=True)
     
-    # calculate the deviation from the average in minutes. 
-    linear_deviation = Lambda(year+"_linDev", lambda x=globalAvg, y=deviation:\
-                              10.**(x+y) - 10.**(x))
-            
+    #the deviations in minutes are not part of the model, they are found from 
+    #the trace after sampling by linear_deviation_stats()
     return locals()
 
 
 
+def film_model_all_years(years, groups, dicts):
+    '''
+    A model of film runtimes in which all years are fitted jointly. In each
+    year the runtimes are modelled exactly as in film_model_by_year but, rather
+    than each year having independent parameters, the global average and each
+    deviation follow a Gaussian random walk from one year to the next:
+    
+    global[t] ~ Normal(global[t-1], variance=gap/tauGlobal)
+    deviation[t] ~ Normal(deviation[t-1], variance=gap/tauDeviation)
+    
+    where gap is the number of years between t-1 and t. The parameters are
+    drawn by sample_all_years(). Intended use:
+    
+    model = film_model_all_years(years, groups, dicts)
+    stats = sample_all_years(model, iter=6000, burn=1000, thin=5)
+    
+    Parameters
+    ----------
+    
+    years: list of integers
+        the years to be analyzed in ascending order
+    
+    groups: list of dataframes
+        the films released in each year, as the group of film_model_by_year
+    
+    dicts: list of tuples
+        the (couDict, lanDict, genDict) of each year, see film_model_by_year
+    
+    Returns
+    -------
+    
+    dictionary
+        the data in the form used by sample_all_years(). 'X' is a sparse matrix
+        with one row per film and one column per (prefix, entry, overlap) label
+        appearing in any year such that the mean of each film is
+        global[t] + X.dot(deviation[:, t]). 'pairs' lists the (label, year)
+        pairs that are represented, in the order of deviation_labels() within
+        each year, together with the weights of the sum-to-zero constraints.
+    
+    '''
+    labels = []
+    column = {}
+    y, t, X = [], [], []
+    pairLabel, pairYear, pairType, pairWeight, yearPairs = [], [], [], [], []
+    for i, (group, (couDict, lanDict, genDict)) in enumerate(zip(groups, dicts)):
+        yearLabels = deviation_labels(couDict, lanDict, genDict)
+        for label in yearLabels:
+            if label not in column:
+                column[label] = len(labels)
+                labels.append(label)
+        design = design_matrix(group, couDict, lanDict, genDict).tocoo()
+        X.append((design.data, len(y) + design.row, \
+                  [column[yearLabels[c]] for c in design.col]))
+        y = np.append(y, group[u'length'].values)
+        t = np.append(t, np.repeat(i, len(group)))
+        #the number of films of each represented label weight the constraints
+        weights = [row[1] for categoryDict in [couDict, lanDict, genDict] \
+                   for overlap in ['same', 'diff'] \
+                   for row in categoryDict[overlap]]
+        yearPairs.append(np.arange(len(pairLabel), \
+                                   len(pairLabel) + len(yearLabels)))
+        pairLabel += [column[label] for label in yearLabels]
+        pairYear += [i] * len(yearLabels)
+        pairType += [[u'Cou_', u'Lan_', u'Gen_'].index(label[0]) \
+                     for label in yearLabels]
+        pairWeight += list(np.float64(weights))
+    data = np.concatenate([x[0] for x in X])
+    rows = np.concatenate([x[1] for x in X])
+    cols = np.concatenate([x[2] for x in X])
+    return {'years': np.array(years), 'gaps': np.float64(np.diff(years)), \
+            'y': y, 't': np.int64(t), 'labels': labels, \
+            'X': sparse.csc_matrix((data, (rows, cols)), \
+                                   shape=(len(y), len(labels))), \
+            'pairLabel': np.array(pairLabel, dtype=int), \
+            'pairYear': np.array(pairYear, dtype=int), \
+            'pairType': np.array(pairType, dtype=int), \
+            'pairWeight': np.array(pairWeight), 'yearPairs': yearPairs}
+
+def sample_all_years(model, iter=6000, burn=1000, thin=5, seed=None, \
+                     alpha=0.05):
+    '''
+    Draws from the posterior of film_model_all_years by Gibbs sampling. The
+    conditional distribution of a whole random walk (the global average or one
+    deviation over all years) is Normal with a tridiagonal precision matrix so
+    each is drawn in one go by a banded Cholesky decomposition. The cost of a
+    sweep therefore grows linearly with the number of years and films. sigmaObs
+    has the same Gamma(1, 5) prior as film_model_by_year, one per year, and is
+    updated by Metropolis steps. The random walk precisions have Gamma(1, 1e-4)
+    priors.
+    
+    The likelihood is unchanged when a constant is added to every deviation of
+    a category (country, language or genre) in a year and a third of it is
+    taken from the global average. Each kept sample is therefore moved along
+    that direction so that it satisfies the sum-to-zero constraints of
+    film_model_by_year.
+    
+    Parameters
+    ----------
+    
+    model: dictionary
+        as returned by film_model_all_years()
+    
+    iter, burn, thin: integers
+        the number of sweeps, the number discarded as burn-in and the interval
+        between kept samples
+    
+    seed: integer or None
+        seed for the random number generator
+    
+    alpha: float
+        the HPD intervals contain 1-alpha of the posterior
+    
+    Returns
+    -------
+    
+    dictionary
+        for each year a dictionary in the format of mc.stats() of
+        film_model_by_year containing "<year>_global" and "<year>_linDev"
+    
+    '''
+    rng = np.random.RandomState(seed)
+    years, gaps, y, t, X = model['years'], model['gaps'], model['y'], \
+                            model['t'], model['X']
+    T, K = len(years), X.shape[1]
+    films = np.float64(np.bincount(t, minlength=T))
+    #weights of the random walk differences, w[t] links year t and t+1
+    w = 1. / gaps
+    rwDiag = np.append(w, 0.) + np.append(0., w)
+    priorPrecision = 1. / 0.25**2
+    
+    globalAvg = np.repeat(np.log10(100.), T)
+    deviation = np.zeros((K, T))
+    logSigma = np.repeat(np.log(0.2), T)
+    tauGlobal, tauDeviation = 1e4, 1e4
+    residual = y - globalAvg[t]
+    
+    #the films, weights and years of each column of X
+    columns = []
+    for k in range(K):
+        rows = X.indices[X.indptr[k]:X.indptr[k + 1]]
+        x = X.data[X.indptr[k]:X.indptr[k + 1]]
+        columns.append((rows, x, t[rows], \
+                        np.bincount(t[rows], x**2, minlength=T)))
+    
+    pairLabel, pairYear, pairType = model['pairLabel'], model['pairYear'], \
+                                    model['pairType']
+    pairWeight = model['pairWeight']
+    constraint = pairYear * 3 + pairType
+    constraintTotal = np.bincount(constraint, pairWeight, minlength=3 * T)
+    kept = len(range(burn, iter, thin))
+    globalTrace = np.empty((kept, T))
+    linearTrace = np.empty((kept, len(pairLabel)), dtype=np.float32)
+    
+    step = 1. / np.sqrt(2. * films + 1.)
+    n = 0
+    for i in range(iter):
+        precision = np.exp(-2. * logSigma)
+        
+        #the global average
+        residual += globalAvg[t]
+        b = precision * np.bincount(t, residual, minlength=T)
+        b[0] += priorPrecision * np.log10(100.)
+        diag = tauGlobal * rwDiag + precision * films
+        diag[0] += priorPrecision
+        globalAvg = _sample_tridiagonal(diag, -tauGlobal * w, b, rng)
+        residual -= globalAvg[t]
+        
+        #each deviation
+        for k, (rows, x, tk, xsq) in enumerate(columns):
+            residual[rows] += x * deviation[k, tk]
+            b = precision * np.bincount(tk, x * residual[rows], minlength=T)
+            diag = tauDeviation * rwDiag + precision * xsq
+            diag[0] += priorPrecision
+            deviation[k] = _sample_tridiagonal(diag, -tauDeviation * w, b, rng)
+            residual[rows] -= x * deviation[k, tk]
+        
+        #sigmaObs of each year, p(log sigma) includes the Jacobian
+        squares = np.bincount(t, residual**2, minlength=T)
+        logPost = lambda s: -films * s - squares * np.exp(-2. * s) / 2. \
+                            - 5. * np.exp(s) + s
+        for j in range(3):
+            proposal = logSigma + step * rng.standard_normal(T)
+            accept = np.log(rng.uniform(size=T)) < \
+                        logPost(proposal) - logPost(logSigma)
+            logSigma = np.where(accept, proposal, logSigma)
+        
+        #the precisions of the random walks
+        tauGlobal = rng.gamma(1. + (T - 1) / 2., \
+                    1. / (1e-4 + (np.diff(globalAvg)**2 * w).sum() / 2.))
+        tauDeviation = rng.gamma(1. + K * (T - 1) / 2., \
+                    1. / (1e-4 + (np.diff(deviation)**2 * w).sum() / 2.))
+        
+        if i >= burn and (i - burn) % thin == 0:
+            #move the sample onto the sum-to-zero constraints
+            dev = deviation[pairLabel, pairYear]
+            shift = np.bincount(constraint, pairWeight * dev, \
+                                minlength=3 * T) / constraintTotal
+            shift[constraintTotal == 0] = 0.
+            dev = dev - shift[constraint]
+            glob = globalAvg + shift.reshape(T, 3).sum(1) / 3.
+            globalTrace[n] = glob
+            linearTrace[n] = 10.**(glob[pairYear] + dev) - \
+                                10.**glob[pairYear]
+            n += 1
+    
+    stats = {}
+    for i, year in enumerate(years):
+        linear = np.float64(linearTrace[:, model['yearPairs'][i]])
+        interval = '%d%% HPD interval' %int(100 * (1 - alpha))
+        stats[year] = {str(year)+'_global': {'n': kept, \
+                        'mean': globalTrace[:, i].mean(), \
+                        'standard deviation': globalTrace[:, i].std(), \
+                        interval: hpd(globalTrace[:, i], alpha)}, \
+                       str(year)+'_linDev': {'n': kept, \
+                        'mean': linear.mean(0), \
+                        'standard deviation': linear.std(0), \
+                        interval: hpd(linear, alpha)}}
+    return stats
+
+
+def sample_years_batched(years, groups, dicts, iter=6000, burn=1000, thin=5, \
+                         seed=None, alpha=0.05):
+    '''
+    Draws from the posterior of film_model_by_year for several years at once.
+    The years are independent, so their parameters form one block-diagonal 
+    problem and the chains of all the years are advanced in lock-step with
+    vectorized operations. This removes the per-year overhead that dominates 
+    the analysis of the small early years.
+    
+    Each sweep is a Gibbs update of beta, the global average followed by the 
+    unconstrained deviations, whose conditional distribution given sigmaObs is
+    Normal, followed by Metropolis updates of log(sigmaObs). Both only need the
+    normal_equations() of each year. The years are padded to the same number
+    of parameters; the padding has no data and is drawn from the prior. 
+    
+    The prior precision of beta is the same for every component, so the 
+    eigenvectors V of Z^T Z = V diag(lambda) V^T are also the eigenvectors of 
+    the conditional precision Z^T Z / sigmaObs^2 + P. The eigenvectors of all 
+    the years are found once, in a single call on the stacked matrices, after
+    which beta = V u with the components of u independent. A sweep therefore 
+    costs O(number of parameters) per year and needs no factorization.
+    
+    Parameters
+    ----------
+    
+    years: list
+        the years, as integers
+    
+    groups: list of dataframes
+        the films of each year, as in film_model_by_year
+    
+    dicts: list of tuples
+        (couDict, lanDict, genDict) for each year, as in film_model_by_year
+    
+    iter, burn, thin: integers
+        the number of sweeps, the number discarded as burn-in and the interval
+        between kept samples
+    
+    seed: integer or None
+        seed for the random number generator
+    
+    alpha: float
+        the HPD intervals contain 1-alpha of the posterior
+    
+    Returns
+    -------
+    
+    dictionary
+        for each year a dictionary in the format of mc.stats() of
+        film_model_by_year containing "<year>_global", "<year>_linDev" and 
+        "<year>_sigmaObs"
+    
+    '''
+    rng = np.random.RandomState(seed)
+    equations = [normal_equations(group, *d) for group, d in zip(groups, dicts)]
+    B = len(years)
+    D = max([len(e[2]) for e in equations])
+    priorPrecision = 1. / 0.25**2
+    ZZ = np.zeros((B, D, D))
+    Zy = np.zeros((B, D))
+    yy = np.array([e[3] for e in equations])
+    films = np.float64([e[4] for e in equations])
+    for j, (C, ZZj, Zyj, yyj, N) in enumerate(equations):
+        ZZ[j, :len(Zyj), :len(Zyj)] = ZZj
+        Zy[j, :len(Zyj)] = Zyj
+    priorTerm = np.zeros((B, D))
+    priorTerm[:, 0] = priorPrecision * np.log10(100.)
+    eigenvalues, V = np.linalg.eigh(ZZ)
+    eigenvalues = np.maximum(eigenvalues, 0.)
+    VtZy = np.einsum('bij,bi->bj', V, Zy)
+    VtPrior = np.einsum('bij,bi->bj', V, priorTerm)
+    
+    logSigma = np.log(np.sqrt(yy / films - (Zy[:, 0] / films)**2) + 1e-3)
+    step = 1. / np.sqrt(2. * films + 1.)
+    kept = len(range(burn, iter, thin))
+    uTrace = np.empty((kept, B, D))
+    sigmaTrace = np.empty((kept, B))
+    n = 0
+    for i in range(iter):
+        #u = V^T beta of every year from its Normal conditional distribution
+        precision = np.exp(-2. * logSigma)[:, np.newaxis]
+        variance = 1. / (eigenvalues * precision + priorPrecision)
+        u = variance * (VtZy * precision + VtPrior) + \
+                np.sqrt(variance) * rng.standard_normal((B, D))
+        
+        #sigmaObs of every year, p(log sigma) includes the Jacobian
+        squares = yy - 2. * (u * VtZy).sum(1) + (eigenvalues * u**2).sum(1)
+        logPost = lambda s: -films * s - squares * np.exp(-2. * s) / 2. \
+                            - 5. * np.exp(s) + s
+        for j in range(3):
+            proposal = logSigma + step * rng.standard_normal(B)
+            accept = np.log(rng.uniform(size=B)) < \
+                        logPost(proposal) - logPost(logSigma)
+            logSigma = np.where(accept, proposal, logSigma)
+        
+        if i >= burn and (i - burn) % thin == 0:
+            uTrace[n] = u
+            sigmaTrace[n] = np.exp(logSigma)
+            n += 1
+    
+    stats = {}
+    for j, year in enumerate(years):
+        C = equations[j][0]
+        beta = uTrace[:, j].dot(V[j].T)[:, :C.shape[1] + 1]
+        stats[year] = gaussian_stats(str(year), beta[:, 0], \
+                                     beta[:, 1:].dot(C.T), sigmaTrace[:, j], \
+                                     alpha)
+    return stats
+
+
+def film_vi_by_year(year, group, couDict, lanDict, genDict, numCategories, \
+                    meanField=False, samples=4000, tol=1e-9, maxIter=100, \
+                    seed=None, alpha=0.05):
+    '''
+    Fits the model of film_model_by_year by variational inference rather than
+    MCMC. The posterior of beta, the global average followed by the
+    unconstrained deviations, is approximated by a Normal distribution q(beta)
+    with a full covariance matrix (or a diagonal one if meanField is True) and
+    the posterior of s = log(sigmaObs) by an independent Normal q(s).
+    
+    Given sigmaObs the mean of the films is linear in beta, so the evidence
+    lower bound and its gradient only depend on the data through the
+    normal_equations() Z^T Z, Z^T y and y^T y, which are computed once. 
+    q(beta) is then updated in closed form and the two parameters of q(s) by 
+    L-BFGS using the analytic gradient, alternating until the mean of q(beta) 
+    stops changing.
+    
+    Parameters
+    ----------
+    
+    year, group, couDict, lanDict, genDict, numCategories:
+        as in film_model_by_year
+    
+    meanField: bool
+        if True q(beta) has independent components
+    
+    samples: integer
+        the number of draws from q used to find the statistics of the linear
+        deviations
+    
+    tol, maxIter: float, integer
+        the iterations stop when no component of the mean of q(beta) changes by
+        more than tol, or after maxIter iterations
+    
+    seed: integer or None
+        seed for the random number generator used to draw from q
+    
+    alpha: float
+        the HPD intervals contain 1-alpha of the posterior
+    
+    Returns
+    -------
+    
+    dictionary
+        statistics in the format of mc.stats() of film_model_by_year for
+        "<year>_global", "<year>_linDev" and "<year>_sigmaObs"
+    
+    '''
+    C, ZZ, Zy, yy, N = normal_equations(group, couDict, lanDict, genDict)
+    D = len(Zy)
+    priorPrecision = 1. / 0.25**2
+    priorTerm = np.zeros(D)
+    priorTerm[0] = priorPrecision * np.log10(100.)
+    
+    def negative_bound(q, A):
+        '''minus the terms of the lower bound that depend on q(s) and their
+            gradient, A is the expected sum of squared residuals times 
+            sigmaObs^2'''
+        mean, var = q[0], np.exp(2. * q[1])
+        E2 = np.exp(-2. * mean + 2. * var)
+        E1 = np.exp(mean + var / 2.)
+        bound = -N * mean - A * E2 / 2. - 5. * E1 + mean + q[1]
+        grad = [-N + A * E2 - 5. * E1 + 1., \
+                -2. * A * var * E2 - 5. * var * E1 + 1.]
+        return -bound, -np.array(grad)
+    
+    q = np.array([np.log(np.sqrt(yy / N - (Zy[0] / N)**2) + 1e-3), np.log(0.1)])
+    m = np.zeros(D)
+    for i in range(maxIter):
+        E2 = np.exp(-2. * q[0] + 2. * np.exp(2. * q[1]))
+        precision = E2 * ZZ + priorPrecision * np.eye(D)
+        factor = cho_factor(precision)
+        mNew = cho_solve(factor, E2 * Zy + priorTerm)
+        if meanField:
+            S = np.diag(1. / np.diag(precision))
+        else:
+            S = cho_solve(factor, np.eye(D))
+        A = yy - 2. * mNew.dot(Zy) + mNew.dot(ZZ).dot(mNew) + (ZZ * S).sum()
+        q = minimize(negative_bound, q, args=(A,), jac=True, \
+                     method='L-BFGS-B').x
+        converged = np.abs(mNew - m).max() < tol
+        m = mNew
+        if converged:
+            break
+    
+    rng = np.random.RandomState(seed)
+    beta = m + rng.standard_normal((samples, D)).dot(np.linalg.cholesky(S).T)
+    sigma = np.exp(q[0] + np.exp(q[1]) * rng.standard_normal(samples))
+    return gaussian_stats(year, beta[:, 0], beta[:, 1:].dot(C.T), sigma, alpha)
+
+
+def film_map_by_year(year, group, couDict, lanDict, genDict, numCategories, \
+                     tol=1e-10, maxIter=200, samples=4000, seed=None, \
+                     alpha=0.05):
+    '''
+    Finds the posterior mode (maximum a posteriori estimate) of the model of 
+    film_model_by_year and approximates the posterior around it by a Normal 
+    distribution (the Laplace approximation).
+    
+    Given sigmaObs the mode of beta, the global average followed by the 
+    unconstrained deviations, is the solution of the weighted least squares 
+    problem
+    
+    (Z^T Z / sigmaObs^2 + P) beta = Z^T y / sigmaObs^2 + P beta0
+    
+    where Z^T Z and Z^T y are the normal_equations() and P and beta0 the 
+    precision and mean of the Normal priors. Given beta the mode of sigmaObs 
+    under its Gamma(1, 5) prior is the positive root of
+    
+    5 sigmaObs^3 + N sigmaObs^2 - RSS = 0
+    
+    with RSS the residual sum of squares. The two steps are alternated until
+    beta stops changing. The covariance of the Laplace approximation is the 
+    inverse of the Hessian of minus the log posterior of beta and sigmaObs at 
+    the mode.
+    
+    Parameters
+    ----------
+    
+    year, group, couDict, lanDict, genDict, numCategories:
+        as in film_model_by_year
+    
+    tol, maxIter: float, integer
+        the iterations stop when no component of beta changes by more than 
+        tol, or after maxIter iterations
+    
+    samples: integer
+        the number of draws from the Laplace approximation used to find the 
+        statistics of the linear deviations
+    
+    seed: integer or None
+        seed for the random number generator used for those draws
+    
+    alpha: float
+        the HPD intervals contain 1-alpha of the posterior
+    
+    Returns
+    -------
+    
+    stats: dictionary
+        statistics in the format of mc.stats() of film_model_by_year for
+        "<year>_global", "<year>_linDev" and "<year>_sigmaObs"
+    
+    mode: dictionary
+        'labels' the free_deviation_labels(), 'mean' the mode of beta, 'cov' 
+        its covariance and 'sigma' the mode of sigmaObs. This is in the format 
+        used to warm start the MCMC of film_model_by_year.
+    
+    '''
+    C, ZZ, Zy, yy, N = normal_equations(group, couDict, lanDict, genDict)
+    D = len(Zy)
+    priorPrecision = 1. / 0.25**2
+    priorTerm = np.zeros(D)
+    priorTerm[0] = priorPrecision * np.log10(100.)
+    
+    rss = lambda b: yy - 2. * b.dot(Zy) + b.dot(ZZ).dot(b)
+    sigma = np.sqrt(yy / N - (Zy[0] / N)**2) + 1e-3
+    beta = np.zeros(D)
+    for i in range(maxIter):
+        betaNew = cho_solve(cho_factor(ZZ / sigma**2 + priorPrecision * \
+                            np.eye(D)), Zy / sigma**2 + priorTerm)
+        #the cubic has a single positive root, the one with largest real part
+        sigma = np.roots([5., N, 0., -max(rss(betaNew), 1e-300)]).real.max()
+        if sigma < 1e-8:
+            raise ValueError('the deviations fit the films of %s exactly, ' \
+                             'the posterior has no mode' %year)
+        converged = np.abs(betaNew - beta).max() < tol
+        beta = betaNew
+        if converged:
+            break
+    
+    #Hessian of minus the log posterior in (beta, sigmaObs)
+    residual = Zy - ZZ.dot(beta)
+    H = np.empty((D + 1, D + 1))
+    H[:D, :D] = ZZ / sigma**2 + priorPrecision * np.eye(D)
+    H[:D, D] = H[D, :D] = 2. * residual / sigma**3
+    H[D, D] = -N / sigma**2 + 3. * rss(beta) / sigma**4
+    cov = cho_solve(cho_factor(H), np.eye(D + 1))
+    
+    rng = np.random.RandomState(seed)
+    L = np.linalg.cholesky(cov)
+    draws = np.append(beta, sigma) + \
+                rng.standard_normal((samples, D + 1)).dot(L.T)
+    stats = gaussian_stats(year, draws[:, 0], draws[:, 1:D].dot(C.T), \
+                           draws[:, D], alpha)
+    mode = {'labels': free_deviation_labels(couDict, lanDict, genDict), \
+            'mean': beta, 'cov': cov[:D, :D], 'sigma': sigma}
+    return stats, mode
+
+
 # define some helper functions to be used by the model
-def deviation_insert_val(devArray, categoryDict, offset, sameLen, diffLen):
+def deviation_labels(couDict, lanDict, genDict):
+    '''
+        Labels each entry of the deviation vector used in film_model_by_year 
+        so that deviations can be matched between years in which different 
+        entries are represented.
+        
+        Parameters
+        ----------
+        
+        couDict, lanDict, genDict: dictionaries
+            as in film_model_by_year
+        
+        Returns
+        -------
+        
+        list of tuples
+            one (prefix, entry, overlap) tuple per deviation, e.g. 
+            (u'Cou_', u'France', True) is the deviation for French films whose
+            writer was also the director.
+        
+        '''
+    labels = []
+    for prefix, categoryDict in [(u'Cou_', couDict), (u'Lan_', lanDict), \
+                                 (u'Gen_', genDict)]:
+        for overlap in ['same', 'diff']:
+            labels += [(prefix, row[0], overlap == 'same') for row in \
+                       categoryDict[overlap]]
+    return labels
+
+def free_deviation_labels(couDict, lanDict, genDict):
+    '''
+        As deviation_labels() but for the unconstrained deviations of 
+        film_model_by_year, i.e. without the final 'diff' entry of each 
+        category whose value is set by deviation_insert_val()
+        '''
+    labels = []
+    for prefix, categoryDict in [(u'Cou_', couDict), (u'Lan_', lanDict), \
+                                 (u'Gen_', genDict)]:
+        labels += [(prefix, row[0], True) for row in categoryDict['same']]
+        labels += [(prefix, row[0], False) for row in categoryDict['diff'][:-1]]
+    return labels
+
+def deviation_insert_val(devArray, categoryDict, offset):
     '''FOR USE IN FILM_MODEL_BY_YEAR
         calculates the weighted average deviation for a category and inserts the
         final deviation value to ensure total deviation is 0, i.e. demand that
@@ -252,6 +860,231 @@ def deviation_insert_val(devArray, categoryDict, offset, sameLen, diffLen):
     return np.insert(devArray, offset+sameLen+diffLen-1, CatFinalDevVal)
 
 
+def insert_constrained(dev, couDict, lanDict, genDict):
+    '''
+        Inserts the final country, language and genre deviations into the
+        unconstrained deviations dev using deviation_insert_val(), see 
+        deviation() in film_model_by_year
+        '''
+    #insert the final country deviation value
+    dev = deviation_insert_val(dev, couDict, 0)
+    #insert the final language deviation value
+    offset = couDict['same'].shape[0]+couDict['diff'].shape[0]
+    dev = deviation_insert_val(dev, lanDict, offset)
+    #insert the final genre deviation value
+    offset += lanDict['same'].shape[0] + lanDict['diff'].shape[0]
+    dev = deviation_insert_val(dev, genDict, offset)
+    return dev
+
+def constraint_transform(couDict, lanDict, genDict):
+    '''
+        The sum-to-zero constraints of film_model_by_year as a linear map: the
+        matrix C such that C.dot(category_deviation) is the full deviation 
+        vector returned by insert_constrained(). The columns of C span the null
+        space of the constraints.
+        '''
+    free = len(free_deviation_labels(couDict, lanDict, genDict))
+    if free == 0:
+        return np.zeros((len(deviation_labels(couDict, lanDict, genDict)), 0))
+    return np.column_stack([insert_constrained(column, couDict, lanDict, \
+                            genDict) for column in np.eye(free)])
+
+def design_matrix(group, couDict, lanDict, genDict):
+    '''
+        Builds the design matrix of film_model_by_year: a sparse matrix X with
+        one row per film and one column per deviation, ordered as
+        deviation_labels(), such that the predicted mean of the films is
+        
+        mu = globalAvg + X.dot(deviation)
+        
+        This is the same calculation as get_deviations() but done once, outside
+        of the model.
+        
+        Parameters
+        ----------
+        
+        group: dataframe
+            the films, as in film_model_by_year
+        
+        couDict, lanDict, genDict: dictionaries
+            as in film_model_by_year
+        
+        Returns
+        -------
+        
+        scipy.sparse.csc_matrix
+        
+        '''
+    columns = []
+    for prefix, entry, same in deviation_labels(couDict, lanDict, genDict):
+        overlap = group[u'Overlap' if same else u'nonOverlap'].values
+        columns.append(overlap * group[prefix+entry].values / \
+                       group[prefix+'TOTAL'].values / 3.)
+    return sparse.csc_matrix(np.column_stack(columns) if columns else \
+                             np.zeros((len(group), 0)))
+
+def normal_equations(group, couDict, lanDict, genDict):
+    '''
+        Given sigmaObs the mean of the films in film_model_by_year is linear 
+        in beta, the global average followed by the unconstrained deviations:
+        
+        mu = Z.dot(beta), Z = [1, design_matrix().dot(constraint_transform())]
+        
+        Returns the constraint transform C, Z^T Z, Z^T y, y^T y and the number 
+        of films N, from which the likelihood of any beta and sigmaObs can be
+        found without returning to the films. Z^T Z is assembled from the 
+        sparse X^T X of the design matrix X so the dense matrix Z is never
+        formed. group may also be the groups of films returned by 
+        group_films(), in which case each row is weighted by its count.
+        '''
+    C = constraint_transform(couDict, lanDict, genDict)
+    X = design_matrix(group, couDict, lanDict, genDict)
+    y = group[u'length'].values
+    if u'count' in group.columns:
+        weights = group[u'count'].values
+        yy = group[u'sumSquares'].values.sum() + weights.dot(y**2)
+    else:
+        weights = np.ones(len(y))
+        yy = y.dot(y)
+    N = weights.sum()
+    XtX = (X.T * sparse.diags(weights) * X).toarray()
+    Xt1 = X.T * weights
+    ZZ = np.empty((C.shape[1] + 1, C.shape[1] + 1))
+    ZZ[0, 0] = N
+    ZZ[0, 1:] = ZZ[1:, 0] = C.T.dot(Xt1)
+    ZZ[1:, 1:] = C.T.dot(XtX).dot(C)
+    Zy = np.append(weights.dot(y), C.T.dot(X.T * (weights * y)))
+    return C, ZZ, Zy, yy, N
+
+def group_films(group, couDict, lanDict, genDict):
+    '''
+        Collapses the films of a year into groups of films that film_model_by_
+        year cannot tell apart: those with the same overlap and the same 
+        entries of the countries, languages and genres represented in the year.
+        The films of a group share the same mean so the likelihood only 
+        depends on the number of films in the group, the mean of their log_10 
+        runtimes and the sum of the squared deviations from that mean.
+        
+        Parameters
+        ----------
+        
+        group: dataframe
+            the films, as in film_model_by_year
+        
+        couDict, lanDict, genDict: dictionaries
+            as in film_model_by_year
+        
+        Returns
+        -------
+        
+        dataframe
+            one row per group with the columns of group that the model uses, 
+            'count', 'length', the mean log_10 runtime of the group, and
+            'sumSquares'. It can be passed to film_model_by_year with grouped
+            True, or to normal_equations.
+        
+        '''
+    columns = [u'Overlap', u'nonOverlap']
+    for prefix, entry, same in deviation_labels(couDict, lanDict, genDict):
+        if prefix+entry not in columns:
+            columns.append(prefix+entry)
+    columns += [u'Cou_TOTAL', u'Lan_TOTAL', u'Gen_TOTAL']
+    signatures, inverse = np.unique(group[columns].values, axis=0, \
+                                    return_inverse=True)
+    y = group[u'length'].values
+    count = np.bincount(inverse)
+    mean = np.bincount(inverse, weights=y) / count
+    grouped = pd.DataFrame(signatures, columns=columns)
+    grouped[u'count'] = count
+    grouped[u'length'] = mean
+    grouped[u'sumSquares'] = np.bincount(inverse, \
+                                         weights=(y - mean[inverse])**2)
+    return grouped
+
+def gaussian_stats(year, globalAvg, dev, sigma, alpha=0.05):
+    '''FOR USE IN FILM_VI_BY_YEAR, FILM_MAP_BY_YEAR AND SAMPLE_YEARS_BATCHED
+        summarizes draws of the log_10 global average, the log_10 deviations
+        and sigmaObs in the format of mc.stats() of film_model_by_year,
+        including the deviations in minutes "<year>_linDev"
+        '''
+    linear = 10.**(globalAvg[:, np.newaxis] + dev) - \
+                10.**globalAvg[:, np.newaxis]
+    summary = lambda x: {'n': len(x), 'mean': x.mean(0), \
+                         'standard deviation': x.std(0), \
+                         '%d%% HPD interval' %int(100 * (1 - alpha)): \
+                         hpd(x, alpha)}
+    return {year+'_global': summary(globalAvg), year+'_linDev': summary(linear),\
+            year+'_sigmaObs': summary(sigma)}
+
+def linear_deviation_stats(globalTrace, categoryTrace, couDict, lanDict, \
+                           genDict, alpha=0.05, blockBytes=2**27, chunk=1000):
+    '''
+    Summarizes the deviations in minutes, 10**(global + deviation) -
+    10**global, in the format of mc.stats()["<year>_linDev"] from the traces of
+    film_model_by_year. The transform is applied to the thinned trace after
+    sampling rather than by a traced node at every step. It is done a block of
+    deviations at a time, so that no more than blockBytes are held in memory
+    when the traces are memory-mapped by filmTrace.
+
+    Parameters
+    ----------
+
+    globalTrace: array like
+        the samples of "<year>_global"
+
+    categoryTrace: array like
+        the samples of "<year>_log10_categoryDev", the unconstrained deviations
+
+    couDict, lanDict, genDict: dictionaries
+        as passed to film_model_by_year
+
+    alpha: float
+        the desired probability of type I error of the HPD interval
+
+    blockBytes: integer
+        the size in bytes of the largest block of deviations in minutes
+
+    chunk: integer
+        the number of samples read from categoryTrace at a time
+
+    Returns
+    -------
+
+    dictionary
+        'n', 'mean', 'standard deviation' and the HPD interval of each
+        deviation, ordered as deviation_labels()
+
+    '''
+    C = constraint_transform(couDict, lanDict, genDict)
+    glob = np.asarray(globalTrace, dtype=np.float64)[:, np.newaxis]
+    n, size = glob.shape[0], C.shape[0]
+    mean, sd = np.empty(size), np.empty(size)
+    interval = np.empty((2, size))
+    width = int(max(1, min(size, blockBytes // (8 * n))))
+    for first in range(0, size, width):
+        cols = slice(first, min(first + width, size))
+        block = np.empty((n, cols.stop - cols.start))
+        for row in range(0, n, chunk):
+            rows = slice(row, min(row + chunk, n))
+            block[rows] = np.dot(categoryTrace[rows], C[cols].T)
+        block = 10.**(glob + block) - 10.**glob
+        mean[cols] = block.mean(0)
+        sd[cols] = block.std(0)
+        interval[:, cols] = hpd(block, alpha)
+    return {'n': n, 'mean': mean, 'standard deviation': sd, \
+            '%d%% HPD interval' %int(100 * (1 - alpha)): interval}
+
+def _sample_tridiagonal(diag, upper, b, rng):
+    '''FOR USE IN SAMPLE_ALL_YEARS
+        draws from a Normal distribution with precision matrix Q and mean
+        Q^-1 b where Q is symmetric and tridiagonal with diagonal diag and
+        off-diagonal upper. Q is factorized as U^T U by a banded Cholesky
+        decomposition which costs O(len(diag)).
+        '''
+    U = cholesky_banded(np.vstack([np.append(0., upper), diag]))
+    mean = cho_solve_banded((U, False), b)
+    return mean + solve_banded((0, 1), U, rng.standard_normal(len(diag)))
+
 def get_deviations(same_list, diff_list, deviations, prefix, df, offset):
     '''FOR USE IN FILM_MODEL_BY_YEAR
         calculates the deviations in the runtime from the average for each film
@@ -305,10 +1138,10 @@ def get_deviations(same_list, diff_list, deviations, prefix, df, offset):
     len_same_list=len(same_list)
     #for each film add all the deviations corresponding to each category
     for i, deviation in enumerate(same_list):
-    same=same.add(deviations[i + offset]*df[prefix+deviation].values)
+        same=same.add(deviations[i + offset]*df[prefix+deviation].values)
     for i, deviation in enumerate(diff_list):
-    diff = diff.add(deviations[i + len_same_list + offset] * \
-                    df[prefix+deviation].values)
+        diff = diff.add(deviations[i + len_same_list + offset] * \
+                        df[prefix+deviation].values)
     #divide by the number of different category entries
     same /= df[prefix+'TOTAL'].values
     diff /= df[prefix+'TOTAL'].values
@@ -2,15 +2,19 @@
     internet movie database website and gathering data on films into a 
     tab-seperated text file'''
 from filmObtainItem import *
+from filmRecord import RecordWriter, open_data_file
+from filmPeople import PersonIndex
+from filmCrawl import CrawlScheduler, load_scheduler
 import os
 import threading
 from threading import Lock
 import codecs
 import time
 
-def getFilm(i, screenLock, dataFile, dataLock, failFile, failLock):
-    '''calls filmGrab and assesses whether film data was successfully obtained 
-        or if the call failed. It then calls either the success of fail function
+def getFilm(i, screenLock, writer, people, scheduler, failFile, failLock):
+    '''calls grab_record and assesses whether film data was successfully 
+        obtained or if the call failed. It then calls either the success of 
+        fail function
 
         Parameters
         ----------
@@ -21,11 +25,16 @@ def getFilm(i, screenLock, dataFile, dataLock, failFile, failLock):
         screenLock: semaphore
             a semaphore allowing the function to safely write to std out
 
-        dataFile: file stream
-            a file into which to store the retrieved data about the movie
+        writer: RecordWriter
+            the writer of the data file in which to store the retrieved data 
+            about the movie
 
-        dataLock: semaphore
-            a semaphore allowing the function to safely write to the dataFile
+        people: PersonIndex
+            the index to which the writers and directors of the movie are added
+
+        scheduler: CrawlScheduler
+            the scheduler of the crawl, to which the state of the entry is 
+            reported
 
         failFile: file stream
             a file into which the fail message is written
@@ -34,15 +43,16 @@ def getFilm(i, screenLock, dataFile, dataLock, failFile, failLock):
             a semaphore allowing the function to safely write to the failFile
 
         '''
-    film = filmGrab(i)
+    record, state = grab_record(i)
+    scheduler.record(i, state)
     screenLock.acquire()
     print str(i)
     screenLock.release()
-    if film.failed:
-        if film.state != "NA":
-            fail(i, film.state, screenLock, failFile, failLock)
+    if record is None:
+        if state != "NA":
+            fail(i, state, screenLock, failFile, failLock)
     else:
-        success(i, film, screenLock, dataFile, dataLock)
+        success(record, screenLock, writer, people)
 
 def fail(i, msg, screenLock, failFile, failLock):
     '''
@@ -77,7 +87,7 @@ def fail(i, msg, screenLock, failFile, failLock):
     screenLock.release()
 
 
-def success(i, filmObj, screenLock, dataFile, dataLock):
+def success(record, screenLock, writer, people):
     '''If aquiring the data on a film with IMDB id i is successful then the 
         films data (id number, date, title, runtime, country of origin, 
         languages, genres, writers, directors and whether one of the 
@@ -90,61 +100,47 @@ def success(i, filmObj, screenLock, dataFile, dataLock):
         Parameters
         ----------
 
-        i: integer
-            the IMDb id of the film that was successfully accessed
-
-        filmObj: filmGrab object
-            the object contains attributes about the accessed movie. Those 
-            attributes are the date, name, the length of the movie, the 
-            countries that the film was made in, the languages spoken in the 
-            movie, the genres describing the movie, the writers, the directors 
-            and whether one of the listed writers was also one of the listed 
-            directors
+        record: filmRecord
+            the data on the accessed movie: its IMDb id, date, name, the length
+            of the movie, the countries that the film was made in, the 
+            languages spoken in the movie, the genres describing the movie, the
+            writers, the directors and whether one of the listed writers was 
+            also one of the listed directors
 
         screenLock: semaphore
             a semaphore allowing the function to safely write to std out
 
-        dataFile: file stream
-            a file into which to store the retrieved data about the movie
+        writer: RecordWriter
+            the writer of the data file, which writes the records in batches
 
-        dataLock: semaphore
-            a semaphore allowing the function to safely write to the dataFile
+        people: PersonIndex
+            the index to which the writers and directors of the movie are added
         
         '''
-    #get attributes from object, create output string containing the films data
-    country = ', '.join(filmObj.country)
-    language = ', '.join(filmObj.language)
-    writer = ', '.join(filmObj.writer)
-    director = ', '.join(filmObj.director)
-    genre = ', '.join(filmObj.genre)
-    textout = "%d\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" %(i, filmObj.date, filmObj.name, str(filmObj.time), country, language, genre, writer, director, filmObj.same)
-
     screenLock.acquire()
-    print textout
+    print record.line()
     screenLock.release()
 
-    dataLock.acquire()
-    dataFile.write(textout)
-    dataLock.release()
+    writer.add(record)
+    people.add_record(record)
 
 def main():
     '''Accesses webpages from the internet movie database corresponding to films
         and TV shows with IMDB ids from 1 to 1million. It does this in 
         increments with five second intervals to avoid accessing too many pages 
-        at once. Creates files for successfully obtained data to be written to 
-        along with a fail file to list failed attepts to access an entry so that
-        they can be retried later.
+        at once. The ids are handed out by the CrawlScheduler of filmCrawl.py,
+        the ids in the ranges with the most films first, and its state is 
+        saved in Film_crawl.npy after each increment. A restarted crawl retries
+        the ids whose requests failed and no others. Creates files for 
+        successfully obtained data to be written to along with a fail file to 
+        list failed attepts to access an entry.
         '''
     
     
-    #create data file in which to store data about the movies
+    #create data file in which to store data about the movies, adding the
+    #writerId and directorId columns to a file written without them
     datafilename = "Film_data"+".txt"
-    if not os.path.isfile(datafilename):
-        datafile = codecs.open(datafilename, mode='w', encoding='utf-8')
-        header = "id\tdate\ttitle\tlength\tcountry\tlanguage\tgenre\twriter\tdirector\tWri/DirOverlap\n"
-        datafile.write(header)
-    else:
-        datafile = codecs.open(datafilename, mode='a', encoding='utf-8')
+    datafile = open_data_file(datafilename)
       
     #create fail file in which to store information on IMDb entries that could 
     #not be accessed
@@ -157,18 +153,32 @@ def main():
         errorfile = codecs.open(errorfilename, mode='a', encoding='utf-8')
     
     #create locks to ensure that only one film prints to screen or to a file at
-    #a given time.
+    #a given time. The writer of the data file has its own lock
     lockScreenPrint = Lock()
-    lockDataFile = Lock()
     lockErrorFile = Lock()
 
-    #create 200 threads at a time to access the first million entries
+    #create 200 threads at a time to access the first million entries, whose
+    #records are written together
     stepsize = 200
-    for j in range(1,1000001, stepsize):
+    writer = RecordWriter(datafile, batchSize=stepsize)
+    
+    #the index of the writers and directors of the films
+    people = PersonIndex("Film_people.db")
+    
+    #the scheduler of the ids, which skips the entries known to be dead or not
+    #to be films
+    crawlfilename = "Film_crawl"+".npy"
+    if not os.path.isfile(crawlfilename):
+        scheduler = CrawlScheduler(1, 1000000)
+    else:
+        scheduler = load_scheduler(crawlfilename)
+        scheduler.retry_failed()
+    ids = scheduler.next_ids(stepsize)
+    while ids:
         #instantiate the threads
         threads = [threading.Thread(target=getFilm, args=(i,lockScreenPrint, \
-            datafile, lockDataFile, errorfile, lockErrorFile)) \
-            for i in range(j,j+stepsize)]
+            writer, people, scheduler, errorfile, lockErrorFile)) \
+            for i in ids]
         for thread in threads:
             thread.setDaemon(True)
         #start the threads
@@ -178,12 +188,18 @@ def main():
         for thread in threads:
             thread.join(3.)
         #register that the thread has failed if it has not yet returned
-        for i in range(0, stepsize):
+        for i in range(0, len(ids)):
             if threads[i].isAlive():
-                fail(i+j, "ThreadTimeout", lockScreenPrint, errorfile, \
+                scheduler.record(ids[i], "ThreadTimeout")
+                fail(ids[i], "ThreadTimeout", lockScreenPrint, errorfile, \
                     lockErrorFile)
+        #write the records of this step that do not fill a batch
+        writer.flush()
+        people.save()
+        scheduler.save(crawlfilename)
         #ensure that the system does not get overloaded by inserting a pause
         time.sleep(5)
+        ids = scheduler.next_ids(stepsize)
     return 0
 
 
@@ -1,7 +1,10 @@
-'''Defines the class filmGrab for getting data on films from the website 
-    of the Internet Movie Database'''
+'''Defines the function grab_record for getting data on films from the website 
+    of the Internet Movie Database, and the class filmGrab, which wraps it.
+    
+    grab_record() parses the pages of a film into a filmRecord of filmRecord.py,
+    a compact record which is all the scraper holds for each film until it is 
+    written. filmGrab keeps the interface of the original class.'''
 
-import numpy as np
 import bs4 as bs4
 import requests
 from requests.exceptions import ConnectionError
@@ -10,6 +13,7 @@ from requests.exceptions import HTTPError
 import socket
 import re
 from retrying import retry, RetryError
+from filmRecord import filmRecord
 
 def retry_if_timeout_or_connection_error(exception):
     '''Return True if the program should try accessing the requested webpage
@@ -17,11 +21,289 @@ def retry_if_timeout_or_connection_error(exception):
         '''
     return isinstance(exception, Timeout) or isinstance(exception, ConnectionError)
 
-class filmGrab():
+#the address of the website, which may be changed to that of a stand-in such 
+#as filmServer.py
+BASE_URL = "http://www.imdb.com"
+
+#the imdb id of a person in the link to their page
+personRX = re.compile("/name/nm(\d+)")
+
+class ScrapeFailed(Exception):
+    '''
+        Raised when the data on a film could not be obtained. Its argument is 
+        the reason for the failure, which becomes the state of filmGrab.
+        '''
+
+def grab_record(idnum):
+    '''
+    Get data about a film from www (dot) IMDB (dot) com
+    
+    Parameters
+    ----------
+    
+    idnum: integer
+        positive integer between 1 and 5million.
+        This number is the imdb id number for an entry on their website.
+        For example num=1 corresponds to the entry for a short film from 1984 
+        called 'Carmencita.'
+    
+    Returns
+    -------
+    
+    record: filmRecord or None
+        the data on the film, or None if the data could not be obtained
+    
+    state: string
+        the state of filmGrab: "all data gained" or the reason for the failure
+    
+    '''
+    urlPrim = BASE_URL + "/title/tt" + str(idnum)+"/"
+    urlSec = urlPrim + "fullcredits"
+    try:
+        primary = parse_primary(get_page(urlPrim))
+        secondary = parse_secondary(get_page(urlSec))
+    except ScrapeFailed as failure:
+        return None, failure.args[0]
+    return filmRecord(idnum, *(primary + secondary)), "all data gained"
+
+#retries up to 5 times when there are timeout errors, with a 0.5 second gap
+#between tries
+@retry(stop='stop_after_attempt', stop_max_attempt_number=5,
+       wait='fixed_sleep', wait_fixed=500,
+       retry_on_exception=retry_if_timeout_or_connection_error)
+def _get_page_internal(address):
+    '''Attempts to access a webpage. Raises ScrapeFailed if unsuccefull.
+
+    Patameters
+    ----------
+
+    address: string
+        The address of the webpage to be accessed
+
+
+    '''
+    try:
+        page=requests.get(address, timeout = 5)
+    except socket.timeout:
+        raise Timeout
+    except Timeout:
+        raise Timeout
+    except ConnectionError:
+        raise ConnectionError
+    except socket.error:
+        raise ScrapeFailed("socket error")
+    except HTTPError as e:
+        raise ScrapeFailed(str(e.response.status_code))
+    except KeyboardInterrupt:
+        raise
+    except Exception as inst:
+        raise ScrapeFailed("Unknown Exception:" + str(type(inst))+"+" \
+            + str(inst.args)+"+"+str(inst))
+    except:
+        raise ScrapeFailed("Unknown Error")
+    if page.status_code != 200:
+        raise ScrapeFailed(str(page.status_code))
+    return bs4.BeautifulSoup(page.text)
+
+#wrapper for _get_page_internal(). Once it has retried 5 times unsuccessfully
+#the page is given up on
+def get_page(address):
+    '''Attempts to access a webpage. Raises ScrapeFailed if unsuccefull.
+
+    Patameters
+    ----------
+
+    address: string
+        The address of the webpage to be accessed
+
+
+    '''
+    try:
+        return _get_page_internal(address)
+    except (RetryError, Timeout, ConnectionError):
+        raise ScrapeFailed("timeoutOrConnenction")
+
+def _unknown(inst):
+    '''the ScrapeFailed of an unexpected exception inst raised by a parser'''
+    return ScrapeFailed("Unknown Error:" + str(type(inst))+"+" \
+        +str(inst.args)+"+"+str(inst))
+
+def parse_primary(primaryPage):
+    '''
+    gets data from www.imdb.com/title/tt<num> on whether or not the entry is
+    a tv program or video. If not then it gets the title, the date, the 
+    runtime, the countries, the languages and the genres.
+
+    Parameters
+    ----------
+
+    primaryPage: string
+        a BeautifulSoup webpage text object
+
+    Returns
+    -------
+
+    tuple
+        the date, name, time, countries, languages and genres of the film
+
+    '''
+    #check if page is for a tv show or video
+    try:
+        medium=primaryPage.find("div", {"class": "infobar"})
+    except AttributeError:
+        raise ScrapeFailed("NA")
+    except Exception as inst:
+        raise _unknown(inst)
+    TVRX = re.compile("TV")
+    VidRX = re.compile("Video")
+    if TVRX.search(medium.decode()) != None or \
+        VidRX.search(medium.decode()) != None:
+        raise ScrapeFailed("NA")
+
+    #get the name of the movie
+    try:
+        getName = primaryPage.h1.find("span", {"itemprop":"name"})
+    except AttributeError:
+        raise ScrapeFailed("NA")
+    except Exception as inst:
+        raise _unknown(inst)
+    if getName == None:
+        raise ScrapeFailed("Couldn't find name and date")
+    name = unicode(getName.contents[0].strip())
+    
+    #get the date the movie was released. It is copied out of the page so that
+    #the record does not keep the page alive
+    try:
+        date = unicode(primaryPage.h1.find("a").contents[0])
+    except AttributeError:
+        raise ScrapeFailed("NA")
+    except Exception as inst:
+        raise _unknown(inst)
+
+    #get the runtime of the movie in minutes
+    #the RegEx below looks for digits, possibly a thousands seperator then
+    #possibly more digits, possibly a decimal point and possible more digits
+    timeRX=re.compile('\d+[,]*\d*[\.]*\d*')
+    try:
+        getTime = primaryPage.find("time", {"itemprop":"duration"})
+    except AttributeError:
+        raise ScrapeFailed("NA")
+    except Exception as inst:
+        raise _unknown(inst)
+    if getTime == None:
+        raise ScrapeFailed("NA")
+    timeSearch=getTime.contents[0]
+    timeString = timeRX.findall(timeSearch.decode())[0]
+    time = float(timeString.replace(',', ''))
+
+    #get the language(s) and country(ies) of the movie
+    try:
+        details = primaryPage.find("div", {"class":"article", \
+            "id":"titleDetails"}).find_all("a")
+    except AttributeError:
+        raise ScrapeFailed("NA")
+    except Exception as inst:
+        raise _unknown(inst)
+    country=[]
+    language=[]
+    wordCountry = re.compile("country")
+    wordLanguage = re.compile("language")
+    #cycle through the details on the films productions looking for 
+    #countries and languages
+    for detail in details:
+        if detail.attrs["href"] !=None:
+            if wordCountry.search(detail.attrs["href"]):
+                country.append(unicode(detail.contents[0].strip()))
+            if wordLanguage.search(detail.attrs["href"]):
+                language.append(unicode(detail.contents[0].strip()))
+    
+    #get the genre(s)
+    genre=[]
+    try:
+        genreSearch = primaryPage.find("div", {"itemprop":"genre"})
+    except AttributeError:
+        raise ScrapeFailed("NA")
+    except Exception as inst:
+        raise _unknown(inst)
+    if genreSearch == None:
+        raise ScrapeFailed("NA")
+    for gen in genreSearch.find_all("a"):
+        genre.append(unicode(gen.contents[0].strip()))
+    return date, name, time, country, language, genre
+
+def parse_secondary(secondaryPage):
+    '''
+    gets data from www.imdb.com/title/tt<num>/fullcredits on the writers and
+    directors, with their imdb ids from the links of the credits.
+
+    Parameters
+    ----------
+
+    secondaryPage: string
+        a BeautifulSoup webpage text object
+
+    Returns
+    -------
+
+    tuple
+        the lists of the writers and of the directors of the film, then the 
+        lists of the numbers of their imdb ids, e.g. 95 for nm0000095, or None
+        for a credit without an id
+
+    '''
+    director = []
+    writer=[]   
+    directorId = []
+    writerId = []
+    wordDir = re.compile("Directed")
+    wordWri = re.compile("Writing") 
+    wordCast = re.compile("Cast")
+    #look for the list of credits
+    try:
+        credits=secondaryPage.find("div", {"id":"fullcredits_content", \
+            "class":"header"})
+        tmp = credits.h4
+    except AttributeError:
+        raise ScrapeFailed("NA")
+    except Exception as inst:
+        raise _unknown(inst)
+    #cycle through the list of credits looking for the writing credits and
+    #the directing credits
+    while(tmp != None):
+        if wordDir.search(tmp.contents[0]) != None:
+            tmp = tmp.find_next_sibling()
+            for name in tmp.find_all("td", {"class":"name"}):
+                director.append(unicode(name.a.contents[0].strip()))
+                directorId.append(person_id(name.a))
+        if wordWri.search(tmp.contents[0]) != None:
+            tmp = tmp.find_next_sibling()
+            for name in tmp.find_all("td", {"class":"name"}):
+                writer.append(unicode(name.a.contents[0].strip())) 
+                writerId.append(person_id(name.a))
+        if wordCast.search(tmp.contents[0]) != None:
+            break
+        tmp = tmp.find_next_sibling() 
+    if len(writer) == 0 or len(director)==0:
+        raise ScrapeFailed("NA")
+    return writer, director, writerId, directorId
+
+def person_id(link):
+    '''
+        the number of the imdb id of a person from the link to their page, 
+        e.g. 95 for /name/nm0000095/, or None if the link has no id
+        '''
+    found = personRX.search(link.attrs.get("href", ""))
+    if found is None:
+        return None
+    return int(found.group(1))
+
+class filmGrab(object):
     '''
     filmGrab(num)
     
-    Get data about a film from www (dot) IMDB (dot) com
+    Get data about a film from www (dot) IMDB (dot) com. This is a wrapper of
+    grab_record() that keeps the attributes of the original class; the 
+    scraper uses grab_record() directly.
     
     Parameters
     ----------
@@ -80,238 +362,32 @@ class filmGrab():
         film. If there are several directors then they are seperated by commas.
         
     same: boolean
-        If failed==False, this is True if the name of a one of the writers is 
-        the same as one of the names of the directors
+        If failed==False, this is True if one of the writers is also one of the
+        directors, as identified by their imdb ids
+    
+    writerId, directorId: lists of integers
+        If failed==False, these are the numbers of the imdb ids of the writers 
+        and of the directors, None for a credit without an id
+    
+    record: filmRecord
+        If failed==False, the record from which the attributes above are read
     
     '''
+    __slots__ = ('idnum', 'failed', 'state', 'record')
+    
     def __init__(self, idnum):
         self.idnum=idnum
-        self.failed = False
-        self.state = "Empty"
-        urlPrim = "http://www.imdb.com/title/tt" + str(self.idnum)+"/"
-        urlSec = urlPrim + "fullcredits"
-        primaryPage = self._getPage(urlPrim)
-        self._getPrimaryData(primaryPage)
-        secondaryPage = self._getPage(urlSec)
-        self._getSecondaryData(secondaryPage)
+        self.record, self.state = grab_record(idnum)
+        self.failed = self.record is None
     
-    #retries up to 5 times when there are timeout errors, with a 0.5 second gap
-    #between tries
-    @retry(stop='stop_after_attempt', stop_max_attempt_number=5,
-           wait='fixed_sleep', wait_fixed=500,
-           retry_on_exception=retry_if_timeout_or_connection_error)
-    def _getPageInternal(self, address):
-        '''Attempts to access a webpage. Returns a fail state if unsuccefull.
-
-        Patameters
-        ----------
-
-        address: string
-            The address of the webpage to be accessed
-
-
-        '''
-        if self.failed == True:
-            return
-        try:
-            page=requests.get(address, timeout = 5)
-        except socket.timeout:
-            raise Timeout
-        except Timeout:
-            raise Timeout
-        except ConnectionError:
-            raise ConnectionError
-        except socket.error:
-            return self._fail("socket error")
-        except HTTPError as e:
-            return self._fail(e.response.statuscode)
-        except KeyboardInterrupt:
-            raise
-        except Exception as inst:
-            return self._fail("Unknown Exception:" + str(type(inst))+"+" \
-                + str(inst.args)+"+"+str(inst))
-        except:
-            return self._fail("Unknown Error")
-        else:
-            if page.status_code != 200:
-                return self._fail(str(page.status_code))
-            self.state = "Page " + address + " Accessed"  
-            return bs4.BeautifulSoup(page.text)
-    
-    #wrapper for _getPageInternal(). Once getPageInt() has retried 5 times
-    #unsuccessfully, then the wrapper executes the _fail() method
-    def _getPage(self, address):
-        '''Attempts to access a webpage. Returns a fail state if unsuccefull.
-
-        Patameters
-        ----------
-
-        address: string
-            The address of the webpage to be accessed
-
-
+    def __getattr__(self, name):
         '''
-        try:
-            page=self._getPageInternal(address)
-        except RetryError:
-            return self._fail("timeoutOrConnenction")
-        return page
-
-    def _getPrimaryData(self, primaryPage):
-        '''
-        gets data from www.imdb.com/title/tt<num> on whether or not the entry is
-        a tv program or video. If not then it gets the title, the date, the 
-        runtime, the countries, the languages and the genres. These are stored 
-        in as attributes of the class
-
-        Parameters
-        ----------
-
-        primaryPage: string
-            a BeautifulSoup webpage text object
-
-        '''
-        if self.failed == True:
-            return
-        #check if page is for a tv show or video
-        try:
-            medium=primaryPage.find("div", {"class": "infobar"})
-        except AttributeError:
-            return self._fail("NA")
-        except Exception as inst:
-            return self._fail("Unknown Error:" + str(type(inst))+"+" \
-                +str(inst.args)+"+"+str(inst))
-        TVRX = re.compile("TV")
-        VidRX = re.compile("Video")
-        if TVRX.search(medium.decode()) != None or \
-            VidRX.search(medium.decode()) != None:
-            return self._fail("NA")
-
-        #get the name of the movie
-        try:
-            getName = primaryPage.h1.find("span", {"itemprop":"name"})
-        except AttributeError:
-            return self._fail("NA")
-        except Exception as inst:
-            return self._fail("Unknown Error:" + str(type(inst))+"+" \
-                +str(inst.args)+"+"+str(inst))
-        if getName == None:
-            return self._fail("Couldn't find name and date")
-        self.name = getName.contents[0].strip()
-        
-        #get the date the movie was released
-        try:
-            self.date = primaryPage.h1.find("a").contents[0]
-        except AttributeError:
-            return self._fail("NA")
-        except Exception as inst:
-            return self._fail("Unknown Error:" + str(type(inst))+"+" \
-                +str(inst.args)+"+"+str(inst))
-
-        #get the runtime of the movie in minutes
-        #the RegEx below looks for digits, possibly a thousands seperator then
-        #possibly more digits, possibly a decimal point and possible more digits
-        timeRX=re.compile('\d+[,]*\d*[\.]*\d*'
-        try:
-            getTime = primaryPage.find("time", {"itemprop":"duration"})
-        except AttributeError:
-            return self._fail("NA")
-        except Exception as inst:
-            return self._fail("Unknown Error:" + str(type(inst))+"+" \
-                +str(inst.args)+"+"+str(inst))
-        if getTime == None:
-            return self._fail("NA")
-        timeSearch=getTime.contents[0]
-        timeString = timeRX.findall(timeSearch.decode())[0]
-        self.time = float(timeString.replace(',', ''))
-
-        #get the language(s) and country(ies) of the movie
-        try:
-            details = primaryPage.find("div", {"class":"article", \
-                "id":"titleDetails"}).find_all("a")
-        except AttributeError:
-            return self._fail("NA")
-        except Exception as inst:
-            return self._fail("Unknown Error:" + str(type(inst))+"+" +\
-                str(inst.args)+"+"+str(inst))
-        self.country=[]
-        self.language=[]
-        wordCountry = re.compile("country")
-        wordLanguage = re.compile("language")
-        #cycle through the details on the films productions looking for 
-        #countries and languages
-        for detail in details:
-            if detail.attrs["href"] !=None:
-                if wordCountry.search(detail.attrs["href"]):
-                    self.country.append(detail.contents[0].strip())
-                if wordLanguage.search(detail.attrs["href"]):
-                    self.language.append(detail.contents[0].strip())
-        
-        #get the genre(s)
-        self.genre=[]
-        try:
-            genreSearch = primaryPage.find("div", {"itemprop":"genre"})
-        except AttributeError:
-            return self._fail("NA")
-        except Exception as inst:
-            return self._fail("Unknown Error:" + str(type(inst))+"+" \
-                +str(inst.args)+"+"+str(inst))
-        if genreSearch == None:
-          return self._fail("NA")
-        for gen in genreSearch.find_all("a"):
-            self.genre.append(gen.contents[0].strip())
-        self.state = "Primary data gained"
-
-    def _getSecondaryData(self, secondaryPage):
-        '''
-        gets data from www.imdb.com/title/tt<num>/fullcredits on the writers and
-        directors. These are stored in as attributes of the class
-
-        Parameters
-        ----------
-
-        primaryPage: string
-            a BeautifulSoup webpage text object
-
-        '''
-        if self.failed == True:
-            return           
-        self.director = []
-        self.writer=[]   
-        wordDir = re.compile("Directed")
-        wordWri = re.compile("Writing") 
-        wordCast = re.compile("Cast")
-        #look for the list of credits
-        try:
-            credits=secondaryPage.find("div", {"id":"fullcredits_content", \
-                "class":"header"})
-            tmp = credits.h4
-        except AttributeError:
-            return self._fail("NA")
-        except Exception as inst:
-            return self._fail("Unknown Error:" + str(type(inst))+"+" \
-                +str(inst.args)+"+"+str(inst))
-        #cycle through the list of credits looking for the writing credits and
-        #the directing credits
-        while(tmp != None):
-            if wordDir.search(tmp.contents[0]) != None:
-                tmp = tmp.find_next_sibling()
-                for name in tmp.find_all("td", {"class":"name"}):
-                    self.director.append(name.a.contents[0].strip())
-            if wordWri.search(tmp.contents[0]) != None:
-                tmp = tmp.find_next_sibling()
-                for name in tmp.find_all("td", {"class":"name"}):
-                    self.writer.append(name.a.contents[0].strip()) 
-            if wordCast.search(tmp.contents[0]) != None:
-                break
-            tmp = tmp.find_next_sibling() 
-        if len(self.writer) == 0 or len(self.director)==0:
-            return self._fail("NA")
-        self.same = np.in1d(self.writer, self.director).any() 
-        self.state = "all data gained"
-        
-    # sets the attribute failed to True and sets the state to msg.
-    def _fail(self, msg):
-        self.failed =True
-        self.state = msg
-        return True
\ No newline at end of file
+            the data on the film are read from its record, as lists rather 
+            than the tuples of the record
+            '''
+        if name in filmRecord.__slots__ and self.record is not None:
+            value = getattr(self.record, name)
+            if isinstance(value, tuple):
+                return list(value)
+            return value
+        raise AttributeError(name)
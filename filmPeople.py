@@ -0,0 +1,223 @@
+'''An index of the people credited as the writers and directors of films.
+
+    The scraper finds the imdb id of each person, e.g. nm0000095, from the link
+    of each credit on the full credits page. Whether a writer was also a
+    director is decided by these ids, as an intersection of sets of integers,
+    so it does not depend on how the name is written in each credit, e.g. with
+    a "(screenplay)" suffix or different spacing.
+
+    PersonIndex numbers the people in the order in which they are first seen
+    and records the films that each of them wrote and directed. It is stored in
+    an SQLite database with an index on the people, so the films of a person
+    are found without reading the data file. Intended use:
+
+    people = PersonIndex('Film_people.db')
+    people.add_record(record)
+    people.save()
+    for person in people.find(u'Woody Allen'):
+        print people.films(person, role='both')
+
+    Running this script builds the index from the writerId and directorId
+    columns of a data file of filmObtainDataset.py and, given some names,
+    prints the films that each of those people wrote and directed.
+    '''
+
+import argparse
+import codecs
+import os
+import sqlite3
+import threading
+
+#the roles of a credit
+WRITER = 0
+DIRECTOR = 1
+
+
+class PersonIndex(object):
+    '''
+    PersonIndex(fileName)
+
+    The people credited as writers and directors, stored in the SQLite
+    database fileName which is created if it does not exist. A person is
+    identified by an integer, numbered from 0, which is mapped to and from the
+    number of their imdb id. Adding people and films is thread safe, the
+    database is only written by save().
+
+    Parameters
+    ----------
+
+    fileName: string
+        the database file
+
+    '''
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.db = sqlite3.connect(fileName, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS people (person INTEGER ' \
+                        'PRIMARY KEY, imdb INTEGER UNIQUE, name TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS credits (film INTEGER, ' \
+                        'person INTEGER, role INTEGER, PRIMARY KEY (film, ' \
+                        'person, role))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS creditsByPerson ON ' \
+                        'credits (person, role)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS peopleByName ON people ' \
+                        '(name)')
+        self.db.commit()
+        self._person = dict(self.db.execute('SELECT imdb, person FROM people'))
+        self._people = []
+        self._credits = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._person)
+
+    def person(self, imdb, name):
+        '''
+            Returns the integer of the person with imdb id number imdb, adding
+            them under name if they have not been seen before
+            '''
+        with self._lock:
+            return self._add_person(imdb, name)
+
+    def _add_person(self, imdb, name):
+        person = self._person.get(imdb)
+        if person is None:
+            person = len(self._person)
+            self._person[imdb] = person
+            self._people.append((person, imdb, name))
+        return person
+
+    def add_film(self, film, writers, directors):
+        '''
+            Adds the film with imdb id number film.
+
+            Parameters
+            ----------
+
+            film: integer
+                the imdb id number of the film
+
+            writers, directors: lists of tuples
+                the imdb id number and the name of each writer and director.
+                The credits without an id number are left out.
+
+            '''
+        with self._lock:
+            for role, credits in [(WRITER, writers), (DIRECTOR, directors)]:
+                for imdb, name in credits:
+                    if imdb is not None:
+                        self._credits.append((film, \
+                            self._add_person(imdb, name), role))
+
+    def add_record(self, record):
+        '''adds the film of a filmRecord'''
+        self.add_film(record.idnum, zip(record.writerId, record.writer), \
+                      zip(record.directorId, record.director))
+
+    def save(self):
+        '''writes the people and films added since the last save'''
+        with self._lock:
+            people, self._people = self._people, []
+            credits, self._credits = self._credits, []
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO people VALUES ' \
+                                '(?, ?, ?)', people)
+            self.db.executemany('INSERT OR IGNORE INTO credits VALUES ' \
+                                '(?, ?, ?)', credits)
+
+    def find(self, name):
+        '''the integers of the saved people credited under name'''
+        return [row[0] for row in self.db.execute('SELECT person FROM ' \
+                'people WHERE name = ? ORDER BY person', (name,))]
+
+    def imdb(self, person):
+        '''the imdb id number and the name of the saved person'''
+        return self.db.execute('SELECT imdb, name FROM people WHERE ' \
+                               'person = ?', (person,)).fetchone()
+
+    def films(self, person, role='both'):
+        '''
+            Returns the imdb id numbers of the saved films of a person, in
+            increasing order.
+
+            Parameters
+            ----------
+
+            person: integer
+                the person, as returned by person() or find()
+
+            role: string
+                'writer' or 'director' for the films the person wrote or
+                directed, 'both' for the films the person both wrote and
+                directed
+
+            '''
+        if role == 'both':
+            rows = self.db.execute('SELECT film FROM credits WHERE person = ? '\
+                                   'GROUP BY film HAVING COUNT(*) = 2 ORDER ' \
+                                   'BY film', (person,))
+        else:
+            role = {'writer': WRITER, 'director': DIRECTOR}[role]
+            rows = self.db.execute('SELECT film FROM credits WHERE person = ? '\
+                                   'AND role = ? ORDER BY film', (person, role))
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.db.close()
+
+
+def imdb_number(text):
+    '''the number of an imdb id such as nm0000095, or None if text is empty'''
+    if text == '':
+        return None
+    return int(text[2:])
+
+def index_data_file(fileName, people):
+    '''
+        Adds the films of a data file written by filmObtainDataset.py to the
+        PersonIndex people and saves it. Lines written before the data file had
+        the writerId and directorId columns are skipped.
+        '''
+    with codecs.open(fileName, 'r', 'utf-8') as f:
+        header = f.readline().rstrip('\n').split('\t')
+        if 'writerId' not in header:
+            return
+        column = dict([(name, i) for i, name in enumerate(header)])
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != len(header):
+                continue
+            credits = []
+            for role in ['writer', 'director']:
+                names = fields[column[role]].split(', ')
+                ids = [imdb_number(i) for i in \
+                       fields[column[role + 'Id']].split(', ')]
+                credits.append(zip(ids, names))
+            people.add_film(int(fields[column['id']]), *credits)
+    people.save()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='the index of the writers ' \
+                                     'and directors of the films')
+    parser.add_argument('names', nargs='*', help='print the films that these '\
+                        'people wrote and directed')
+    parser.add_argument('--index', default='Film_people.db', \
+                        help='the database of the index')
+    parser.add_argument('--data', help='add the films of this data file of ' \
+                        'filmObtainDataset.py to the index first')
+    args = parser.parse_args()
+    people = PersonIndex(args.index)
+    if args.data is not None:
+        index_data_file(args.data, people)
+    print '%d people in %s' %(len(people), os.path.abspath(args.index))
+    for name in args.names:
+        name = name.decode('utf-8')
+        if len(people.find(name)) == 0:
+            print u'no one called %s is in the index' %name
+        for person in people.find(name):
+            films = people.films(person)
+            print u'%s (nm%07d) wrote and directed %d films: %s' %(name, \
+                people.imdb(person)[0], len(films), \
+                ', '.join(['tt%07d' %film for film in films]))
+    people.close()
@@ -3,28 +3,46 @@
     filmMCMC.py
     
     Error bar plots are created and a gaussian process regression is employed to
-    find the trend in the data.
+    find the trend in the data. By default the regression is done by 
+    scikit-learn's GaussianProcessRegressor with an RBF kernel. With --trend 
+    kalman it is done by the Kalman smoother of filmTrend.py, in O(n) 
+    operations, with a Matern 5/2 kernel, which gives slightly different trends.
     
     Plots are created for the global average of film runtimes and the deviations
     from that average for different categories. The categories are a set of 
     countries, languages and genres.
     
+    By default each plot is saved as a pdf of its own. With --output pdf they
+    are the pages of the single file plots/plots.pdf instead and with --output 
+    html the data of every plot are written to the single file 
+    plots/plots_data.js, which plots/index.html, a copy of filmPlot.html, draws
+    a category at a time in a web browser.
+    
     '''
 
 import pandas as pd
 import codecs
 import numpy as np
+#the plots are only saved to file so no display is needed, which also lets 
+#them be drawn by several processes at once
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
 from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF
+from sklearn.gaussian_process.kernels import RBF, ConstantKernel
+from filmTrend import fit_trend, fit_trends, trend_grid, TREND_VERSION
+from filmCache import DiskCache, cache_key
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shutil
 import sys
+import time
 
 DIRECTORY = sys.path[0]
 
-#import the results of the MCMC
-df=pd.read_csv(DIRECTORY + '/results.csv', encoding='utf-8')
-df.sort(columns='date', inplace=True)
-
 #import the names of the countries, languages and genres
 with codecs.open(DIRECTORY + '/categories.txt', 'r', 'utf-8') as f:
     countries=f.readline()
@@ -34,8 +52,75 @@ with codecs.open(DIRECTORY + '/categories.txt', 'r', 'utf-8') as f:
     genres=f.readline()
     genres=np.array(genres.strip('\n').split(', '))
 
+#a deviation is only plotted if there are at least min_years years in which 
+#each of writer/director overlap and non-overlap has min_films or more films
+min_years = 50
+min_films = 10
+
+#how plot_gaussian() finds the trend: the engine is 'sklearn', 'kalman' 
+#(filmTrend.py, all the trends at once by filmTrend.fit_trends()) or 'batched'
+#(the same, with the length scale fixed) and the length scale in years is 
+#optimized unless fixLengthScale
+trend = {'engine': 'sklearn', 'lengthScale': 10., 'fixLengthScale': False}
+
+#the fitted trends are cached on disk by __main__ so that a rerun which only 
+#changes the look of the plots does not fit them again, see trend_key()
+trendCache = None
+
+def read_results(fileName):
+    '''
+        Reads the results of the MCMC, as written by filmMCMC.py, ordered by 
+        year
+        '''
+    df=pd.read_csv(fileName, encoding='utf-8', dtype={'QSame': str})
+    return df.sort_values('date', kind='mergesort')
+
+def split_overlap(data):
+    '''
+        Separates the results of a category into writer/director overlap and 
+        non-overlap, keeping only the years with at least min_films films
+        '''
+    same = data[(data.QSame == 'True') & (data.number>=min_films)]
+    diff = data[(data.QSame == 'False') & (data.number>=min_films)]
+    return same, diff
+
+def plottable(data, title):
+    '''
+        True if plot_tool() would plot the category title, i.e. if it is the 
+        global average or there are enough years of data for both writer/
+        director overlap and non-overlap, see plot_tool()
+        '''
+    if title == 'Global':
+        return True
+    same, diff = split_overlap(data)
+    return len(same)>=min_years and len(diff)>=min_years
+
+def plotted_series(data, title):
+    '''
+        The (label, data) pairs of the series with a trend in the plot of 
+        category title: 'all' for the global average, otherwise 'same' and 
+        'diff', see split_overlap()
+        '''
+    if title == 'Global':
+        return [('all', data)]
+    return zip(['same', 'diff'], split_overlap(data))
+
 
-def plot_tool(data, title, folder):
+def category_folder(title):
+    '''
+        The subfolder of the plots in which the plot of category title is saved,
+        '' for the global average
+        '''
+    if title == 'Global':
+        return ''
+    elif title in countries:
+        return 'countries'
+    elif title in languages:
+        return 'languages'
+    return 'genres'
+
+
+def plot_tool(data, title, folder, fits=None, pdf=None):
     '''
         Creates an error bar plot overlaid with the result of a gaussian process
         regression. This can be performed for the global average and for the 
@@ -63,35 +148,37 @@ def plot_tool(data, title, folder):
         folder: string
             the filepath into which the plots should be saved.
         
+        fits: dictionary or None
+            the trends already fitted by fit_all_trends(), keyed on the labels
+            of plotted_series(). If None the trends are fitted here.
+        
+        pdf: PdfPages or None
+            if given the plot is added to this multi-page pdf rather than saved
+            in a file of its own in folder
+        
         '''
+    if fits is None:
+        fits = {}
     plt.figure(title, figsize=(13, 6))
     plt.title(title, fontsize=30)
     
+    if not plottable(data, title):
+        plt.close()
+        return
     if title == 'Global':
         plot_data(data, 'green', 'Global Average')
-        plot_gaussian(data, 'green', 'Global Average')
+        plot_gaussian(data, 'green', fits.get('all'))
     else:
         #seperate data into writer/director overlap and non-overlap
         #demand that the results for each year be based on at least 10 films
-        same = data[(data.QSame == 'True') & (data.number>=10)]
-        diff = data[(data.QSame == 'False') & (data.number>=10)]
-        #demand that there must be at least fifty years worth of data
-        min_years = 50
-        if len(same)<min_years or len(diff)<min_years:
-            plt.close()
-            return
+        same, diff = split_overlap(data)
         #save plots to different subfolders depending on their category
-        if title in countries:
-            folder +='/countries'
-        elif title in languages:
-            folder += '/languages'
-        else:
-            folder += '/genres'
+        folder += '/' + category_folder(title)
         plot_data(same, 'red', 'same')
         plot_data(diff, 'blue', 'different')
         
-        plot_gaussian(same, 'red')
-        plot_gaussian(diff, 'blue')
+        plot_gaussian(same, 'red', fits.get('same'))
+        plot_gaussian(diff, 'blue', fits.get('diff'))
         
         plt.ylim(-60, 150)
     
@@ -105,7 +192,10 @@ def plot_tool(data, title, folder):
                         wspace=0, hspace=0)
     
     plt.legend(loc='best', fontsize=24, ncol=1, frameon=False)
-    plt.savefig(folder +'/'+title+'.pdf')
+    if pdf is not None:
+        pdf.savefig()
+    else:
+        plt.savefig(folder +'/'+title+'.pdf')
     plt.close()
 
 
@@ -152,10 +242,12 @@ def plot_data(data, col, label):
     plt.draw()
 
 
-def plot_gaussian(data, col):
+def plot_gaussian(data, col, fit=None):
     '''
         Plots the gaussian process regression with a characteristic length scale
-        of 10 years. Essentially this highlights the 'slow trend' in the data.
+        of 10 years, see trend. Essentially this highlights the 'slow trend' in
+        the data. The trend is taken from trendCache if it has been fitted 
+        before.
         
         Parameters
         ----------
@@ -166,27 +258,14 @@ def plot_gaussian(data, col):
         
         col: string
         the color in which the plot the data
+        
+        fit: tuple or None
+        (years, mean, standard deviation) of the trend if it has already been
+        fitted
         '''
-    #extract the results from the dataframe
-    Year = np.array(data[u'date'].tolist())
-    Mean = np.array(data[u'linMean'].tolist())
-    SD = np.array(data[u'linSD'].tolist())
-    
-    #initialize the gaussian process. Note that the process is calculated with a
-    #length scale of 10years to give the 'slow trend' in the results.
-    length_scale = 10.
-    kernel = 1.* RBF(length_scale)
-    gp = GaussianProcessRegressor(kernel=kernel, sigma_squared_n=(SD) ** 2, \
-                                  normalize_y=True)
-    
-    #now fit the data and get the predicted mean and standard deviation
-    #Note: for reasons that are unclear, GaussianProcessRegressor won't take 1D
-    #arrays so the data are converted to 2D and then converted back for plotting
-    gp.fit(np.atleast_2d(Year).T, np.atleast_2d(Mean).T)
-    Year_array = np.atleast_2d(np.linspace(min(Year)-2, max(Year)+2, 100)).T
-    Mean_prediction, SD_prediction = gp.predict(Year_pred, return_std=True)
-    Year_array=Year_array.ravel()
-    Mean_prediction=Mean_prediction.ravel()
+    if fit is None:
+        fit = cached_fit(data)
+    Year_array, Mean_prediction, SD_prediction = fit
     
     #plot the predicted best fit
     plt.plot(Year_array, Mean_prediction, col, alpha=1)
@@ -197,9 +276,226 @@ def plot_gaussian(data, col):
     plt.draw()
 
 
-if __name__=='__main__':
-    grp=df.groupby('category')
-    for name, categoryDF in grp:
+def fit_series(data):
+    '''
+        Fits the trend of the results data of a series with the engine of 
+        trend, see plot_gaussian(). Returns the years at which it is predicted,
+        the predicted trend and its standard deviation.
+        '''
+    #extract the results from the dataframe
+    Year = np.array(data[u'date'].tolist())
+    Mean = np.array(data[u'linMean'].tolist())
+    SD = np.array(data[u'linSD'].tolist())
+    
+    Year_array = trend_grid(Year)
+    if trend['engine'] in ['kalman', 'batched']:
+        #a Matern 5/2 kernel, whose state space form is solved by a Kalman 
+        #smoother
+        Mean_prediction, SD_prediction = fit_trend(Year, Mean, SD, Year_array,\
+                    trend['lengthScale'], \
+                    optimize=not trend['fixLengthScale'])[:2]
+    else:
+        #initialize the gaussian process. Note that the process is calculated 
+        #with a length scale of 10years to give the 'slow trend' in the results.
+        if trend['fixLengthScale']:
+            kernel = ConstantKernel(max(np.std(Mean), 1e-3)**2, 'fixed') * \
+                        RBF(trend['lengthScale'], 'fixed')
+        else:
+            kernel = 1.* RBF(trend['lengthScale'])
+        gp = GaussianProcessRegressor(kernel=kernel, alpha=(SD) ** 2, \
+                                      normalize_y=True)
+        
+        #now fit the data and get the predicted mean and standard deviation
+        #Note: for reasons that are unclear, GaussianProcessRegressor won't take
+        #1D arrays so the data are converted to 2D and then converted back for 
+        #plotting
+        gp.fit(np.atleast_2d(Year).T, np.atleast_2d(Mean).T)
+        Mean_prediction, SD_prediction = gp.predict(np.atleast_2d( \
+                                            Year_array).T, return_std=True)
+        Mean_prediction=Mean_prediction.ravel()
+    return Year_array, Mean_prediction, SD_prediction
+
+def trend_key(data):
+    '''
+        The key of the trend of the results data in trendCache: a hash of the 
+        years, means and standard deviations, the settings of trend and 
+        filmTrend.TREND_VERSION
+        '''
+    rows = np.float64(data[['date', 'linMean', 'linSD']].values)
+    return cache_key(rows, trend, TREND_VERSION)
+
+def cached_fit(data):
+    '''the trend of fit_series(data), from trendCache if it is there'''
+    if trendCache is None:
+        return fit_series(data)
+    key = trend_key(data)
+    fit = trendCache.get(key)
+    if fit is None:
+        fit = fit_series(data)
+        trendCache.put(key, fit)
+    return fit
+
+
+def fit_all_trends(categories):
+    '''
+        Fits the trends of every series of the (name, data) pairs categories,
+        that are not in trendCache, in one call to filmTrend.fit_trends(), 
+        which optimizes the hyperparameters of all of them together unless
+        the length scale is fixed. Returns a list with a dictionary of the fits
+        of each category, keyed on the labels of plotted_series().
+        '''
+    fits = {}
+    missing = []
+    series = []
+    for name, categoryDF in categories:
+        for label, data in plotted_series(categoryDF, name):
+            key = trend_key(data) if trendCache is not None else None
+            if key is not None:
+                fits[name, label] = trendCache.get(key)
+                if fits[name, label] is not None:
+                    continue
+            missing.append((name, label, key))
+            series.append((np.float64(data['date'].values), \
+                           data['linMean'].values, data['linSD'].values))
+    if series:
+        for (name, label, key), fit in zip(missing, fit_trends(series, \
+                    trend['lengthScale'], \
+                    optimize=not trend['fixLengthScale'])):
+            fits[name, label] = fit
+            if key is not None:
+                trendCache.put(key, fit)
+    return [dict([(label, fits[name, label]) for label, data in \
+                  plotted_series(categoryDF, name)]) \
+            for name, categoryDF in categories]
+
+def plot_batch(batch):
+    '''
+        Plots each (name, data, fits) of a batch of categories with 
+        plot_tool(). Used by the pool of processes in __main__. Returns the 
+        number of trends that were not found in trendCache.
+        '''
+    misses = trendCache.misses if trendCache is not None else 0
+    for name, categoryDF, fits in batch:
         print name
-        plot_tool(categoryDF, name, DIRECTORY+'/plots')
+        plot_tool(categoryDF, name, DIRECTORY+'/plots', fits)
+    return trendCache.misses - misses if trendCache is not None else 0
+
+
+def plot_record(data, title, fits=None):
+    '''
+        The data of the plot of category title, as drawn by plot_tool(), in a 
+        dictionary for the viewer filmPlot.html: the title, the subfolder, and
+        for each series of plotted_series() its label, the year, mean and 95% 
+        interval of each result and the years, mean and standard deviation of 
+        the trend. Numbers are rounded to a thousandth of a minute to keep the
+        file small.
+        '''
+    if fits is None:
+        fits = {}
+    rounded = lambda x: np.round(np.float64(x), 3).tolist()
+    record = {'title': title, 'folder': category_folder(title), 'series': []}
+    for label, series in plotted_series(data, title):
+        fit = fits.get(label)
+        if fit is None:
+            fit = cached_fit(series)
+        grid, mean, sd = fit
+        record['series'].append({'label': label, \
+                'date': series['date'].tolist(), \
+                'mean': rounded(series['linMean'].values), \
+                'low': rounded(series['lin95Low'].values), \
+                'hi': rounded(series['lin95Hi'].values), \
+                'grid': rounded(grid), 'trendMean': rounded(mean), \
+                'trendSD': rounded(sd)})
+    return record
+
+def write_html(records, folder):
+    '''
+        Writes the records of plot_record() to folder/plots_data.js, as a 
+        single javascript assignment so that the viewer can load it from disk,
+        and copies the viewer filmPlot.html to folder/index.html. Returns the 
+        names of the two files.
+        '''
+    dataName = os.path.join(folder, 'plots_data.js')
+    viewerName = os.path.join(folder, 'index.html')
+    with open(dataName, 'w') as f:
+        f.write('var plots = ')
+        json.dump(records, f, separators=(',', ':'))
+        f.write(';\n')
+    shutil.copy(DIRECTORY + '/filmPlot.html', viewerName)
+    return [dataName, viewerName]
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='plot the results of the ' \
+                                     'MCMC')
+    parser.add_argument('--processes', type=int, default=mp.cpu_count(), \
+                        help='the number of processes drawing plots')
+    parser.add_argument('--trend', choices=['sklearn', 'kalman', 'batched'],\
+                        default=trend['engine'], help='how the trend is found')
+    parser.add_argument('--fix-length-scale', action='store_true', \
+                        help='keep the length scale of the trend at 10 years '\
+                        'instead of optimizing it')
+    parser.add_argument('--no-cache', action='store_true', \
+                        help='fit every trend, without looking up or storing '\
+                        'the trends in the cache')
+    parser.add_argument('--output', choices=['pdfs', 'pdf', 'html'], \
+                        default='pdfs', help='a pdf file per category, a ' \
+                        'single multi-page pdf or a data file and a viewer ' \
+                        'for web browsers')
+    args = parser.parse_args()
+    trend['engine'] = args.trend
+    trend['fixLengthScale'] = args.fix_length_scale or args.trend == 'batched'
+    start = time.time()
+    if not args.no_cache:
+        trendCache = DiskCache(DIRECTORY + '/cache/trends')
+    df = read_results(DIRECTORY + '/results.csv')
+    
+    #discard the categories that would not be plotted before any figure is 
+    #made, then share the rest out in batches, several per process
+    categories = [(name, categoryDF) for name, categoryDF in \
+                  df.groupby('category') if plottable(categoryDF, name)]
+    print 'plotting %d of %d categories' %(len(categories), \
+                                           df['category'].nunique())
+    #the Matern trends are all fitted here, before the plots are shared out
+    if trend['engine'] in ['kalman', 'batched']:
+        fits = fit_all_trends(categories)
+    else:
+        fits = [None] * len(categories)
+    categories = [(name, categoryDF, fit) for (name, categoryDF), fit in \
+                  zip(categories, fits)]
+    folder = DIRECTORY + '/plots'
+    #the number of trends fitted by the pool of processes, to which those 
+    #fitted by this process are added
+    fitted = 0
+    if args.output == 'html':
+        records = [plot_record(categoryDF, name, fit) for name, categoryDF, \
+                   fit in categories]
+        outputs = write_html(records, folder)
+    elif args.output == 'pdf':
+        #the pages of a single file are drawn by this process alone
+        outputs = [folder + '/plots.pdf']
+        with PdfPages(outputs[0]) as pdf:
+            for name, categoryDF, fit in categories:
+                print name
+                plot_tool(categoryDF, name, folder, fit, pdf)
+    else:
+        outputs = [os.path.join(folder, category_folder(name), name + '.pdf') \
+                   for name, categoryDF, fit in categories]
+        size = max(1, len(categories) // (4 * args.processes))
+        batches = [categories[i:i + size] for i in \
+                   range(0, len(categories), size)]
+        if args.processes > 1:
+            p = mp.Pool(processes=args.processes)
+            fitted += sum(p.map(plot_batch, batches, chunksize=1))
+            p.close()
+            p.join()
+        else:
+            #the trends fitted by this process are counted by trendCache
+            map(plot_batch, batches)
+    if trendCache is not None:
+        fitted += trendCache.misses
+        print '%d trends fitted, the rest found in the cache' %fitted
+    print 'plotted %s in %.1fs, %.1f kB in %d files' %(args.output, \
+            time.time() - start, sum([os.path.getsize(name) for name in \
+            outputs]) / 1024., len(outputs))
 
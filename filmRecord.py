@@ -0,0 +1,205 @@
+'''Defines filmRecord, a compact record of the data on a film scraped from the
+    Internet Movie Database, and RecordWriter, which writes the records of the
+    scraper's threads to the data file in batches.
+
+    A filmRecord has slots rather than a dictionary of attributes and keeps the
+    countries, languages, genres, writers and directors in tuples. The names of
+    the countries, languages and genres are interned, so the many films made in
+    one country or sharing a genre share one copy of its name. Intended use:
+
+    record = filmRecord(1, u'1894', u'Carmencita', 1., [u'USA'], [u'None'], \
+                        [u'Documentary', u'Short'], [u'W. Dickson'], \
+                        [u'W. Dickson'], [5], [5])
+    dataFile = open_data_file('Film_data.txt')
+    writer = RecordWriter(dataFile, batchSize=200)
+    writer.add(record)
+    writer.flush()
+    '''
+
+import codecs
+import os
+import threading
+
+#the header of the data file, naming the columns of filmRecord.line()
+HEADER = u"id\tdate\ttitle\tlength\tcountry\tlanguage\tgenre\twriter\t" \
+    u"director\tWri/DirOverlap\twriterId\tdirectorId\n"
+
+def open_data_file(fileName):
+    '''
+        Opens the data file fileName to append records to it, writing the
+        header if the file is new. A data file written before the writerId and
+        directorId columns were added is first rewritten with these columns,
+        the ids of its credits left empty, so that the old and new lines have
+        the same number of fields.
+        '''
+    if not os.path.isfile(fileName):
+        dataFile = codecs.open(fileName, mode='w', encoding='utf-8')
+        dataFile.write(HEADER)
+        return dataFile
+    with codecs.open(fileName, 'r', 'utf-8') as f:
+        header = f.readline().rstrip('\n').split('\t')
+    if 'writerId' not in header:
+        column = dict([(name, i) for i, name in enumerate(header)])
+        #an empty id for each of the credited people
+        ids = lambda names: u', '.join([u''] * len(names.split(', ')))
+        with codecs.open(fileName, 'r', 'utf-8') as old, \
+             codecs.open(fileName + '.part', 'w', 'utf-8') as new:
+            old.readline()
+            new.write(HEADER)
+            for line in old:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) == len(header):
+                    fields += [ids(fields[column['writer']]), \
+                               ids(fields[column['director']])]
+                new.write(u'\t'.join(fields) + u'\n')
+        os.rename(fileName + '.part', fileName)
+    return codecs.open(fileName, mode='a', encoding='utf-8')
+
+#the names of the countries, languages and genres of all the records, so that
+#each name is stored once
+_interned = {}
+
+def intern_string(s):
+    '''
+        Returns the stored copy of the string s, storing s if it has not been
+        seen before. Unlike the builtin intern() this accepts the unicode
+        strings returned by BeautifulSoup.
+        '''
+    return _interned.setdefault(s, s)
+
+class filmRecord(object):
+    '''
+    filmRecord(idnum, date, name, time, country, language, genre, writer, \
+               director, writerId=None, directorId=None)
+
+    The data on a film, as found by filmObtainItem.grab_record()
+
+    Parameters
+    ----------
+
+    idnum: integer
+        the imdb id number of the film
+
+    date: string
+        the year the film was released
+
+    name: string
+        the title of the film
+
+    time: float
+        the runtime of the film in minutes
+
+    country, language, genre: lists of strings
+        the countries in which the film was made, the languages used in it and
+        the genres that imdb use to describe it
+
+    writer, director: lists of strings
+        the writers and the directors of the film
+
+    writerId, directorId: lists of integers or None
+        the numbers of the imdb ids of the writers and the directors, e.g. 95
+        for nm0000095, None for a credit without an id. If not given, no
+        credit has an id.
+
+    Attributes
+    ----------
+
+    The parameters, with tuples in place of the lists, and
+
+    same: boolean
+        True if one of the writers was also one of the directors. The people
+        are compared by their imdb ids, and by their names if a credit has no
+        id.
+
+    '''
+    __slots__ = ('idnum', 'date', 'name', 'time', 'country', 'language', \
+                 'genre', 'writer', 'director', 'writerId', 'directorId', \
+                 'same')
+
+    def __init__(self, idnum, date, name, time, country, language, genre, \
+                 writer, director, writerId=None, directorId=None):
+        self.idnum = idnum
+        self.date = date
+        self.name = name
+        self.time = time
+        self.country = tuple([intern_string(c) for c in country])
+        self.language = tuple([intern_string(l) for l in language])
+        self.genre = tuple([intern_string(g) for g in genre])
+        self.writer = tuple(writer)
+        self.director = tuple(director)
+        self.writerId = tuple(writerId or [None] * len(writer))
+        self.directorId = tuple(directorId or [None] * len(director))
+        #each person is their imdb id number, or their name without an id
+        people = lambda ids, names: set([name if i is None else i for i, name \
+                                         in zip(ids, names)])
+        self.same = not people(self.writerId, writer).isdisjoint( \
+                        people(self.directorId, director))
+
+    def line(self):
+        '''
+            Returns the record as a line of the tab-separated data file of
+            filmObtainDataset.py: the id number, date, title, runtime,
+            countries, languages, genres, writers, directors and whether one of
+            the writers was also one of the directors, followed by the imdb ids
+            of the writers and of the directors. The lists are separated by
+            commas and a credit without an id has an empty id.
+            '''
+        ids = lambda numbers: u', '.join([u'' if i is None else u'nm%07d' %i \
+                                          for i in numbers])
+        return u"%d\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" %( \
+            self.idnum, self.date, self.name, str(self.time), \
+            ', '.join(self.country), ', '.join(self.language), \
+            ', '.join(self.genre), ', '.join(self.writer), \
+            ', '.join(self.director), self.same, ids(self.writerId), \
+            ids(self.directorId))
+
+class RecordWriter(object):
+    '''
+    RecordWriter(dataFile, batchSize=200)
+
+    Collects the records of the threads of the scraper and writes them to
+    dataFile batchSize at a time, so that the file is written and its lock
+    taken once per batch rather than once per film.
+
+    Parameters
+    ----------
+
+    dataFile: file stream
+        the file into which the records are written
+
+    batchSize: integer
+        the number of records written at a time
+
+    Attributes
+    ----------
+
+    written: integer
+        the number of records written so far
+
+    '''
+    def __init__(self, dataFile, batchSize=200):
+        self.dataFile = dataFile
+        self.batchSize = batchSize
+        self.written = 0
+        self._records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        '''adds a filmRecord, writing the batch if it is full'''
+        with self._lock:
+            self._records.append(record)
+            if len(self._records) >= self.batchSize:
+                self._write()
+
+    def flush(self):
+        '''writes the records that have not yet been written'''
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        if len(self._records) == 0:
+            return
+        self.dataFile.write(u''.join([record.line() for record in \
+                                      self._records]))
+        self.written += len(self._records)
+        self._records = []
@@ -0,0 +1,257 @@
+'''A store for the results of the analysis of each year.
+
+    The results used to be appended to a csv file, so a rerun duplicated the
+    header and the rows and an interrupted run could not be resumed. They are
+    now kept in an SQLite database with one row per (date, category, QSame).
+    Writing a year replaces all of its rows in one transaction and records a
+    hash of the year's input and the version of the model, so filmMCMC.py can
+    skip the years whose results are already current. results.csv is exported
+    from the database at the end of every run. Intended use:
+
+    store = ResultsStore('results.db')
+    key = input_hash(rows, columns, settings)
+    if not store.is_current(1950, key):
+        store.write_year(1950, resultRows, key)
+    store.export_csv('results.csv')
+
+    ResultsWriter does the writing in a background thread so that the process
+    handing out the work is never held up by the disk.
+
+    The columns of the results are:
+
+    date - the year in which the analyzed films were released
+
+    category - a country, language or genre. Can also be 'Global' to denote the
+                undeviated average runtime
+
+    QSame - whether or not the writer of the film was also the director. True
+             if the writer was the director, False if not and -1 if the
+             category is 'Global'
+
+    number - the number of films released in that category that year
+
+    linMean - Either this is the average number of minutes by which films
+               descibed by category differ from the global average in the
+               given year or, if the category is 'Global', this is the average
+               runtime of the movies in the analyzed year.
+
+    linSD - the standard deviation for the mean given in linMean
+
+    lin95Low - the 95% lower confidence bound for the mean given in linMean
+
+    lin95Hi - the 95% upper confidence bound for the mean given in linMean
+    '''
+
+import Queue
+import codecs
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from filmModel import MODEL_VERSION
+
+COLUMNS = ['date', 'category', 'QSame', 'number', 'linMean', 'linSD', \
+           'lin95Low', 'lin95Hi']
+
+
+class ResultsStore(object):
+    '''
+    ResultsStore(fileName)
+
+    The results of the analysis, stored in the SQLite database fileName which
+    is created if it does not exist.
+
+    Parameters
+    ----------
+
+    fileName: string
+        the database file
+
+    '''
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.db = sqlite3.connect(fileName)
+        #a year is still written atomically, but the log is not flushed to disk
+        #at the end of every year
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (date INTEGER, ' \
+                        'category TEXT, QSame TEXT, number REAL, linMean ' \
+                        'REAL, linSD REAL, lin95Low REAL, lin95Hi REAL, ' \
+                        'PRIMARY KEY (date, category, QSame))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS years (date INTEGER ' \
+                        'PRIMARY KEY, inputHash TEXT, modelVersion TEXT, ' \
+                        'written REAL)')
+        self.db.commit()
+
+    def is_current(self, year, inputHash, modelVersion=MODEL_VERSION):
+        '''
+            True if the results of year were found from the input with hash
+            inputHash by the model version modelVersion
+            '''
+        row = self.db.execute('SELECT inputHash, modelVersion FROM years ' \
+                              'WHERE date = ?', (int(year),)).fetchone()
+        return row is not None and tuple(row) == (inputHash, modelVersion)
+
+    def write_year(self, year, rows, inputHash, modelVersion=MODEL_VERSION):
+        '''
+            Replaces the results of year by rows in a single transaction, so
+            that a year is either stored completely or not at all.
+
+            Parameters
+            ----------
+
+            year: integer
+                the year in which the analyzed films were released
+
+            rows: list of tuples
+                one tuple per result with an entry for each of COLUMNS
+
+            inputHash: string
+                the input_hash() of the year's input
+
+            modelVersion: string
+                the version of the model that produced the results
+
+            '''
+        with self.db:
+            self.db.execute('DELETE FROM results WHERE date = ?', (int(year),))
+            self.db.executemany('INSERT OR REPLACE INTO results VALUES ' \
+                                '(?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.execute('INSERT OR REPLACE INTO years VALUES (?, ?, ?, ?)',\
+                            (int(year), inputHash, modelVersion, time.time()))
+
+    def keep_years(self, years):
+        '''
+            Deletes, in a single transaction, the results of every stored year
+            that is not one of years, such as a year whose films have all been
+            dropped from the data since its results were written.
+            '''
+        stale = [(year,) for year in set(self.years()) - \
+                 set([int(year) for year in years])]
+        with self.db:
+            self.db.executemany('DELETE FROM results WHERE date = ?', stale)
+            self.db.executemany('DELETE FROM years WHERE date = ?', stale)
+        return len(stale)
+
+    def years(self):
+        '''the years for which results are stored'''
+        return [row[0] for row in \
+                self.db.execute('SELECT date FROM years ORDER BY date')]
+
+    def export_csv(self, fileName):
+        '''
+            Writes all the results to the csv file fileName, ordered by year
+            and, within a year, in the order in which they were written. The
+            file is written under a temporary name and then renamed so that it
+            is never left half written.
+            '''
+        temporary = fileName + '.tmp'
+        with codecs.open(temporary, 'w', 'utf-8') as f:
+            f.write(','.join(COLUMNS) + '\n')
+            rows = self.db.execute('SELECT * FROM results ORDER BY date, ' \
+                                   'rowid').fetchall()
+            #format every row in a single operation
+            line = u','.join([u'%s'] * len(COLUMNS)) + u'\n'
+            f.write((line * len(rows)) % \
+                    tuple(itertools.chain.from_iterable(rows)))
+        os.rename(temporary, fileName)
+
+    def close(self):
+        self.db.close()
+
+
+class ResultsWriter(threading.Thread):
+    '''
+    ResultsWriter(fileName)
+
+    Writes results to the ResultsStore fileName from a background thread. The
+    results are queued by write_year() which returns at once. Other slow tasks,
+    such as storing results in a DiskCache, can be queued with submit(). An 
+    exception raised in the thread is raised again by close().
+
+    Parameters
+    ----------
+
+    fileName: string
+        the database file of the ResultsStore
+
+    '''
+    def __init__(self, fileName):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fileName = fileName
+        self.queue = Queue.Queue()
+        self.error = None
+        self.start()
+
+    def run(self):
+        #an SQLite connection can only be used by the thread that made it
+        store = ResultsStore(self.fileName)
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            if self.error is not None:
+                continue
+            function, args = task
+            try:
+                if function is None:
+                    store.write_year(*args)
+                else:
+                    function(*args)
+            except Exception as error:
+                self.error = error
+        store.close()
+
+    def write_year(self, year, rows, inputHash, modelVersion=MODEL_VERSION):
+        '''queues ResultsStore.write_year()'''
+        self.queue.put((None, (year, rows, inputHash, modelVersion)))
+
+    def submit(self, function, *args):
+        '''queues the call function(*args)'''
+        self.queue.put((function, args))
+
+    def close(self):
+        '''waits for the queued tasks to be done'''
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+def input_hash(rows, columns, settings):
+    '''
+        A hash of everything the results of a year depend on: the year's rows
+        of the wrangled data, the names of the columns and the settings of the
+        analysis.
+
+        Parameters
+        ----------
+
+        rows: array
+            the year's rows of the wrangled data, without the row numbers of
+            film_wrangled.csv, which change whenever a film of an earlier
+            year is added or dropped
+
+        columns: list of strings
+            the names of the columns of rows
+
+        settings: dictionary
+            the method and the settings of the sampler, anything json can
+            serialize
+
+        Returns
+        -------
+
+        string
+            the hexadecimal sha1 digest
+
+        '''
+    digest = hashlib.sha1()
+    digest.update(json.dumps([list(columns), settings], sort_keys=True))
+    digest.update(rows.tobytes())
+    return digest.hexdigest()
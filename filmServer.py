@@ -0,0 +1,439 @@
+'''A local stand-in for the pages of imdb.com that the scraper requests.
+
+    StandInServer serves made up title/ttN/ and title/ttN/fullcredits pages in
+    the layout that filmObtainItem.py parses, so that the scraper can be run
+    and timed without a request to imdb.com. Each id is a film, a TV series,
+    which the scraper records as "NA", or missing, which is a 404, as decided
+    by entry_kind(). The pages of an id are made up from a random state seeded
+    by the id, so every request of an id gets the same pages and the films that
+    a crawl should find are known in advance. Point the scraper at the server
+    by setting filmObtainItem.BASE_URL to its address.
+
+    The server can also be made to behave like a busy website: each request is
+    delayed by a latency drawn from a distribution, see latency_sampler(), and
+    a fraction of the requests are answered with a 503, have their connection
+    reset or have their page sent slowly, a piece at a time. These faults are
+    drawn for each request, so a retry may succeed. load_test() crawls a range
+    of ids from the server as filmObtainDataset.py does and reports the ids
+    crawled per second, the latency of the ids and how many of the ids that met
+    a fault were still recorded correctly. Intended use:
+
+    server = StandInServer(port=8001, latency='lognormal:0.05,0.5', \
+                           unavailable=0.01, reset=0.01, slow=0.01)
+    server.start()
+    filmObtainItem.BASE_URL = server.address
+    ...
+    server.stop()
+
+    Running this script serves the pages until it is interrupted or, with
+    --load-test, load tests the crawler against them.
+    '''
+
+import argparse
+import BaseHTTPServer
+import codecs
+import numpy as np
+import re
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+DIRECTORY=sys.path[0]
+
+#import the names of the countries, languages and genres
+with codecs.open(DIRECTORY+'/categories.txt', 'r', 'utf-8') as f:
+    countries=f.readline()
+    countries=np.array(countries.strip('\n').split(', '))
+    languages=f.readline()
+    languages=np.array(languages.strip('\n').split(', '))
+    genres=f.readline()
+    genres=np.array(genres.strip('\n').split(', '))
+
+#the kinds of entry
+FILM = 'film'
+TV = 'tv'
+MISSING = 'missing'
+
+#the faults of a request
+UNAVAILABLE = 'unavailable'
+RESET = 'reset'
+SLOW = 'slow'
+FAULTS = (UNAVAILABLE, RESET, SLOW)
+
+#the state that filmObtainItem.grab_record returns for each kind of entry
+EXPECTED_STATE = {FILM: "all data gained", TV: "NA", MISSING: "404"}
+
+#the path of a page of an entry
+pathRX = re.compile(r'^/title/tt(\d+)/(fullcredits)?$')
+
+def film_pages(idnum, rng):
+    '''
+        Returns the text of the primary page and of the full credits page of a
+        made up film with imdb id idnum, in the layout of the imdb.com pages
+        that filmObtainItem.py parses. The countries, languages and genres are
+        drawn from categories.txt and the writers and directors from a pool of
+        ten thousand people by the RandomState rng.
+        '''
+    pick = lambda names, most: [names[i] for i in rng.choice(len(names), \
+                                rng.randint(1, most + 1), replace=False)]
+    links = [u'<a href="/country/%s">%s</a>' %(c[:2].lower(), c) \
+             for c in pick(countries, 2)] + \
+            [u'<a href="/language/%s">%s</a>' %(l[:2].lower(), l) \
+             for l in pick(languages, 2)]
+    genreLinks = [u'<a href="/genre/%s">%s</a>' %(g, g) for g in \
+                  pick(genres, 3)]
+    primary = u'''<html><head><title>Film %d</title></head><body>
+<div class="infobar"><time itemprop="duration">%d min</time></div>
+<h1><span itemprop="name">Film %d</span> (<a href="/year/%d">%d</a>)</h1>
+<div itemprop="genre">%s</div>
+<div class="article" id="titleDetails">
+%s
+</div></body></html>''' %(idnum, rng.randint(60, 180), idnum, \
+        rng.randint(1910, 2016), rng.randint(1910, 2016), \
+        u' '.join(genreLinks), u'\n'.join(links))
+    people = [u'Person %d' %p for p in rng.randint(0, 10000, 4)]
+    directors = people[:rng.randint(1, 3)]
+    #about a third of the films are written by one of their directors
+    writers = directors[:1] if rng.rand() < 0.35 else []
+    writers += people[2:2 + rng.randint(1, 3)]
+    table = lambda names: u''.join([u'<tr><td class="name"><a href=' \
+        u'"/name/nm%07d/">%s</a></td></tr>' %(int(name[7:]), name) for name \
+        in names])
+    credits = u'''<html><body><div id="fullcredits_content" class="header">
+<h4>Directed by</h4>
+<table>
+%s</table>
+<h4>Writing Credits</h4>
+<table>
+%s</table>
+<h4>Cast</h4>
+<table>
+</table>
+</div></body></html>''' %(table(directors), table(writers))
+    return primary, credits
+
+def tv_page(idnum):
+    '''the primary page of a TV series, which the scraper records as "NA"'''
+    return u'''<html><head><title>Series %d</title></head><body>
+<div class="infobar">TV Series</div>
+<h1><span itemprop="name">Series %d</span></h1>
+</body></html>''' %(idnum, idnum)
+
+def entry_kind(idnum, films=0.1, tv=0.6, seed=0):
+    '''
+        Returns the kind of the entry with id idnum, FILM, TV or MISSING, with
+        probabilities films, tv and the rest, and the RandomState from which
+        its pages are made up
+        '''
+    rng = np.random.RandomState([seed, idnum])
+    r = rng.rand()
+    if r < films:
+        return FILM, rng
+    if r < films + tv:
+        return TV, rng
+    return MISSING, rng
+
+def latency_sampler(spec):
+    '''
+        Returns a function that draws a latency in seconds from a RandomState.
+
+        Parameters
+        ----------
+
+        spec: string
+            the distribution and its parameters in seconds: "none",
+            "fixed:t", "uniform:low,high", "exponential:mean" or
+            "lognormal:median,sigma", where sigma is the standard deviation of
+            the logarithm of the latency
+
+        '''
+    name, _, params = spec.partition(':')
+    params = [float(p) for p in params.split(',')] if params else []
+    if name == 'none':
+        return lambda rng: 0.
+    if name == 'fixed':
+        return lambda rng: params[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == 'exponential':
+        return lambda rng: rng.exponential(params[0])
+    if name == 'lognormal':
+        return lambda rng: params[0] * np.exp(params[1] * rng.randn())
+    raise ValueError('unknown latency distribution %s' %name)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Answers the requests of the pages of an entry'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        found = pathRX.match(self.path)
+        if found is None:
+            self.send_page(404, u'')
+            return
+        idnum, credits = int(found.group(1)), found.group(2) is not None
+        server = self.server
+        delay, fault = server.draw(idnum)
+        time.sleep(delay)
+        if fault == RESET:
+            server.reset(self.connection)
+            self.close_connection = 1
+            return
+        if fault == UNAVAILABLE:
+            self.send_page(503, u'')
+            return
+        kind, rng = entry_kind(idnum, server.films, server.tv, server.seed)
+        if kind == MISSING:
+            self.send_page(404, u'')
+        elif kind == TV:
+            self.send_page(200, u'' if credits else tv_page(idnum), fault)
+        else:
+            self.send_page(200, film_pages(idnum, rng)[int(credits)], fault)
+
+    def send_page(self, code, text, fault=None):
+        body = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if fault != SLOW:
+            self.wfile.write(body)
+            return
+        #a slow page is sent in ten pieces over slowSeconds
+        size = len(body) // 10 + 1
+        for start in range(0, len(body), size):
+            self.wfile.write(body[start:start + size])
+            self.wfile.flush()
+            time.sleep(self.server.slowSeconds / 10.)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    StandInServer(port=8001, films=0.1, tv=0.6, seed=0, latency='none', \
+                  unavailable=0., reset=0., slow=0., slowSeconds=2.)
+
+    A threaded HTTP server of made up imdb.com pages on localhost, see
+    entry_kind(), with latency and faults drawn for each request.
+
+    Parameters
+    ----------
+
+    port: integer
+        the port on which the server listens, 0 for any free port
+
+    films, tv: floats
+        the fractions of the ids that are films and TV series, the rest are
+        missing
+
+    seed: integer
+        the seed of the kinds and the pages of the entries, and of the latency
+        and the faults
+
+    latency: string
+        the distribution of the latency of a request, see latency_sampler()
+
+    unavailable, reset, slow: floats
+        the fractions of the requests that are answered with a 503, whose
+        connection is reset without an answer and whose page is sent slowly
+
+    slowSeconds: float
+        the number of seconds over which a slow page is sent
+
+    Attributes
+    ----------
+
+    address: string
+        the address of the server, e.g. http://localhost:8001
+
+    requests: integer
+        the number of requests answered
+
+    faulted: dictionary
+        the faults met by the requests of each id
+
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, port=8001, films=0.1, tv=0.6, seed=0, latency='none', \
+                 unavailable=0., reset=0., slow=0., slowSeconds=2.):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', port), \
+                                           StandInHandler)
+        self.films = films
+        self.tv = tv
+        self.seed = seed
+        self.latency = latency_sampler(latency)
+        self.rates = np.cumsum([unavailable, reset, slow])
+        self.slowSeconds = slowSeconds
+        self.address = 'http://localhost:%d' %self.server_address[1]
+        self.requests = 0
+        self.faulted = {}
+        self._rng = np.random.RandomState(seed)
+        self._lock = threading.Lock()
+        self._resets = set()
+        self._thread = None
+
+    def draw(self, idnum):
+        '''
+            Returns the latency and the fault, or None, of a request of a page
+            of the id idnum
+            '''
+        with self._lock:
+            self.requests += 1
+            delay = max(self.latency(self._rng), 0.)
+            i = np.searchsorted(self.rates, self._rng.rand(), 'right')
+            fault = FAULTS[i] if i < len(FAULTS) else None
+            if fault is not None:
+                self.faulted.setdefault(idnum, []).append(fault)
+            return delay, fault
+
+    def reset(self, connection):
+        '''closes the connection of a request with a reset once it is handled'''
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, \
+                              struct.pack('ii', 1, 0))
+        with self._lock:
+            self._resets.add(id(connection))
+
+    def shutdown_request(self, request):
+        with self._lock:
+            reset = id(request) in self._resets
+            self._resets.discard(id(request))
+        if reset:
+            #closing without a shutdown sends a reset rather than the end of
+            #the answer
+            request.close()
+        else:
+            BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def start(self):
+        '''serves the pages from a background thread'''
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        #a crawler that is killed or gives up drops its connections
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, \
+                                                   client_address)
+
+
+def load_test(server, first, last, stepsize=200):
+    '''
+        Crawls the ids from first to last from the stand-in server as
+        filmObtainDataset.main() does, stepsize ids at a time each in its own
+        thread which is given three seconds, but without a pause between the
+        steps, and prints
+
+        - the ids crawled per second
+        - the 50th and 99th percentiles of the time taken by an id, from the
+          first request of its pages to its record or its failure
+        - the states recorded for the ids, and the number that differ from
+          the state expected of their kind of entry
+        - for each fault, the number of ids that met it and the fraction of
+          those that were still recorded correctly, through the retries of
+          filmObtainItem.py
+
+        Returns a dictionary of the numbers printed.
+        '''
+    import filmObtainItem
+    from filmObtainItem import grab_record
+    filmObtainItem.BASE_URL = server.address
+    seconds, states = {}, {}
+
+    def get(i):
+        start = time.time()
+        state = grab_record(i)[1]
+        seconds[i] = time.time() - start
+        states[i] = state
+
+    start = time.time()
+    for j in range(first, last + 1, stepsize):
+        ids = range(j, min(j + stepsize, last + 1))
+        threads = [threading.Thread(target=get, args=(i,)) for i in ids]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            thread.join(3.)
+        for i, thread in zip(ids, threads):
+            if thread.isAlive():
+                states.setdefault(i, "ThreadTimeout")
+    elapsed = time.time() - start
+    ids = range(first, last + 1)
+    expected = dict((i, EXPECTED_STATE[entry_kind(i, server.films, \
+                     server.tv, server.seed)[0]]) for i in ids)
+    correct = set([i for i in ids if states[i] == expected[i]])
+    latency = np.array([seconds[i] for i in ids if i in seconds])
+    report = {'ids': len(ids), 'seconds': elapsed, \
+              'idsPerSecond': len(ids) / elapsed, 'requests': server.requests, \
+              'p50': np.percentile(latency, 50), \
+              'p99': np.percentile(latency, 99), 'wrong': len(ids) - \
+              len(correct), 'faults': {}}
+    print '%d ids in %.1fs, %.1f ids/s, %d requests' %(len(ids), elapsed, \
+        report['idsPerSecond'], server.requests)
+    print 'time per id: p50 %.3fs, p99 %.3fs' %(report['p50'], report['p99'])
+    counts = {}
+    for i in ids:
+        counts[states[i]] = counts.get(states[i], 0) + 1
+    for state in sorted(counts):
+        print '    %-25s %6d ids' %(state, counts[state])
+    print '%d ids recorded differently from their kind of entry' \
+        %report['wrong']
+    for fault in FAULTS:
+        hit = [i for i in ids if fault in server.faulted.get(i, [])]
+        if hit:
+            recovered = len([i for i in hit if i in correct])
+            report['faults'][fault] = (len(hit), recovered)
+            print '%-12s met by %5d ids, %5.1f%% recorded correctly' %(fault, \
+                len(hit), 100. * recovered / len(hit))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='a local stand-in for the ' \
+                                     'pages of imdb.com')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--films', type=float, default=0.1, \
+                        help='the fraction of the ids that are films')
+    parser.add_argument('--tv', type=float, default=0.6, \
+                        help='the fraction of the ids that are TV series, ' \
+                        'the rest are missing')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', default='none', help='the distribution ' \
+                        'of the latency of a request, e.g. lognormal:0.05,0.5')
+    parser.add_argument('--unavailable', type=float, default=0., \
+                        help='the fraction of the requests answered with a 503')
+    parser.add_argument('--reset', type=float, default=0., \
+                        help='the fraction of the connections that are reset')
+    parser.add_argument('--slow', type=float, default=0., \
+                        help='the fraction of the pages that are sent slowly')
+    parser.add_argument('--slow-seconds', type=float, default=2., \
+                        help='the seconds over which a slow page is sent')
+    parser.add_argument('--load-test', type=int, metavar='IDS', \
+                        help='crawl the ids from 1 to IDS and report')
+    args = parser.parse_args()
+    server = StandInServer(args.port, args.films, args.tv, args.seed, \
+                           args.latency, args.unavailable, args.reset, \
+                           args.slow, args.slow_seconds)
+    if args.load_test:
+        server.start()
+        try:
+            load_test(server, 1, args.load_test)
+        finally:
+            server.stop()
+        sys.exit()
+    print 'serving made up imdb.com pages at %s' %server.address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
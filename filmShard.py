@@ -0,0 +1,437 @@
+'''Crawls the imdb ids in shards on any number of processes and machines.
+
+    A LeaseCoordinator splits the ids into ranges and hands them out over
+    XML-RPC to the crawlers as leases. A lease expires unless it is renewed,
+    which a crawler does after each step of 200 ids, and the range of an
+    expired lease, e.g. of a crawler that died, is leased again to the next
+    crawler that asks. The coordinator saves the ranges that are complete, so
+    it can be restarted without crawling them again.
+
+    A crawler writes the films and the failures of each range to files of its
+    own, which are renamed to shard_<first id>.txt and shard_<first id>_fail.txt
+    only once the coordinator accepts that the range is complete, so a shard is
+    always a whole range crawled by a single lease. merge_shards() writes the
+    films of all the shards to one data file and the failures to one fail
+    file, in order of id, so the merged files are the same whatever the number
+    of crawlers and the order in which they finished. Intended use:
+
+    python filmShard.py coordinator --last 5000000 --port 8000
+    python filmShard.py crawl --coordinator http://host:8000 --shards shards
+    python filmShard.py merge shards*/shard_*.txt
+
+    python filmShard.py local --crawlers 4 --last 20000 runs a coordinator, the
+    stand-in server of filmServer.py and four crawler processes on one machine,
+    kills one of the crawlers part way through and checks that the merged data
+    file holds every film of the stand-in server exactly once.
+    '''
+
+import argparse
+import codecs
+import glob
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xmlrpclib
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+import filmObtainItem
+from filmObtainItem import grab_record
+from filmRecord import RecordWriter, HEADER
+from filmPeople import PersonIndex, index_data_file
+
+#the header of a fail file
+FAIL_HEADER = u"id\terror\n"
+
+
+class LeaseCoordinator(object):
+    '''
+    LeaseCoordinator(first, last, leaseSize=10000, expiry=600., stateFile=None)
+
+    Hands out the ids from first to last to the crawlers as leases of ranges
+    of leaseSize ids. The methods are served over XML-RPC by serve().
+
+    Parameters
+    ----------
+
+    first, last: integers
+        the first and the last id of the crawl
+
+    leaseSize: integer
+        the number of ids in a range
+
+    expiry: float
+        the number of seconds after which a lease that has not been renewed
+        expires
+
+    stateFile: string
+        the json file in which the complete ranges are saved, read if it
+        exists
+
+    '''
+    def __init__(self, first, last, leaseSize=10000, expiry=600., \
+                 stateFile=None):
+        self.ranges = [(start, min(start + leaseSize - 1, last)) for start in \
+                       range(first, last + 1, leaseSize)]
+        self.expiry = expiry
+        self.stateFile = stateFile
+        self.done = set()
+        if stateFile is not None and os.path.isfile(stateFile):
+            with open(stateFile) as f:
+                self.done = set(json.load(f))
+        #the token, the crawler and the expiry time of each leased range
+        self.leases = {}
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def lease(self, worker):
+        '''
+            Returns the index, the first and last id and the token of a range
+            leased to the crawler worker, or an empty list if every range is
+            leased or complete
+            '''
+        now = time.time()
+        with self._lock:
+            for index, (token, holder, expires) in self.leases.items():
+                if expires < now:
+                    print 'the lease of ids %d to %d by %s expired' %( \
+                        self.ranges[index] + (holder,))
+                    del self.leases[index]
+            for index, (first, last) in enumerate(self.ranges):
+                if index not in self.done and index not in self.leases:
+                    self._tokens += 1
+                    self.leases[index] = (self._tokens, worker, \
+                                          now + self.expiry)
+                    return [index, first, last, self._tokens]
+            return []
+
+    def renew(self, index, token):
+        '''extends a lease, returning False if it is no longer held'''
+        with self._lock:
+            if self.leases.get(index, (None,))[0] != token:
+                return False
+            self.leases[index] = (token, self.leases[index][1], \
+                                  time.time() + self.expiry)
+            return True
+
+    def complete(self, index, token):
+        '''
+            Marks the range of a lease as complete, returning False if the
+            lease is no longer held, in which case the range is crawled by
+            another lease
+            '''
+        with self._lock:
+            if self.leases.get(index, (None,))[0] != token:
+                return False
+            del self.leases[index]
+            self.done.add(index)
+            if self.stateFile is not None:
+                with open(self.stateFile, 'w') as f:
+                    json.dump(sorted(self.done), f)
+            return True
+
+    def finished(self):
+        '''True if every range is complete'''
+        return len(self.done) == len(self.ranges)
+
+    def progress(self):
+        '''the numbers of ranges, of complete ranges and of leased ranges'''
+        with self._lock:
+            return [len(self.ranges), len(self.done), len(self.leases)]
+
+def serve(coordinator, port=8000, host=''):
+    '''Returns an XML-RPC server of the coordinator, not yet serving'''
+    server = SimpleXMLRPCServer((host, port), allow_none=True, \
+                                logRequests=False)
+    for method in [coordinator.lease, coordinator.renew, \
+                   coordinator.complete, coordinator.finished, \
+                   coordinator.progress]:
+        server.register_function(method)
+    return server
+
+
+def crawl_range(first, last, dataFile, failFile, stepsize=200, pause=5., \
+                renew=None):
+    '''
+        Crawls the ids from first to last as filmObtainDataset.main() does,
+        stepsize at a time, writing the films and the failures to the files.
+
+        Parameters
+        ----------
+
+        first, last: integers
+            the first and the last id of the range
+
+        dataFile, failFile: file streams
+            the files into which the films and the failures are written
+
+        stepsize: integer
+            the number of ids requested at a time, each by its own thread
+
+        pause: float
+            the number of seconds between steps
+
+        renew: function
+            called after each step, the crawl stops if it returns False
+
+        Returns
+        -------
+
+        boolean
+            False if the crawl was stopped by renew()
+
+        '''
+    writer = RecordWriter(dataFile, batchSize=stepsize)
+    failLock = threading.Lock()
+    #each id is written once, as a film or a failure, by whichever of its
+    #thread and the timeout gets failLock first, and nothing is written once
+    #the range is done
+    crawling = [True]
+    settled = set()
+
+    def settle(i):
+        '''True if i is not yet written, called with failLock held'''
+        if not crawling[0] or i in settled:
+            return False
+        settled.add(i)
+        return True
+
+    def fail(i, state):
+        with failLock:
+            if settle(i):
+                failFile.write(u"%d\t%s\n" %(i, state))
+
+    def get(i):
+        record, state = grab_record(i)
+        if record is not None:
+            with failLock:
+                if settle(i):
+                    writer.add(record)
+        elif state != "NA":
+            fail(i, state)
+
+    try:
+        for j in range(first, last + 1, stepsize):
+            ids = range(j, min(j + stepsize, last + 1))
+            threads = [threading.Thread(target=get, args=(i,)) for i in ids]
+            for thread in threads:
+                thread.setDaemon(True)
+                thread.start()
+            for thread in threads:
+                thread.join(3.)
+            for i, thread in zip(ids, threads):
+                if thread.isAlive():
+                    fail(i, "ThreadTimeout")
+            writer.flush()
+            if renew is not None and not renew():
+                return False
+            if pause:
+                time.sleep(pause)
+        return True
+    finally:
+        with failLock:
+            crawling[0] = False
+
+def crawl_shards(coordinatorUrl, shardDir, worker=None, stepsize=200, \
+                 pause=5.):
+    '''
+        Crawls the ranges leased from the coordinator at coordinatorUrl until
+        every range is complete, writing the shards of the complete ranges in
+        the directory shardDir. Returns the number of ranges crawled.
+        '''
+    coordinator = xmlrpclib.ServerProxy(coordinatorUrl, allow_none=True)
+    if worker is None:
+        worker = '%s:%d' %(socket.gethostname(), os.getpid())
+    if not os.path.isdir(shardDir):
+        os.makedirs(shardDir)
+    crawled = 0
+    while True:
+        lease = coordinator.lease(worker)
+        if not lease:
+            if coordinator.finished():
+                return crawled
+            #the other ranges are leased, one may yet expire
+            time.sleep(max(pause, 1.))
+            continue
+        index, first, last, token = lease
+        name = os.path.join(shardDir, 'shard_%010d' %first)
+        part = '%s.%s.part' %(name, worker.replace(':', '_'))
+        with codecs.open(part, 'w', 'utf-8') as dataFile, \
+             codecs.open(part + '_fail', 'w', 'utf-8') as failFile:
+            dataFile.write(HEADER)
+            failFile.write(FAIL_HEADER)
+            complete = crawl_range(first, last, dataFile, failFile, \
+                stepsize, pause, lambda: coordinator.renew(index, token))
+        if complete and coordinator.complete(index, token):
+            os.rename(part, name + '.txt')
+            os.rename(part + '_fail', name + '_fail.txt')
+            crawled += 1
+            print '%s crawled ids %d to %d' %(worker, first, last)
+        else:
+            os.remove(part)
+            os.remove(part + '_fail')
+            print '%s lost the lease of ids %d to %d' %(worker, first, last)
+
+
+def read_lines(fileName):
+    '''the lines of a data or fail file after its header, keyed by their id'''
+    with codecs.open(fileName, 'r', 'utf-8') as f:
+        f.readline()
+        return [(int(line.split('\t', 1)[0]), line) for line in f]
+
+def merge_shards(shardNames, dataName, failName):
+    '''
+        Merges shards into one data file and one fail file.
+
+        Parameters
+        ----------
+
+        shardNames: list of strings
+            the data files of the shards, shard_<first id>.txt. The fail file
+            of each is found from its name.
+
+        dataName, failName: strings
+            the merged data file and fail file
+
+        Returns
+        -------
+
+        tuple
+            the numbers of films and of failures merged
+
+        '''
+    films, fails = {}, {}
+    #the shards are read in order of name so any id found twice is taken from
+    #the same shard every time
+    for name in sorted(set(shardNames)):
+        if name.endswith('_fail.txt'):
+            continue
+        for i, line in read_lines(name):
+            films.setdefault(i, line)
+        for i, line in read_lines(name[:-len('.txt')] + '_fail.txt'):
+            fails.setdefault(i, line)
+    for fileName, lines, header in [(dataName, films, HEADER), \
+                                    (failName, fails, FAIL_HEADER)]:
+        with codecs.open(fileName, 'w', 'utf-8') as f:
+            f.write(header)
+            for i in sorted(lines):
+                if lines is films or i not in films:
+                    f.write(lines[i])
+    return len(films), len([i for i in fails if i not in films])
+
+
+def run_local(crawlers=4, last=20000, leaseSize=1000, port=8000, \
+              serverPort=8001, expiry=10., kill=True):
+    '''
+        Runs a sharded crawl of the ids from 1 to last on this machine: a
+        coordinator and the stand-in server of filmServer.py in this process
+        and crawlers in processes of their own, each with its own shard
+        directory as if on its own machine. If kill is True the first crawler
+        is killed once a few ranges are complete, so its lease expires after
+        expiry seconds and is leased again. The shards are merged and the
+        merged data file is checked against the films of the stand-in server.
+        '''
+    from filmServer import StandInServer, entry_kind, FILM
+    directory = tempfile.mkdtemp()
+    server = StandInServer(serverPort)
+    server.start()
+    coordinator = LeaseCoordinator(1, last, leaseSize, expiry)
+    rpc = serve(coordinator, port, 'localhost')
+    rpcThread = threading.Thread(target=rpc.serve_forever)
+    rpcThread.setDaemon(True)
+    rpcThread.start()
+    try:
+        start = time.time()
+        processes = [subprocess.Popen([sys.executable, os.path.abspath( \
+            __file__), 'crawl', '--coordinator', 'http://localhost:%d' %port, \
+            '--shards', os.path.join(directory, 'node%d' %k), '--base-url', \
+            server.address, '--pause', '0']) for k in range(crawlers)]
+        killed = not kill
+        while not coordinator.finished():
+            if not killed and len(coordinator.done) >= crawlers:
+                processes[0].kill()
+                killed = True
+                print 'killed the first crawler, its lease expires in %.0fs' \
+                    %expiry
+            time.sleep(0.2)
+        for process in processes:
+            process.wait()
+        seconds = time.time() - start
+        shards = glob.glob(os.path.join(directory, 'node*', 'shard_*.txt'))
+        dataName = os.path.join(directory, 'Film_data.txt')
+        films, fails = merge_shards(shards, dataName, \
+                                    os.path.join(directory, 'Film_fail.txt'))
+        ids = [i for i, line in read_lines(dataName)]
+        expected = [i for i in range(1, last + 1) if entry_kind(i, \
+                    server.films, server.tv, server.seed)[0] == FILM]
+        print '%d ids crawled in %.1fs by %d crawlers, %.0f ids/s' %(last, \
+            seconds, crawlers, last / seconds)
+        print '%d films and %d failures merged from %d shards' %(films, \
+            fails, len([s for s in shards if not s.endswith('_fail.txt')]))
+        print 'every film found exactly once: %s' %(ids == expected)
+    finally:
+        rpc.shutdown()
+        server.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='a sharded crawl of imdb.com')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('coordinator', help='hand out the leases')
+    command.add_argument('--first', type=int, default=1)
+    command.add_argument('--last', type=int, default=5000000)
+    command.add_argument('--lease-size', type=int, default=10000, \
+                         help='the number of ids in a lease')
+    command.add_argument('--expiry', type=float, default=600., \
+                         help='the seconds after which a lease expires')
+    command.add_argument('--port', type=int, default=8000)
+    command.add_argument('--state', default='Film_leases.json', \
+                         help='the file of the complete ranges')
+    command = commands.add_parser('crawl', help='crawl the leased ranges')
+    command.add_argument('--coordinator', default='http://localhost:8000')
+    command.add_argument('--shards', default='shards', \
+                         help='the directory of the shards')
+    command.add_argument('--base-url', default=filmObtainItem.BASE_URL, \
+                         help='the address of the website')
+    command.add_argument('--pause', type=float, default=5., \
+                         help='the seconds between steps of 200 ids')
+    command = commands.add_parser('merge', help='merge the shards')
+    command.add_argument('shards', nargs='+')
+    command.add_argument('--data', default='Film_data.txt')
+    command.add_argument('--fail', default='Film_fail.txt')
+    command.add_argument('--people', default='Film_people.db', \
+                         help='the index of filmPeople.py of the films')
+    command = commands.add_parser('local', help='a sharded crawl of the ' \
+                                  'stand-in server on this machine')
+    command.add_argument('--crawlers', type=int, default=4)
+    command.add_argument('--last', type=int, default=20000)
+    command.add_argument('--lease-size', type=int, default=1000)
+    command.add_argument('--no-kill', action='store_true', \
+                         help='do not kill a crawler part way through')
+    args = parser.parse_args()
+
+    if args.command == 'coordinator':
+        coordinator = LeaseCoordinator(args.first, args.last, \
+                                       args.lease_size, args.expiry, args.state)
+        print '%d of %d ranges are complete, serving leases on port %d' %( \
+            len(coordinator.done), len(coordinator.ranges), args.port)
+        serve(coordinator, args.port).serve_forever()
+    elif args.command == 'crawl':
+        filmObtainItem.BASE_URL = args.base_url
+        crawl_shards(args.coordinator, args.shards, pause=args.pause)
+    elif args.command == 'merge':
+        films, fails = merge_shards(args.shards, args.data, args.fail)
+        people = PersonIndex(args.people)
+        index_data_file(args.data, people)
+        people.close()
+        print '%d films written to %s and %d failures to %s' %(films, \
+            args.data, fails, args.fail)
+    else:
+        run_local(args.crawlers, args.last, args.lease_size, \
+                  kill=not args.no_kill)
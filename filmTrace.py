@@ -0,0 +1,243 @@
+'''A disk-backed trace backend for pyMC2.
+
+    The default 'ram' backend keeps every sample of every traced variable in
+    memory until the end of the run. StreamingDatabase instead appends the
+    samples to binary files on disk in chunks of a fixed number of rows. The
+    mean and standard deviation are updated as each chunk is written and the 95%
+    HPD interval is found from the file at the end of the run, a block of
+    columns at a time. The memory used is therefore set by the chunk size and
+    not by the number of iterations. Like pyMC2's own backends, this module is
+    passed to MCMC as the database. Intended use:
+
+    import filmTrace
+    mc = MCMC(film_model_by_year(...), db=filmTrace, dbname='traces/1950', \
+              chunk=1000)
+    mc.sample(iter=300000, burn=75000, thin=10, progress_bar=False)
+    stats = mc.stats()
+    mc.db.remove()
+    '''
+
+import numpy as np
+import os
+import shutil
+from pymc.database import base
+
+
+class StreamingTrace(base.Trace):
+    '''
+    The trace of a single pyMC2 variable. Samples are buffered in memory and
+    appended to the file <dbname>/<name>.<chain>.dat whenever chunk samples
+    have been collected. The running count, mean and sum of squared deviations
+    are updated at every append.
+    '''
+    def _initialize(self, chain, length):
+        base.Trace._initialize(self, chain, length)
+        if not hasattr(self, '_files'):
+            self._files = {}
+            self._count = {}
+            self._mean = {}
+            self._M2 = {}
+        self._shape = np.shape(self._getfunc())
+        self._size = int(np.prod(self._shape))
+        self._buffer = np.empty((self.db.chunk, self._size))
+        self._n = 0
+        self._files[chain] = open(self._filename(chain), 'wb')
+        self._count[chain] = 0
+        self._mean[chain] = np.zeros(self._size)
+        self._M2[chain] = np.zeros(self._size)
+
+    def _filename(self, chain):
+        return os.path.join(self.db.dbname, '%s.%d.dat' %(self.name, chain))
+
+    def tally(self, chain):
+        self._buffer[self._n] = np.ravel(self._getfunc())
+        self._n += 1
+        if self._n == self.db.chunk:
+            self._flush(chain)
+
+    def _flush(self, chain):
+        '''
+            write the buffered samples to disk and merge their moments into the
+            running moments of the chain (Chan et al.'s pairwise update)
+            '''
+        if self._n == 0:
+            return
+        chunk = self._buffer[:self._n]
+        chunk.tofile(self._files[chain])
+        chunkMean = chunk.mean(0)
+        total = self._count[chain] + self._n
+        delta = chunkMean - self._mean[chain]
+        self._M2[chain] += ((chunk - chunkMean)**2).sum(0) + \
+                    delta**2 * self._count[chain] * self._n / float(total)
+        self._mean[chain] += delta * self._n / float(total)
+        self._count[chain] = total
+        self._n = 0
+
+    def truncate(self, index, chain):
+        self._flush(chain)
+
+    def _finalize(self, chain):
+        self._flush(chain)
+        self._files[chain].close()
+
+    def length(self, chain=-1):
+        chains = self._chains(chain)
+        return sum([self._count[c] for c in chains])
+
+    def _chains(self, chain):
+        '''the indices of the chains selected by chain, all of them if None'''
+        chains = sorted(self._count.keys())
+        if chain is None:
+            return chains
+        return [chains[chain]]
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        '''
+            Returns the samples of a chain as a read-only memory-mapped array of
+            shape (number of samples,) + shape of the variable.
+            '''
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+        traces = []
+        for c in self._chains(chain):
+            if self._count[c] == 0:
+                continue
+            tr = np.memmap(self._filename(c), dtype=np.float64, mode='r', \
+                           shape=(self._count[c],) + self._shape)
+            traces.append(tr[slicing])
+        if len(traces) == 1:
+            return traces[0]
+        return np.concatenate(traces)
+
+    __call__ = gettrace
+
+    def stats(self, alpha=0.05, start=0, batches=100, chain=None, \
+              quantiles=(2.5, 25, 50, 75, 97.5)):
+        '''
+            Returns the number of samples, the mean, the standard deviation and
+            the HPD interval in the format of pyMC2's stats(). The mean and
+            standard deviation come from the running moments, start and batches
+            are ignored.
+            '''
+        chains = self._chains(chain)
+        n = 0
+        mean = np.zeros(self._size)
+        M2 = np.zeros(self._size)
+        for c in chains:
+            if self._count[c] == 0:
+                continue
+            total = n + self._count[c]
+            delta = self._mean[c] - mean
+            M2 += self._M2[c] + delta**2 * n * self._count[c] / float(total)
+            mean += delta * self._count[c] / float(total)
+            n = total
+        if n == 0:
+            return
+        interval = np.empty((2, self._size))
+        for cols, block in self._column_blocks(chains):
+            interval[:, cols] = hpd(block, alpha)
+        shape = lambda x: x.reshape(self._shape) if self._shape else x[0]
+        return {'n': n, 'mean': shape(mean), \
+                'standard deviation': shape(np.sqrt(M2 / n)), \
+                '%d%% HPD interval' %int(100 * (1 - alpha)): \
+                np.array([shape(interval[0]), shape(interval[1])])}
+
+    def _column_blocks(self, chains):
+        '''
+            Yields the samples of all the chains a block of columns at a time.
+            Each block is assembled by reading the files chunk rows at a time so
+            that no more than db.blockBytes are held in memory.
+            '''
+        n = sum([self._count[c] for c in chains])
+        width = int(max(1, min(self._size, self.db.blockBytes // (8 * n))))
+        for first in range(0, self._size, width):
+            cols = slice(first, min(first + width, self._size))
+            block = np.empty((n, cols.stop - cols.start))
+            row = 0
+            for c in chains:
+                with open(self._filename(c), 'rb') as f:
+                    while True:
+                        rows = np.fromfile(f, dtype=np.float64, \
+                                           count=self.db.chunk * self._size)
+                        if len(rows) == 0:
+                            break
+                        rows = rows.reshape(-1, self._size)
+                        block[row:row + len(rows)] = rows[:, cols]
+                        row += len(rows)
+            yield cols, block
+
+
+class StreamingDatabase(base.Database):
+    '''
+    StreamingDatabase(dbname, chunk=1000, blockBytes=2**27)
+
+    A pyMC2 database that writes the traces to binary files in the directory
+    dbname.
+
+    Parameters
+    ----------
+
+    dbname: string
+        the directory in which the traces are stored. It is created if it does
+        not exist.
+
+    chunk: integer
+        the number of samples held in memory for each variable before they are
+        appended to its file
+
+    blockBytes: integer
+        the maximum number of bytes of samples read back into memory when
+        calculating the HPD intervals
+
+    '''
+    def __init__(self, dbname, chunk=1000, blockBytes=2**27):
+        base.Database.__init__(self, dbname)
+        self.__Trace__ = StreamingTrace
+        self.__name__ = 'stream'
+        self.chunk = chunk
+        self.blockBytes = blockBytes
+        if not os.path.isdir(dbname):
+            os.makedirs(dbname)
+
+    def remove(self):
+        '''deletes the trace files'''
+        shutil.rmtree(self.dbname, ignore_errors=True)
+
+
+#pyMC2 instantiates the backend module's Database class
+Trace = StreamingTrace
+Database = StreamingDatabase
+
+
+def hpd(x, alpha=0.05):
+    '''
+        Calculates the highest posterior density interval of each column of x,
+        i.e. the narrowest interval containing a fraction 1-alpha of the
+        samples. This is the same calculation as pymc.utils.hpd but is
+        vectorized over the columns.
+
+        Parameters
+        ----------
+
+        x: array like
+            the samples, one row per sample
+
+        alpha: float
+            the desired probability of type I error
+
+        Returns
+        -------
+
+        array
+            the lower bounds in the first row and the upper bounds in the second
+
+        '''
+    x = np.sort(np.asarray(x, dtype=np.float64), axis=0)
+    n = x.shape[0]
+    included = int(np.floor((1. - alpha) * n))
+    widths = x[included:] - x[:n - included]
+    lowest = np.argmin(widths, axis=0)
+    if x.ndim == 1:
+        return np.array([x[lowest], x[lowest + included]])
+    columns = np.arange(x.shape[1])
+    return np.array([x[lowest, columns], x[lowest + included, columns]])
@@ -0,0 +1,773 @@
+'''
+    Fast gaussian process regression of the yearly results, used by
+    filmPlot.py to find the 'slow trend'.
+
+    A gaussian process in one dimension with a Matern kernel of smoothness 5/2
+    is the output of a linear stochastic differential equation with a three
+    dimensional state: the trend and its first two derivatives. The posterior
+    of the trend given noisy observations can therefore be found by a Kalman
+    filter followed by a Rauch-Tung-Striebel smoother, in O(n) operations
+    rather than the O(n^3) of the usual gaussian process regression. Each year
+    has its own noise variance, the square of the standard deviation found by
+    the MCMC. The likelihood of the data, which the filter finds along the
+    way, is maximized to choose the amplitude and the length scale of the
+    kernel unless they are fixed.
+
+    fit_trends() fits every series at once instead. Their hyperparameters are
+    optimized together: a single Kalman filter runs over all the series,
+    carrying the derivatives of the likelihood by the hyperparameters along
+    with the state, and a quasi-Newton step is taken for each series from its
+    own gradient. With the hyperparameters found, each series is fitted by a
+    dense regression over the union of the years, with the years it lacks
+    masked out, and all of them are factorized together by a stacked LAPACK
+    call.
+
+    Run this script to compare the trends with those found by
+    GaussianProcessRegressor of scikit-learn for every plotted series, or with
+    --batched to compare fit_trends() with fit_trend().
+    '''
+
+import numpy as np
+from scipy.optimize import minimize
+from scipy.linalg import solve_triangular
+import argparse
+import sys
+
+DIRECTORY = sys.path[0]
+
+#the version of the fits, part of the key of the trends cached by filmPlot.py.
+#Change it whenever a change to the fits changes the trends
+TREND_VERSION = '2'
+
+
+def matern_state_space(amplitude, lengthScale):
+    '''
+        The state space form of the Matern 5/2 kernel
+
+        k(t) = amplitude^2 (1 + r + r^2/3) exp(-r), r = sqrt(5)|t|/lengthScale
+
+        Returns the feedback matrix F of the stochastic differential equation
+        dx/dt = F x + noise and the stationary covariance Pinf of the state x.
+        '''
+    lam = np.sqrt(5.) / lengthScale
+    F = np.array([[0., 1., 0.], [0., 0., 1.], \
+                  [-lam**3, -3. * lam**2, -3. * lam]])
+    kappa = amplitude**2 * lam**2 / 3.
+    Pinf = np.array([[amplitude**2, 0., -kappa], [0., kappa, 0.], \
+                     [-kappa, 0., amplitude**2 * lam**4]])
+    return F, Pinf
+
+def matern_transitions(steps, amplitude, lengthScale):
+    '''
+        The transition matrices A = expm(F step) of the state and the
+        covariances Q = Pinf - A Pinf A^T of the noise added over each of steps.
+        The characteristic polynomial of F is (s + lam)^3 so N = F + lam I is
+        nilpotent and the exponential has the closed form
+        
+        expm(F step) = exp(-lam step) (I + N step + N^2 step^2 / 2)
+        '''
+    F, Pinf = matern_state_space(amplitude, lengthScale)
+    lam = np.sqrt(5.) / lengthScale
+    N = F + lam * np.eye(3)
+    steps = np.asarray(steps, dtype=np.float64)[:, np.newaxis, np.newaxis]
+    A = np.exp(-lam * steps) * (np.eye(3) + N * steps + \
+                                N.dot(N) * steps**2 / 2.)
+    Q = Pinf - np.einsum('kij,jl,kml->kim', A, Pinf, A)
+    return A, Q, Pinf
+
+def kalman_smoother(times, y, noise, amplitude, lengthScale, smooth=True):
+    '''
+        The posterior of a zero mean gaussian process with a Matern 5/2 kernel
+        at each of times, given observations y with noise variances noise.
+        
+        Parameters
+        ----------
+        
+        times: array
+            increasing times
+        
+        y: array
+            the observation at each time, ignored where noise is infinite
+        
+        noise: array
+            the noise variance of each observation, np.inf where there is none
+        
+        amplitude, lengthScale: floats
+            the hyperparameters of the kernel
+        
+        smooth: bool
+            if False only the log likelihood is found, by the forward pass
+        
+        Returns
+        -------
+        
+        mean, variance: arrays
+            the posterior mean and variance of the process at each time, None 
+            if smooth is False
+        
+        logLikelihood: float
+            the log marginal likelihood of the observations
+        
+        '''
+    n = len(times)
+    A, Q, Pinf = matern_transitions(np.diff(times), amplitude, lengthScale)
+    
+    #forward pass: the Kalman filter
+    mPred = np.empty((n, 3))
+    PPred = np.empty((n, 3, 3))
+    mFilt = np.empty((n, 3))
+    PFilt = np.empty((n, 3, 3))
+    m, P = np.zeros(3), Pinf
+    logLikelihood = 0.
+    for k in range(n):
+        if k:
+            m = A[k - 1].dot(m)
+            P = A[k - 1].dot(P).dot(A[k - 1].T) + Q[k - 1]
+        mPred[k], PPred[k] = m, P
+        if noise[k] < np.inf:
+            S = P[0, 0] + noise[k]
+            gain = P[:, 0] / S
+            innovation = y[k] - m[0]
+            m = m + gain * innovation
+            P = P - np.outer(gain, gain) * S
+            logLikelihood -= 0.5 * (np.log(2. * np.pi * S) + innovation**2 / S)
+        mFilt[k], PFilt[k] = m, P
+    if not smooth:
+        return None, None, logLikelihood
+    
+    #backward pass: the Rauch-Tung-Striebel smoother
+    mean = np.empty(n)
+    variance = np.empty(n)
+    m, P = mFilt[-1], PFilt[-1]
+    mean[-1], variance[-1] = m[0], P[0, 0]
+    for k in range(n - 2, -1, -1):
+        G = np.linalg.solve(PPred[k + 1], A[k].dot(PFilt[k])).T
+        m = mFilt[k] + G.dot(m - mPred[k + 1])
+        P = PFilt[k] + G.dot(P - PPred[k + 1]).dot(G.T)
+        mean[k], variance[k] = m[0], P[0, 0]
+    return mean, np.maximum(variance, 0.), logLikelihood
+
+def log_likelihood(times, y, noise, amplitude, lengthScale):
+    '''
+        The log likelihood of kalman_smoother(..., smooth=False) for
+        observations with finite noise. The forward pass is written out on the
+        six distinct entries of the symmetric covariance with python floats,
+        which is much faster than numpy on 3x3 matrices. It is called at every
+        step of the optimization of the hyperparameters.
+        '''
+    A, Q, Pinf = matern_transitions(np.diff(times), amplitude, lengthScale)
+    A, Q = A.tolist(), Q.tolist()
+    y, noise = list(y), list(noise)
+    m0 = m1 = m2 = 0.
+    (p00, p01, p02), (_, p11, p12), (_, _, p22) = Pinf.tolist()
+    logLikelihood = 0.
+    for k in range(len(y)):
+        if k:
+            (a00, a01, a02), (a10, a11, a12), (a20, a21, a22) = A[k - 1]
+            (q00, q01, q02), (_, q11, q12), (_, _, q22) = Q[k - 1]
+            m0, m1, m2 = a00*m0 + a01*m1 + a02*m2, \
+                         a10*m0 + a11*m1 + a12*m2, a20*m0 + a21*m1 + a22*m2
+            #B = A P, then P = B A^T + Q
+            b00 = a00*p00 + a01*p01 + a02*p02
+            b01 = a00*p01 + a01*p11 + a02*p12
+            b02 = a00*p02 + a01*p12 + a02*p22
+            b10 = a10*p00 + a11*p01 + a12*p02
+            b11 = a10*p01 + a11*p11 + a12*p12
+            b12 = a10*p02 + a11*p12 + a12*p22
+            b20 = a20*p00 + a21*p01 + a22*p02
+            b21 = a20*p01 + a21*p11 + a22*p12
+            b22 = a20*p02 + a21*p12 + a22*p22
+            p00 = b00*a00 + b01*a01 + b02*a02 + q00
+            p01 = b00*a10 + b01*a11 + b02*a12 + q01
+            p02 = b00*a20 + b01*a21 + b02*a22 + q02
+            p11 = b10*a10 + b11*a11 + b12*a12 + q11
+            p12 = b10*a20 + b11*a21 + b12*a22 + q12
+            p22 = b20*a20 + b21*a21 + b22*a22 + q22
+        S = p00 + noise[k]
+        g0, g1, g2 = p00 / S, p01 / S, p02 / S
+        innovation = y[k] - m0
+        m0, m1, m2 = m0 + g0*innovation, m1 + g1*innovation, m2 + g2*innovation
+        p00, p01, p02 = p00 - g0*g0*S, p01 - g0*g1*S, p02 - g0*g2*S
+        p11, p12, p22 = p11 - g1*g1*S, p12 - g1*g2*S, p22 - g2*g2*S
+        logLikelihood -= 0.5 * (np.log(2. * np.pi * S) + innovation**2 / S)
+    return logLikelihood
+
+def stacked_transitions(steps, amplitudes, lengthScales):
+    '''
+        matern_transitions() for many series at once, each with its own
+        hyperparameters, together with the derivatives of A, Q and Pinf by the
+        logarithms of the amplitude and of the length scale. A does not depend
+        on the amplitude and Q and Pinf are proportional to its square. The
+        derivatives by lam follow from the closed form of A, since N = F + lam I
+        also depends on lam, and from Q = Pinf - A Pinf A^T.
+
+        Returns
+        -------
+
+        A, Q: arrays
+            of shape (series, steps, 3, 3)
+
+        Pinf: array
+            of shape (series, 3, 3)
+
+        dA, dQ, dPinf: arrays
+            the derivatives, with an axis of length two after the first for the
+            log amplitude and the log length scale
+
+        '''
+    lam = np.sqrt(5.) / np.asarray(lengthScales, dtype=np.float64)
+    square = np.asarray(amplitudes, dtype=np.float64)**2
+    zero, one = np.zeros(len(lam)), np.ones(len(lam))
+    stack = lambda rows: np.array(rows).transpose(2, 0, 1)
+    N = stack([[lam, one, zero], [zero, lam, one], \
+               [-lam**3, -3. * lam**2, -2. * lam]])
+    dN = stack([[one, zero, zero], [zero, one, zero], \
+                [-3. * lam**2, -6. * lam, -2. * one]])
+    NN = np.matmul(N, N)
+    dNN = np.matmul(dN, N) + np.matmul(N, dN)
+    steps = np.asarray(steps, dtype=np.float64)[np.newaxis, :, np.newaxis, \
+                                                np.newaxis]
+    decay = np.exp(-lam[:, np.newaxis, np.newaxis, np.newaxis] * steps)
+    A = decay * (np.eye(3) + N[:, np.newaxis] * steps + \
+                 NN[:, np.newaxis] * steps**2 / 2.)
+    dAdlam = -steps * A + decay * (dN[:, np.newaxis] * steps + \
+                                   dNN[:, np.newaxis] * steps**2 / 2.)
+    kappa = square * lam**2 / 3.
+    Pinf = stack([[square, zero, -kappa], [zero, kappa, zero], \
+                  [-kappa, zero, square * lam**4]])
+    dkappa = 2. * square * lam / 3.
+    dPinfdlam = stack([[zero, zero, -dkappa], [zero, dkappa, zero], \
+                       [-dkappa, zero, 4. * square * lam**3]])
+    AT = A.swapaxes(2, 3)
+    Q = Pinf[:, np.newaxis] - np.matmul(np.matmul(A, Pinf[:, np.newaxis]), AT)
+    #dA Pinf A^T + A Pinf dA^T is X + X^T
+    X = np.matmul(np.matmul(dAdlam, Pinf[:, np.newaxis]), AT)
+    dQdlam = dPinfdlam[:, np.newaxis] - X - X.swapaxes(2, 3) - \
+             np.matmul(np.matmul(A, dPinfdlam[:, np.newaxis]), AT)
+    #dlam / dlog(lengthScale) = -lam
+    scale = -lam[:, np.newaxis, np.newaxis, np.newaxis]
+    dA = np.stack([np.zeros_like(A), scale * dAdlam], axis=1)
+    dQ = np.stack([2. * Q, scale * dQdlam], axis=1)
+    dPinf = np.stack([2. * Pinf, scale[:, 0] * dPinfdlam], axis=1)
+    return A, Q, Pinf, dA, dQ, dPinf
+
+def log_likelihoods(times, y, noise, amplitudes, lengthScales):
+    '''
+        The log likelihoods of many series observed at some of the same times,
+        each with its own hyperparameters, and their gradients. One Kalman
+        filter runs over every series at once, so each step is a few stacked
+        numpy operations rather than a python loop per series, and the
+        derivatives of the state by the log amplitude and the log length scale
+        are carried along with it.
+
+        Parameters
+        ----------
+
+        times: array
+            the increasing times shared by the series
+
+        y, noise: arrays
+            of shape (series, times), the observations and their noise
+            variances, np.inf where a series has no observation
+
+        amplitudes, lengthScales: arrays
+            the hyperparameters of each series
+
+        Returns
+        -------
+
+        logLikelihood: array
+            the log likelihood of each series, as kalman_smoother()
+
+        gradient: array
+            of shape (series, 2), its derivatives by the log amplitude and the
+            log length scale
+
+        '''
+    A, Q, P, dA, dQ, dP = stacked_transitions(np.diff(times), amplitudes, \
+                                              lengthScales)
+    observed = np.isfinite(noise)
+    noise = np.where(observed, noise, 1.)
+    y = np.where(observed, y, 0.)
+    S = len(y)
+    m = np.zeros((S, 3))
+    dm = np.zeros((S, 2, 3))
+    logLikelihood = np.zeros(S)
+    gradient = np.zeros((S, 2))
+    for k in range(len(times)):
+        if k:
+            a, da = A[:, k - 1], dA[:, :, k - 1]
+            aT = a.swapaxes(1, 2)[:, np.newaxis]
+            dm = np.matmul(da, m[:, np.newaxis, :, np.newaxis])[..., 0] + \
+                 np.matmul(a[:, np.newaxis], dm[..., np.newaxis])[..., 0]
+            m = np.matmul(a, m[..., np.newaxis])[..., 0]
+            X = np.matmul(np.matmul(da, P[:, np.newaxis]), aT)
+            dP = X + X.swapaxes(2, 3) + np.matmul(np.matmul( \
+                    a[:, np.newaxis], dP), aT) + dQ[:, :, k - 1]
+            P = np.matmul(np.matmul(a, P), aT[:, 0]) + Q[:, k - 1]
+        #the update by the observation, kept only where there is one
+        isObserved = observed[:, k]
+        s = P[:, 0, 0] + noise[:, k]
+        ds = dP[:, :, 0, 0]
+        c, dc = P[:, :, 0], dP[:, :, :, 0]
+        innovation = y[:, k] - m[:, 0]
+        dInnovation = -dm[:, :, 0]
+        gain = c / s[:, np.newaxis]
+        dGain = dc / s[:, np.newaxis, np.newaxis] - c[:, np.newaxis] * \
+                (ds / s[:, np.newaxis]**2)[..., np.newaxis]
+        keep = isObserved[:, np.newaxis]
+        m = np.where(keep, m + gain * innovation[:, np.newaxis], m)
+        dm = np.where(keep[..., np.newaxis], dm + dGain * \
+                      innovation[:, np.newaxis, np.newaxis] + \
+                      gain[:, np.newaxis] * dInnovation[..., np.newaxis], dm)
+        outer = c[:, :, np.newaxis] * c[:, np.newaxis, :]
+        dOuter = dc[..., np.newaxis] * c[:, np.newaxis, np.newaxis, :]
+        dOuter = dOuter + dOuter.swapaxes(2, 3)
+        s3 = s[:, np.newaxis, np.newaxis]
+        dP = np.where(keep[..., np.newaxis, np.newaxis], dP - dOuter / \
+                      s3[..., np.newaxis] + outer[:, np.newaxis] * \
+                      (ds / s[:, np.newaxis]**2)[..., np.newaxis, \
+                      np.newaxis], dP)
+        P = np.where(keep[..., np.newaxis], P - outer / s3, P)
+        logLikelihood -= np.where(isObserved, 0.5 * (np.log(2. * np.pi * s) \
+                                  + innovation**2 / s), 0.)
+        gradient -= np.where(keep, 0.5 * (ds / s[:, np.newaxis] + 2. * \
+                             (innovation / s)[:, np.newaxis] * dInnovation - \
+                             (innovation**2 / s**2)[:, np.newaxis] * ds), 0.)
+    return logLikelihood, gradient
+
+def maximize_likelihoods(times, y, noise, amplitudes, lengthScales, \
+                         bounds=((-5., 8.), (0., 6.)), maxPasses=500):
+    '''
+        Finds the amplitude and the length scale that maximize the likelihood
+        of each of many series, by a quasi-Newton method within the bounds of
+        fit_trend(). Each series is optimized on its own, with its own inverse
+        Hessian and backtracking line search, but the likelihoods of all the
+        series that have not converged are found together by
+        log_likelihoods(), with their gradients, each at its own trial point:
+        a series whose step was too long tries a shorter one in the same pass
+        as the others take their next step. The tolerances are those of
+        L-BFGS-B in fit_trend().
+
+        Parameters
+        ----------
+
+        times, y, noise: arrays
+            as for log_likelihoods()
+
+        amplitudes, lengthScales: arrays
+            the hyperparameters of each series from which to start
+
+        bounds: tuple
+            the lower and upper bounds of the log amplitude and of the log
+            length scale
+
+        maxPasses: integer
+            the largest number of passes of the filter
+
+        Returns
+        -------
+
+        amplitudes, lengthScales: arrays
+            the hyperparameters of each series at the maximum
+
+        '''
+    lower, upper = np.array(bounds, dtype=np.float64).T
+    x = np.clip(np.column_stack([np.log(amplitudes), np.log(lengthScales)]), \
+                lower, upper)
+    S = len(x)
+
+    def evaluate(rows, at):
+        logLikelihood, gradient = log_likelihoods(times, y[rows], \
+                                    noise[rows], np.exp(at[:, 0]), \
+                                    np.exp(at[:, 1]))
+        return -logLikelihood, -gradient
+
+    def projected(at, gradient):
+        return np.clip(at - gradient, lower, upper) - at
+
+    f, g = evaluate(np.arange(S), x)
+    H = np.tile(np.eye(2), (S, 1, 1))
+    #the series whose inverse Hessian is the identity, not yet scaled
+    fresh = np.ones(S, dtype=bool)
+    direction = np.zeros((S, 2))
+    step = np.ones(S)
+    halvings = np.zeros(S, dtype=int)
+
+    def new_steps(rows):
+        d = -np.matmul(H[rows], g[rows][..., np.newaxis])[..., 0]
+        #at a bound a step outwards is dropped, and if what is left does not
+        #go downhill the projected gradient is followed instead
+        d[((x[rows] <= lower) & (d < 0.)) | ((x[rows] >= upper) & (d > 0.))] \
+            = 0.
+        uphill = (d * g[rows]).sum(axis=1) >= 0.
+        d[uphill] = projected(x[rows][uphill], g[rows][uphill])
+        H[rows[uphill]] = np.eye(2)
+        fresh[rows[uphill]] = True
+        #as in L-BFGS-B, a step along the gradient is at most one long
+        scale = np.where(fresh[rows], np.maximum(np.sqrt((d**2).sum(axis=1)), \
+                                                 1.), 1.)
+        direction[rows] = d / scale[:, np.newaxis]
+        step[rows] = 1.
+        halvings[rows] = 0
+
+    active = np.flatnonzero(np.abs(projected(x, g)).max(axis=1) > 1e-5)
+    new_steps(active)
+    for p in range(maxPasses):
+        if len(active) == 0:
+            break
+        at = np.clip(x[active] + step[active, np.newaxis] * \
+                     direction[active], lower, upper)
+        fTry, gTry = evaluate(active, at)
+        accepted = fTry <= f[active] + 1e-4 * ((at - x[active]) * \
+                                               g[active]).sum(axis=1)
+        #a step that does not decrease minus the likelihood enough is halved,
+        #and a series whose step cannot be made short enough is stopped
+        rejected = active[~accepted]
+        step[rejected] /= 2.
+        halvings[rejected] += 1
+        stalled = rejected[halvings[rejected] >= 30]
+
+        #the BFGS update of the inverse Hessian where the curvature is positive
+        rows = active[accepted]
+        s = at[accepted] - x[rows]
+        change = gTry[accepted] - g[rows]
+        curvature = (s * change).sum(axis=1)
+        update = curvature > 1e-12
+        Hr = H[rows]
+        #the identity is first scaled to the curvature along the step
+        scaled = update & fresh[rows]
+        Hr[scaled] = (curvature[scaled] / (change[scaled]**2).sum( \
+                      axis=1))[:, np.newaxis, np.newaxis] * np.eye(2)
+        rho = 1. / curvature[update]
+        su, cu = s[update], change[update]
+        V = np.eye(2) - rho[:, np.newaxis, np.newaxis] * su[:, :, np.newaxis] \
+            * cu[:, np.newaxis, :]
+        Hr[update] = np.matmul(np.matmul(V, Hr[update]), V.swapaxes(1, 2)) + \
+            rho[:, np.newaxis, np.newaxis] * su[:, :, np.newaxis] * \
+            su[:, np.newaxis, :]
+        H[rows] = Hr
+        fresh[rows[update]] = False
+        reduction = (f[rows] - fTry[accepted]) / np.maximum(np.maximum( \
+                     np.abs(f[rows]), np.abs(fTry[accepted])), 1.)
+        x[rows], f[rows], g[rows] = at[accepted], fTry[accepted], \
+                                    gTry[accepted]
+        converged = (np.abs(projected(x[rows], g[rows])).max(axis=1) <= \
+                     1e-5) | (reduction <= 1e7 * np.finfo(float).eps)
+        new_steps(rows[~converged])
+        active = active[~np.in1d(active, np.concatenate([rows[converged], \
+                                                         stalled]))]
+    return np.exp(x[:, 0]), np.exp(x[:, 1])
+
+def fit_trend(year, mean, sd, grid, lengthScale=10., amplitude=None, \
+              optimize=True):
+    '''
+        Fits the trend of a series of yearly results and predicts it on grid.
+
+        As in filmPlot.plot_gaussian the mean of the results is subtracted
+        before the fit and the noise of each year is its standard deviation
+        squared.
+
+        Parameters
+        ----------
+
+        year: array
+            the years of the results
+
+        mean, sd: arrays
+            the result of each year and its standard deviation
+
+        grid: array
+            the years at which to predict the trend
+
+        lengthScale: float
+            the length scale of the kernel in years, the starting point of the
+            optimization if optimize is True
+
+        amplitude: float or None
+            the amplitude of the kernel. If None it starts from the standard
+            deviation of the results.
+
+        optimize: bool
+            if True the amplitude and the length scale maximize the likelihood
+            of the results, otherwise they are fixed
+
+        Returns
+        -------
+
+        gridMean, gridSD: arrays
+            the predicted trend and its standard deviation at each year of grid
+
+        parameters: dictionary
+            'amplitude', 'lengthScale' and 'logLikelihood' of the fit
+
+        '''
+    year = np.asarray(year, dtype=np.float64)
+    offset = np.mean(mean)
+    if amplitude is None:
+        amplitude = max(np.std(mean), 1e-3)
+
+    #the observations and the prediction points in one increasing sequence
+    times = np.concatenate([year, np.asarray(grid, dtype=np.float64)])
+    y = np.concatenate([np.asarray(mean) - offset, np.zeros(len(grid))])
+    noise = np.concatenate([np.asarray(sd)**2, np.repeat(np.inf, len(grid))])
+    order = np.argsort(times, kind='mergesort')
+    times, y, noise = times[order], y[order], noise[order]
+
+    if optimize:
+        #the prediction points do not change the likelihood
+        observed = np.asarray(year)
+        centred = np.asarray(mean) - offset
+        variances = np.asarray(sd)**2
+        objective = lambda x: -log_likelihood(observed, centred, variances, \
+                                              np.exp(x[0]), np.exp(x[1]))
+        result = minimize(objective, np.log([amplitude, lengthScale]), \
+                          method='L-BFGS-B', bounds=[(-5., 8.), (0., 6.)])
+        amplitude, lengthScale = np.exp(result.x)
+    smoothMean, variance, logLikelihood = kalman_smoother(times, y, noise, \
+                                                    amplitude, lengthScale)
+    isGrid = order >= len(year)
+    positions = order[isGrid] - len(year)
+    gridMean = np.empty(len(grid))
+    gridSD = np.empty(len(grid))
+    gridMean[positions] = smoothMean[isGrid] + offset
+    gridSD[positions] = np.sqrt(variance[isGrid])
+    return gridMean, gridSD, {'amplitude': amplitude, \
+                              'lengthScale': lengthScale, \
+                              'logLikelihood': logLikelihood}
+
+def trend_grid(year):
+    '''the 100 years at which filmPlot.plot_gaussian predicts a trend'''
+    return np.linspace(min(year)-2, max(year)+2, 100)
+
+def matern_kernel(t1, t2, amplitude, lengthScale):
+    '''
+        The Matern 5/2 kernel of matern_state_space() between every pair of
+        times in the arrays t1 and t2, which broadcast against each other
+        '''
+    r = np.sqrt(5.) * np.abs(t1 - t2) / lengthScale
+    return amplitude**2 * (1. + r + r**2 / 3.) * np.exp(-r)
+
+def fit_trends(series, lengthScale=10., amplitudes=None, optimize=False):
+    '''
+        Fits the trends of many series of yearly results at once and predicts
+        each on its trend_grid(). With fixed hyperparameters each trend is the
+        same as that of fit_trend(..., optimize=False). If optimize is True the
+        hyperparameters of every series are first found together by
+        maximize_likelihoods().
+
+        The kernel matrix is built once over the union of the years of all the
+        series. For each series the rows and columns of the years it lacks are
+        replaced by those of the identity matrix and its results there are set
+        to zero, which leaves its regression on the years it has unchanged.
+        The matrices of all the series then have the same shape and are
+        factorized by one stacked call to numpy.linalg. When the
+        hyperparameters are optimized each series has its own length scale and
+        so its own kernel matrix.
+
+        Parameters
+        ----------
+
+        series: list of tuples
+            (year, mean, sd) arrays of each series, as for fit_trend()
+
+        lengthScale: float
+            the length scale of the kernel in years, shared by every series,
+            the starting point of the optimization if optimize is True
+
+        amplitudes: array or None
+            the amplitude of the kernel for each series. If None it is the
+            standard deviation of the series' results, as in fit_trend().
+
+        optimize: bool
+            if True the amplitude and the length scale of each series maximize
+            the likelihood of its results, otherwise they are fixed
+
+        Returns
+        -------
+
+        list of tuples
+            (grid, gridMean, gridSD) of each series: the years of its
+            trend_grid(), the predicted trend and its standard deviation
+
+        '''
+    years = np.unique(np.concatenate([s[0] for s in series])).astype( \
+                                                                np.float64)
+    S, n = len(series), len(years)
+    observed = np.zeros((S, n), dtype=bool)
+    y = np.zeros((S, n))
+    noise = np.ones((S, n))
+    grids = np.empty((S, 100))
+    offsets = np.empty(S)
+    if amplitudes is None:
+        amplitudes = [max(np.std(s[1]), 1e-3) for s in series]
+    amplitudes = np.asarray(amplitudes, dtype=np.float64)
+    for i, (year, mean, sd) in enumerate(series):
+        columns = np.searchsorted(years, year)
+        offsets[i] = np.mean(mean)
+        observed[i, columns] = True
+        y[i, columns] = np.asarray(mean) - offsets[i]
+        noise[i, columns] = np.asarray(sd)**2
+        grids[i] = trend_grid(year)
+    lengthScales = np.repeat(np.float64(lengthScale), S)
+    if optimize:
+        amplitudes, lengthScales = maximize_likelihoods(years, y, \
+            np.where(observed, noise, np.inf), amplitudes, lengthScales)
+    scales = lengthScales[:, np.newaxis, np.newaxis]
+    correlation = matern_kernel(years[:, np.newaxis], years, 1., scales)
+
+    K = amplitudes[:, np.newaxis, np.newaxis]**2 * correlation * \
+        (observed[:, :, np.newaxis] & observed[:, np.newaxis, :])
+    K[:, np.arange(n), np.arange(n)] += np.where(observed, noise, 1.)
+    L = np.linalg.cholesky(K)
+
+    #the covariance of each grid point with each observed year
+    crossK = amplitudes[:, np.newaxis, np.newaxis]**2 * \
+             matern_kernel(years, grids[:, :, np.newaxis], 1., scales) * \
+             observed[:, np.newaxis, :]
+    #solve L [w, V] = [y, crossK^T] by forward substitution for each series
+    solved = np.array([solve_triangular(L[i], np.column_stack([y[i], \
+                       crossK[i].T]), lower=True) for i in range(S)])
+    w, V = solved[:, :, 0], solved[:, :, 1:]
+    gridMean = np.einsum('sni,sn->si', V, w) + offsets[:, np.newaxis]
+    variance = amplitudes[:, np.newaxis]**2 - np.einsum('sni,sni->si', V, V)
+    gridSD = np.sqrt(np.maximum(variance, 0.))
+    return [(grids[i], gridMean[i], gridSD[i]) for i in range(S)]
+
+def parity_check(fileName):
+    '''
+        Compares fit_trend() with GaussianProcessRegressor for every series
+        plotted by filmPlot.py. Prints, for each series, the largest difference
+        of the predicted trends in units of the sklearn standard deviation and
+        the largest ratio of the standard deviations, both for a Matern 5/2
+        kernel with fixed hyperparameters, for which the two should agree to
+        rounding, and with the hyperparameters optimized by each.
+        '''
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import ConstantKernel, Matern
+    from filmPlot import read_results, plottable, plotted_series
+    import time
+    df = read_results(fileName)
+    times = {}
+    for engine in ['kalman', 'sklearn']:
+        for key in ['fixed', 'optimized']:
+            times[engine, key] = 0.
+    worst = {'fixed': 0., 'optimized': 0.}
+    print '%-24s %-6s %12s %12s %12s %12s' %('category', 'series', \
+        'fixed dMean', 'fixed SD', 'opt dMean', 'opt SD')
+    for name, data in df.groupby('category'):
+        if not plottable(data, name):
+            continue
+        for label, s in plotted_series(data, name):
+            year = s['date'].values.astype(np.float64)
+            mean, sd = s['linMean'].values, s['linSD'].values
+            grid = trend_grid(year)
+            row = []
+            for optimize in [False, True]:
+                key = 'optimized' if optimize else 'fixed'
+                amplitude = np.std(mean)
+                kernel = ConstantKernel(amplitude**2, 'fixed' if not optimize \
+                            else (1e-5, 1e8)) * Matern(10., 'fixed' if not \
+                            optimize else (1., 400.), nu=2.5)
+                start = time.time()
+                gp = GaussianProcessRegressor(kernel=kernel, alpha=sd**2, \
+                                              normalize_y=True)
+                gp.fit(year[:, np.newaxis], mean)
+                skMean, skSD = gp.predict(grid[:, np.newaxis], return_std=True)
+                times['sklearn', key] += time.time() - start
+                start = time.time()
+                kMean, kSD, parameters = fit_trend(year, mean, sd, grid, \
+                                10., amplitude, optimize)
+                times['kalman', key] += time.time() - start
+                shift = np.max(np.abs(kMean - skMean) / skSD)
+                ratio = np.max(np.maximum(kSD / skSD, skSD / kSD))
+                worst[key] = max(worst[key], shift)
+                row += [shift, ratio]
+            print '%-24s %-6s %12.2e %12.6f %12.2e %12.6f' %tuple([name[:24], \
+                                                                label] + row)
+    print 'largest difference of the trends in sklearn SDs: fixed %.2e, ' \
+        'optimized %.2e' %(worst['fixed'], worst['optimized'])
+    for key in ['fixed', 'optimized']:
+        print 'time with %s hyperparameters: kalman %.2fs, sklearn %.2fs' \
+            %(key, times['kalman', key], times['sklearn', key])
+
+def batch_check(fileName, repeat=3):
+    '''
+        Compares fit_trends() with fit_trend() and GaussianProcessRegressor for
+        every series plotted by filmPlot.py, first with the hyperparameters
+        fixed and then with them optimized. Prints the best of repeat timings
+        of fitting every series by each, with the RBF kernel of filmPlot.py as
+        well when optimized, and the largest difference of the trends of
+        fit_trends() and fit_trend() in units of the standard deviation. Once
+        optimized, the likelihood of a few series has more than one maximum
+        and the two may find different ones, so the number of series whose
+        trends differ by more than a hundredth of a standard deviation is
+        printed too.
+        '''
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import ConstantKernel, Matern, RBF
+    from filmPlot import read_results, plottable, plotted_series
+    import time
+    df = read_results(fileName)
+    series = []
+    for name, data in df.groupby('category'):
+        if plottable(data, name):
+            for label, s in plotted_series(data, name):
+                series.append((s['date'].values.astype(np.float64), \
+                               s['linMean'].values, s['linSD'].values))
+
+    def kalman(optimize):
+        return [fit_trend(year, mean, sd, trend_grid(year), \
+                          optimize=optimize)[:2] for year, mean, sd in series]
+
+    def sklearn(kernel):
+        for year, mean, sd in series:
+            gp = GaussianProcessRegressor(kernel=kernel(mean), alpha=sd**2, \
+                                          normalize_y=True)
+            gp.fit(year[:, np.newaxis], mean)
+            gp.predict(trend_grid(year)[:, np.newaxis], return_std=True)
+
+    amplitude = lambda mean: max(np.std(mean), 1e-3)**2
+    engines = {False: [('sklearn', lambda: sklearn(lambda mean: \
+                            ConstantKernel(amplitude(mean), 'fixed') * \
+                            Matern(10., 'fixed', nu=2.5))), \
+                       ('kalman', lambda: kalman(False)), \
+                       ('batched', lambda: fit_trends(series))], \
+               True: [('sklearn', lambda: sklearn(lambda mean: \
+                           ConstantKernel(amplitude(mean), (1e-5, 1e8)) * \
+                           Matern(10., (1., 400.), nu=2.5))), \
+                      ('sklearn RBF', lambda: sklearn(lambda mean: \
+                           1. * RBF(10.))), \
+                      ('kalman', lambda: kalman(True)), \
+                      ('batched', lambda: fit_trends(series, optimize=True))]}
+    print 'fitting %d series' %len(series)
+    for optimize in [False, True]:
+        print 'with the hyperparameters %s:' %('optimized' if optimize else \
+                                               'fixed')
+        for name, function in engines[optimize]:
+            times = []
+            for i in range(repeat):
+                start = time.time()
+                function()
+                times.append(time.time() - start)
+            print '    %-16s %8.4fs' %(name, min(times))
+        shifts = np.array([np.max(np.abs(kMean - bMean) / kSD) for \
+                           (kMean, kSD), (grid, bMean, bSD) in \
+                           zip(kalman(optimize), fit_trends(series, \
+                                                  optimize=optimize))])
+        print '    largest difference of the trends in SDs %.2e, %d series ' \
+            'differ by more than 0.01' %(shifts.max(), (shifts > 0.01).sum())
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='compare the Kalman ' \
+                                     'smoother trends with scikit-learn')
+    parser.add_argument('--results', default=DIRECTORY+'/results.csv', \
+                        help='the results of the MCMC')
+    parser.add_argument('--batched', action='store_true', \
+                        help='compare the batched trends with the Kalman ' \
+                        'smoother instead')
+    args = parser.parse_args()
+    if args.batched:
+        batch_check(args.results)
+    else:
+        parity_check(args.results)
@@ -2,19 +2,127 @@
     writes two new files. The first file is a comma seperated file containing 
     data on all the films in the analysis. The second is a text file containing 
     a list of all the countries, languages and genres that are represented in 
-    the data.'''
+    the data. The films that are listed more than once are reported in the file
+    film_duplicates.txt.'''
 import pandas as pd
 import numpy as np
 from string import split
 import codecs
+import re
 import sys
+import unicodedata
 DIRECTORY = sys.path[0]
 
+#the characters that normalize() removes or decomposes
+punctuationRX = re.compile(r'[\W_]+', re.UNICODE)
+nonAsciiRX = re.compile(u'[^\x00-\x7f]')
+
+class DuplicateIndex(object):
+    '''
+    DuplicateIndex()
+    
+    An index of the fingerprints of the films seen so far, used to drop the 
+    films that are listed more than once. The fingerprint of a film is a hash 
+    of its normalized title, its year, its runtime in whole minutes and its 
+    sorted directors: their imdb ids if the data file has them, otherwise their
+    normalized names. A film listed under two imdb ids with a differently 
+    written title or different countries, languages, genres or writers is 
+    therefore found by one dictionary lookup. Only the fingerprint and the id of
+    each film are kept, so the films can be passed a chunk at a time.
+    
+    Attributes
+    ----------
+    
+    seen: integer
+        the number of films passed to keep()
+    
+    clusters: dictionary
+        the imdb id of each film that was kept and had duplicates, mapped to a 
+        list of the id, date, runtime and title of each duplicate
+    
+    '''
+    def __init__(self):
+        self.seen = 0
+        self.clusters = {}
+        self._first = {}
+    
+    def keep(self, df):
+        '''
+            Returns an array that is True for each film of the dataframe df 
+            that has not been seen before, in df or in an earlier call, and 
+            False for its duplicates.
+            '''
+        names = df['director']
+        if 'directorId' in df.columns:
+            ids = df['directorId']
+        else:
+            ids = [None] * len(df)
+        keep = np.ones(len(df), dtype=bool)
+        for i, (idnum, date, length, title, name, director) in enumerate(zip( \
+                df['id'], df['date'], df['length'], df['title'], names, ids)):
+            #the ids are used as they are, the names are normalized
+            if isinstance(director, basestring) and director.strip(', ') != '':
+                director = sorted(director.split(', '))
+            elif isinstance(name, basestring):
+                director = sorted([normalize(d) for d in name.split(',')])
+            else:
+                director = []
+            fingerprint = hash((normalize(title), date, round(length), \
+                                tuple(director)))
+            if fingerprint in self._first:
+                keep[i] = False
+                first = self._first[fingerprint]
+                self.clusters.setdefault(first, []).append((idnum, date, \
+                                                            length, title))
+            else:
+                self._first[fingerprint] = idnum
+        self.seen += len(df)
+        return keep
+    
+    def report(self, fileName, kept):
+        '''
+            Writes the clusters of duplicates to the tab-separated file 
+            fileName, one line per film: the id of the film that was kept, the
+            id, date, runtime and title of the film. The first line of each 
+            cluster is the film that was kept, whose data are looked up in the
+            dataframe kept. Returns the number of clusters.
+            '''
+        kept = kept.set_index('id')
+        with codecs.open(fileName, 'w', 'utf-8') as f:
+            f.write(u'cluster\tid\tdate\tlength\ttitle\n')
+            for first in sorted(self.clusters):
+                films = [(first, kept.at[first, 'date'], \
+                          kept.at[first, 'length'], kept.at[first, 'title'])] \
+                        + self.clusters[first]
+                for idnum, date, length, title in films:
+                    f.write(u'%d\t%d\t%s\t%s\t%s\n' %(first, idnum, date, \
+                                                      length, title))
+        return len(self.clusters)
+
+def normalize(text):
+    '''
+        Returns text in lower case without accents or punctuation and with 
+        single spaces between its words, e.g. u'Am\xe9lie!' becomes u'amelie'.
+        Anything other than a string, such as a missing value, becomes u''.
+        '''
+    if not isinstance(text, basestring):
+        return u''
+    #only the text with accents needs to be decomposed, most of it is ascii
+    if nonAsciiRX.search(text) is not None:
+        text = unicodedata.normalize('NFKD', unicode(text))
+        text = u''.join([c for c in text if not unicodedata.combining(c)])
+    return u' '.join(punctuationRX.sub(u' ', text.lower()).split())
+
 #import data
-def get_clean_data():
+def get_clean_data(fileName="Desktop/imdb_data.txt", chunksize=100000, \
+                   reportName=DIRECTORY+'/film_duplicates.txt'):
     '''Returns a pandas data frame of the cleaned data. 
         The wrangling consists of 
-            1) Dropping duplicate entries.
+            1) Dropping duplicate entries. The raw data are read chunksize 
+                films at a time and each film is looked up in a DuplicateIndex,
+                so a film listed twice under two different imdb ids is dropped 
+                even if the two entries differ slightly. The clusters of 
+                duplicates are written to the file reportName.
 
             2) Dropping undesired genres of film such as Short, Documentary and
                 Adult (as the point of the analysis is to look at fiction 
@@ -37,6 +145,18 @@ def get_clean_data():
                 director
 
             5) Convert runtimes to log_10 runtimes
+        
+        Parameters
+        ----------
+        
+        fileName: string
+            the raw data written by the web scraper
+        
+        chunksize: integer
+            the number of films read at a time
+        
+        reportName: string
+            the file to which the clusters of duplicates are written
                 
         Returns
         -------
@@ -44,12 +164,19 @@ def get_clean_data():
         df: dataframe
             a pandas data frame containing the cleaned data
         '''
-    #import the data
-    df = pd.read_csv("Desktop/imdb_data.txt", sep='\t', encoding='utf-8')
-    #drop duplcate data. The film may have been imported twice by the web scrape
-    #or the film may be listed twice under two different imdb ids
-    df.drop_duplicates(subset=df.columns[1:], inplace=True)
-    df.drop(["title", "writer", "director"], axis=1, inplace=True)
+    #import the data, dropping duplcate data. The film may have been imported 
+    #twice by the web scrape or the film may be listed twice under two 
+    #different imdb ids
+    duplicates = DuplicateIndex()
+    df = pd.concat([chunk[duplicates.keep(chunk)] for chunk in \
+                    pd.read_csv(fileName, sep='\t', encoding='utf-8', \
+                                chunksize=chunksize)], ignore_index=True)
+    clusters = duplicates.report(reportName, df)
+    print '%d duplicates of %d films dropped, see %s' %(duplicates.seen - \
+        len(df), clusters, reportName)
+    #the imdb ids of the writers and directors are only in the newer data files
+    df.drop([column for column in ["title", "writer", "director", "writerId", \
+             "directorId"] if column in df.columns], axis=1, inplace=True)
     df = df[df["date"]<2015]
     #We only want fictitious feature films so drop other genres.
     #remove all reference to films with the following genres listed
@@ -88,7 +215,7 @@ def get_clean_data():
     df.drop([u'Wri/DirOverlap'], axis=1, inplace=True)
     
     #order the dataframe by date
-    df.sort(["date", "id"], inplace=True)
+    df.sort_values(["date", "id"], inplace=True)
     df.reset_index(drop=True, inplace=True)
     
     #Film runtime is obviously a positive number menaing that the distribution